@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, Ride, RideEvent
+from .models import User, Ride, RideEvent, ApiKey
 
 
 @admin.register(User)
@@ -57,3 +57,25 @@ class RideEventAdmin(admin.ModelAdmin):
     list_filter = ('created_at',)
     search_fields = ('description', 'id_ride__id_ride')
     readonly_fields = ('id_ride_event', 'created_at')
+
+
+@admin.register(ApiKey)
+class ApiKeyAdmin(admin.ModelAdmin):
+    """
+    Admin configuration for ApiKey model; keys are created with the
+    create_api_key command, since the key is only shown once
+    """
+    list_display = ('prefix', 'name', 'id_user', 'created_at', 'expires_at', 'revoked_at')
+    list_filter = ('revoked_at', 'created_at')
+    search_fields = ('prefix', 'name', 'id_user__email')
+    readonly_fields = ('prefix', 'id_user', 'created_at', 'revoked_at')
+    fields = ('prefix', 'name', 'id_user', 'created_at', 'expires_at', 'revoked_at')
+    actions = ['revoke']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Revoke selected API keys')
+    def revoke(self, request, queryset):
+        for api_key in queryset.filter(revoked_at__isnull=True):
+            api_key.revoke()
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class RidesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rides'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .geo import register_sqlite_functions
+        from .metrics import install_query_recorder
+
+        connection_created.connect(register_sqlite_functions)
+        connection_created.connect(install_query_recorder)
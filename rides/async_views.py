@@ -0,0 +1,149 @@
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views import View
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import exceptions
+from rest_framework.filters import OrderingFilter
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .filters import RideFilter, RideEventFilter
+from .models import Ride, RideEvent
+from .pagination import RidePagination, RideEventPagination
+from .permissions import IsAdminUser
+from .serializers import RideEventSerializer, RideRowSerializer, get_ride_fields
+from .views import order_by_distance
+
+
+class AsyncReadView(View):
+    """
+    Async read-only list/retrieve endpoint
+
+    DRF views are sync only, so this is a plain async Django view that
+    reuses the API's authenticators, permissions, filtersets and paginators.
+    Authentication and filtering (which may query the database) run in a
+    worker thread; the rows themselves are read with the async ORM, so under
+    ASGI a request waiting on the database does not hold a worker thread.
+    """
+    http_method_names = ['get', 'head', 'options']
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    permission_classes = [IsAdminUser]
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_class = None
+    ordering_fields = None
+    pagination_class = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request = await sync_to_async(self.initial)(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return self.handle_exception(request, exc)
+
+    async def get(self, request, pk=None):
+        if pk is None:
+            return self.render(await self.list(request))
+        return self.render(await self.retrieve(request, pk))
+
+    def initial(self, request):
+        """
+        Authenticate the request and check permissions, like APIView.initial
+        """
+        request = Request(request, authenticators=[auth() for auth in self.authentication_classes])
+        for permission in [permission() for permission in self.permission_classes]:
+            if not permission.has_permission(request, self):
+                if request.authenticators and not request.successful_authenticator:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied(getattr(permission, 'message', None))
+        return request
+
+    def filter_queryset(self, request, queryset):
+        for backend in self.filter_backends:
+            queryset = backend().filter_queryset(request, queryset, self)
+        return queryset
+
+    async def paginate(self, queryset, request, serialize):
+        """
+        Return the paginated response data for one page of queryset
+
+        serialize is an async callable turning the page's rows into data.
+        """
+        paginator = self.pagination_class()
+        page = await paginator.apaginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(await serialize(page)).data
+
+    def render(self, data, status=200):
+        return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+    def handle_exception(self, request, exc):
+        """
+        Error responses shaped like DRF's exception handler
+        """
+        if isinstance(exc.detail, (list, dict)):
+            data = exc.detail
+        else:
+            data = {'detail': exc.detail}
+        response = self.render(data, status=exc.status_code)
+
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            header = self.authentication_classes[0]().authenticate_header(request)
+            if header:
+                response['WWW-Authenticate'] = header
+            else:
+                response.status_code = exceptions.PermissionDenied.status_code
+        return response
+
+
+class AsyncRideView(AsyncReadView):
+    """
+    GET /api/v1/async/rides/ and /api/v1/async/rides/{id}/
+
+    Same filters, sorting, pagination, ?fields= and ?expand= as the rides
+    endpoints and the same output. Responses are not served from the
+    response cache and carry no ETag.
+    """
+    filterset_class = RideFilter
+    ordering_fields = ['pickup_time']
+    pagination_class = RidePagination
+
+    async def list(self, request):
+        fields = get_ride_fields(request.query_params)
+        queryset = order_by_distance(Ride.objects.all(), request.query_params)
+        queryset = await sync_to_async(self.filter_queryset)(request, queryset)
+        rows = queryset.values(*RideRowSerializer.get_values_fields(fields))
+        return await self.paginate(rows, request, lambda page: RideRowSerializer(page, fields=fields).adata())
+
+    async def retrieve(self, request, pk):
+        fields = get_ride_fields(request.query_params)
+        rows = Ride.objects.filter(pk=pk).values(*RideRowSerializer.get_values_fields(fields))
+        try:
+            row = await rows.aget()
+        except Ride.DoesNotExist:
+            raise exceptions.NotFound()
+        data = await RideRowSerializer([row], fields=fields).adata()
+        return data[0]
+
+
+class AsyncRideEventView(AsyncReadView):
+    """
+    GET /api/v1/async/ride-events/ and /api/v1/async/ride-events/{id}/
+    """
+    filterset_class = RideEventFilter
+    ordering_fields = RideEventSerializer.Meta.fields
+    pagination_class = RideEventPagination
+
+    async def list(self, request):
+        queryset = await sync_to_async(self.filter_queryset)(request, RideEvent.objects.all())
+        return await self.paginate(queryset, request, self.serialize)
+
+    async def retrieve(self, request, pk):
+        try:
+            event = await RideEvent.objects.aget(pk=pk)
+        except RideEvent.DoesNotExist:
+            raise exceptions.NotFound()
+        return RideEventSerializer(event).data
+
+    async def serialize(self, events):
+        # Plain model fields only, so serializing touches no database
+        return RideEventSerializer(events, many=True).data
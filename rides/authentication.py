@@ -0,0 +1,173 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import authentication, exceptions
+
+from .models import ApiKey
+
+
+class ApiKeyCache:
+    """
+    In-process LRU cache of verified API keys, with a time to live
+
+    Maps the key's hash to (user, api_key), so a cached request skips both
+    the database and any password hashing. Revocations and user changes
+    drop that user's keys here and record the user under a new generation
+    number in the Django cache (see rides.signals); other processes compare
+    that number at most every `generation_check_interval` seconds and drop
+    the recorded users' keys too, or everything if they missed some.
+
+    The generation only reaches other processes through a shared cache
+    backend. With the default LocMemCache they refuse a revoked key once
+    its entry's time to live ran out and it is verified again.
+    """
+    generation_key = 'rides:api_keys:generation'
+    invalidated_user_key = 'rides:api_keys:invalidated:{}'
+    generation_check_interval = 1.0
+    # Further behind than this a process clears its cache instead of replaying
+    max_replayed_generations = 100
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = None
+        self.generation_checked_at = 0.0
+
+    def get_max_size(self):
+        if self.max_size is not None:
+            return self.max_size
+        return getattr(settings, 'API_KEY_CACHE_SIZE', 10000)
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, 'API_KEY_CACHE_TTL', 60)
+
+    def get(self, key_hash):
+        now = time.monotonic()
+        self.check_generation(now)
+        with self.lock:
+            entry = self.entries.get(key_hash)
+            if entry is None:
+                return None
+            principal, expires = entry
+            if expires <= now:
+                del self.entries[key_hash]
+                return None
+            self.entries.move_to_end(key_hash)
+        return self.copy_principal(principal)
+
+    def set(self, key_hash, principal):
+        principal = self.copy_principal(principal)
+        with self.lock:
+            self.entries[key_hash] = (principal, time.monotonic() + self.get_ttl())
+            self.entries.move_to_end(key_hash)
+            while len(self.entries) > self.get_max_size():
+                self.entries.popitem(last=False)
+
+    @staticmethod
+    def copy_principal(principal):
+        # Requests may change their user, so none shares the cached instances
+        user, api_key = copy.copy(principal[0]), copy.copy(principal[1])
+        api_key.id_user = user
+        return user, api_key
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def drop_users(self, id_users):
+        with self.lock:
+            for key_hash in [key_hash for key_hash, ((user, _), _) in self.entries.items() if user.pk in id_users]:
+                del self.entries[key_hash]
+
+    def check_generation(self, now):
+        if now - self.generation_checked_at < self.generation_check_interval:
+            return
+        self.generation_checked_at = now
+        generation = cache.get(self.generation_key, 0)
+        if generation == self.generation:
+            return
+        missed = []
+        if self.generation is not None and 0 < generation - self.generation <= self.max_replayed_generations:
+            missed = [self.invalidated_user_key.format(g) for g in range(self.generation + 1, generation + 1)]
+        id_users = cache.get_many(missed)
+        if missed and len(id_users) == len(missed):
+            self.drop_users(set(id_users.values()))
+        else:
+            # Restarted generation, too far behind, or records expired or not yet written
+            self.clear()
+        self.generation = generation
+
+    def invalidate(self, id_user):
+        """
+        Drop the user's cached keys here and, through the generation, everywhere
+        """
+        self.drop_users({id_user})
+        try:
+            generation = cache.incr(self.generation_key)
+        except ValueError:
+            generation = 1
+            if not cache.add(self.generation_key, generation, timeout=None):
+                generation = cache.incr(self.generation_key)
+        # Entries are gone by themselves after their time to live anyway
+        cache.set(self.invalidated_user_key.format(generation), id_user, timeout=self.get_ttl())
+
+
+api_key_cache = ApiKeyCache()
+
+
+class ApiKeyAuthentication(authentication.BaseAuthentication):
+    """
+    Authenticate `Authorization: Api-Key <key>` requests
+
+    Verified keys are cached in api_key_cache, so repeat requests cost a
+    SHA-256 and a dictionary lookup.
+    """
+    keyword = 'Api-Key'
+
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid API key header.')
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid API key header.')
+        return self.authenticate_credentials(key)
+
+    def authenticate_credentials(self, key):
+        key_hash = ApiKey.hash_key(key)
+        principal = api_key_cache.get(key_hash)
+        if principal is None:
+            principal = self.verify(key)
+            api_key_cache.set(key_hash, principal)
+
+        user, api_key = principal
+        # Checked on every request, so expiry needs no cache invalidation
+        if api_key.expires_at is not None and api_key.expires_at <= timezone.now():
+            raise exceptions.AuthenticationFailed('API key expired.')
+        return principal
+
+    def verify(self, key):
+        prefix = key.split('.', 1)[0]
+        api_key = ApiKey.objects.select_related('id_user').filter(prefix=prefix).first()
+        if api_key is None or not api_key.matches(key):
+            raise exceptions.AuthenticationFailed('Invalid API key.')
+        if api_key.revoked_at is not None:
+            raise exceptions.AuthenticationFailed('API key revoked.')
+        if not api_key.id_user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return api_key.id_user, api_key
+
+    def authenticate_header(self, request):
+        return self.keyword
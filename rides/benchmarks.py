@@ -0,0 +1,195 @@
+import json
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from urllib.parse import quote
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import ApiKey, User, Ride, RideEvent
+
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'bench_baseline.json'
+
+# (name, method, path, body); {placeholders} are filled by scenario_context()
+SCENARIOS = [
+    ('rides-list', 'get', '/api/v1/rides/', None),
+    ('rides-list-page-5', 'get', '/api/v1/rides/?page=5', None),
+    ('rides-list-page-size-100', 'get', '/api/v1/rides/?page_size=100', None),
+    ('rides-list-status', 'get', '/api/v1/rides/?status=completed', None),
+    ('rides-list-rider-email', 'get', '/api/v1/rides/?rider_email=john', None),
+    ('rides-list-rider-email-exact', 'get',
+     '/api/v1/rides/?rider_email=john.doe@example.com&rider_email_match=exact', None),
+    ('rides-list-rider-email-prefix', 'get', '/api/v1/rides/?rider_email=jane&rider_email_match=prefix', None),
+    ('rides-list-radius', 'get', '/api/v1/rides/?lat=37.7749&lon=-122.4194&radius_km=1', None),
+    ('rides-list-bbox', 'get', '/api/v1/rides/?bbox=-122.43,37.76,-122.41,37.78', None),
+    ('rides-list-ordering', 'get', '/api/v1/rides/?ordering=-pickup_time', None),
+    ('rides-list-distance', 'get', '/api/v1/rides/?sort_by_distance=true&lat=37.7749&lon=-122.4194', None),
+    ('rides-list-combined', 'get',
+     '/api/v1/rides/?status=pickup&rider_email=example.com&ordering=pickup_time', None),
+    ('rides-list-cursor', 'get', '/api/v1/rides/?pagination=cursor', None),
+    ('rides-list-fields', 'get', '/api/v1/rides/?fields=id_ride,status,pickup_time', None),
+    ('rides-list-expand', 'get', '/api/v1/rides/?fields=id_ride&expand=rider,driver,events', None),
+    ('rides-detail', 'get', '/api/v1/rides/{ride}/', None),
+    ('rides-detail-fields', 'get', '/api/v1/rides/{ride}/?fields=id_ride,status', None),
+    ('rides-history', 'get', '/api/v1/rides/{ride}/history/', None),
+    ('rides-nearby', 'get', '/api/v1/rides/nearby/?lat=37.7749&lon=-122.4194&k=10', None),
+    ('rides-export-csv', 'get', '/api/v1/rides/export/?format=csv&lat=37.7749&lon=-122.4194&radius_km=0.2', None),
+    ('rides-distance-matrix', 'post', '/api/v1/rides/distance-matrix/', 'distance_matrix'),
+    ('rides-async-list', 'get', '/api/v1/async/rides/', None),
+    ('rides-async-list-distance', 'get',
+     '/api/v1/async/rides/?sort_by_distance=true&lat=37.7749&lon=-122.4194', None),
+    ('rides-async-detail', 'get', '/api/v1/async/rides/{ride}/', None),
+    ('users-list', 'get', '/api/v1/users/', None),
+    ('users-detail', 'get', '/api/v1/users/{user}/', None),
+    ('ride-events-list', 'get', '/api/v1/ride-events/', None),
+    ('ride-events-by-ride', 'get', '/api/v1/ride-events/?id_ride={ride}', None),
+    ('ride-events-by-type', 'get', '/api/v1/ride-events/?event_type=pickup,dropoff', None),
+    ('ride-events-created-after', 'get', '/api/v1/ride-events/?created_after={day_ago}', None),
+    ('ride-events-cursor', 'get', '/api/v1/ride-events/?pagination=cursor', None),
+    ('ride-events-detail', 'get', '/api/v1/ride-events/{event}/', None),
+    ('ride-events-async-list', 'get', '/api/v1/async/ride-events/', None),
+    ('reports-long-trips', 'get', '/api/v1/reports/long-trips/', None),
+    ('reports-driver-daily', 'get', '/api/v1/reports/driver-daily/', None),
+]
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def percentile(values, q):
+    """
+    Nearest-rank q-th percentile of values (q in 0..100)
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q / 100 * (len(ordered) - 1)))]
+
+
+def seed_rides(rides, seed=42):
+    """
+    Top the database up to `rides` sample rides with 4 events each
+
+    Riders and drivers grow with the ride count, as in a real dataset.
+    """
+    existing = Ride.objects.count()
+    if existing >= rides:
+        return
+    call_command(
+        'create_sample_data',
+        rides=rides - existing,
+        riders=max(5, rides // 20),
+        drivers=max(3, rides // 200),
+        events_per_ride=4,
+        seed=seed + existing,
+        stdout=StringIO(),
+    )
+
+
+def scenario_context():
+    ride_ids = list(Ride.objects.order_by('id_ride').values_list('id_ride', flat=True)[:50])
+    return {
+        'ride': ride_ids[0],
+        'user': User.objects.filter(role='rider').order_by('id_user').values_list('id_user', flat=True)[0],
+        'event': RideEvent.objects.order_by('id_ride_event').values_list('id_ride_event', flat=True)[0],
+        'day_ago': quote((timezone.now() - timedelta(days=1)).isoformat()),
+        'distance_matrix': {'origins': [[37.7749, -122.4194]] * 10, 'ride_ids': ride_ids},
+    }
+
+
+def run_scenarios(repeat=20, only=None):
+    """
+    Time every scenario; returns {name: {'queries', 'p50_ms', 'p99_ms'}}
+
+    Requests authenticate with an API key of the admin user. Each scenario
+    gets one untimed warm-up request, then `repeat` timed ones whose unique
+    _bench= parameter keeps them out of the response cache, so the numbers
+    are for building responses with warm count and event caches.
+    """
+    admin = User.objects.filter(role='admin').order_by('id_user').first()
+    _, key = ApiKey.generate(admin, name='bench_api')
+    client = Client(HTTP_AUTHORIZATION=f'Api-Key {key}')
+    context = scenario_context()
+
+    results = {}
+    for name, method, path, body in SCENARIOS:
+        if only and only not in name:
+            continue
+        path = path.format(**context)
+        data = context[body] if body else None
+        request(client, method, path, data)
+
+        timings = []
+        queries = 0
+        separator = '&' if '?' in path else '?'
+        for n in range(repeat):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = request(client, method, f'{path}{separator}_bench={n}', data)
+                timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise BenchmarkError(f'{name}: {method.upper()} {path} returned {response.status_code}')
+            queries = max(queries, len(captured))
+        results[name] = {
+            'queries': queries,
+            'p50_ms': round(percentile(timings, 50) * 1000, 2),
+            'p99_ms': round(percentile(timings, 99) * 1000, 2),
+        }
+    return results
+
+
+def request(client, method, path, data):
+    if method == 'post':
+        response = client.post(path, json.dumps(data), content_type='application/json')
+    else:
+        response = client.get(path)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def compare(results, baseline, latency_threshold=0.5, query_threshold=0, latency_slack_ms=2.0, latency=True):
+    """
+    Return one message per regression of results against baseline
+
+    A scenario regresses when it needs more than query_threshold queries
+    above its baseline, or (with latency) when its p50 or p99 exceeds the
+    baseline by more than latency_threshold (a fraction) plus
+    latency_slack_ms. Scenarios missing from the baseline are skipped.
+    """
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if current['queries'] > base['queries'] + query_threshold:
+            regressions.append(f'{name}: {current["queries"]} queries, baseline {base["queries"]}')
+        if not latency:
+            continue
+        for stat in ('p50_ms', 'p99_ms'):
+            limit = base[stat] * (1 + latency_threshold) + latency_slack_ms
+            if current[stat] > limit:
+                regressions.append(f'{name}: {stat} {current[stat]:.2f}, baseline {base[stat]:.2f}')
+    return regressions
+
+
+def load_baseline(path=BASELINE_PATH):
+    """
+    Return {ride count (as a string): {scenario: stats}}
+    """
+    try:
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(baseline, path=BASELINE_PATH):
+    with open(path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write('\n')
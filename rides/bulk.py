@@ -0,0 +1,96 @@
+from django.db import transaction
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .serializers import PrefetchedPrimaryKeyRelatedField
+from .signals import bulk_created
+
+
+class BulkCreateMixin:
+    """
+    Adds POST <list url>/bulk/ taking a list of objects
+
+    Items are validated one by one with bulk_serializer_class, but every
+    foreign key they reference is loaded up front with one query per
+    related model. Valid items are inserted with a single bulk_create in
+    one transaction and invalid ones are reported by their index.
+    """
+    bulk_serializer_class = None
+    bulk_max_items = 1000
+    bulk_batch_size = 500
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({'detail': 'Expected a list of objects.'})
+        if len(items) > self.bulk_max_items:
+            raise ValidationError({'detail': f'At most {self.bulk_max_items} objects per request.'})
+
+        context = self.get_serializer_context()
+        context['related_objects'] = self.resolve_related_objects(items)
+
+        model = self.bulk_serializer_class.Meta.model
+        valid, errors = [], []
+        for index, item in enumerate(items):
+            serializer = self.bulk_serializer_class(data=item, context=context)
+            if serializer.is_valid():
+                instance = model(**serializer.validated_data)
+                self.prepare_bulk_instance(instance)
+                valid.append((index, instance))
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+
+        created = []
+        if valid:
+            with transaction.atomic():
+                created = model.objects.bulk_create(
+                    [instance for _, instance in valid], batch_size=self.bulk_batch_size
+                )
+                bulk_created.send(sender=model, instances=created)
+
+        pk_name = model._meta.pk.name
+        if not errors:
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({
+            'created': [
+                {'index': index, pk_name: instance.pk}
+                for (index, _), instance in zip(valid, created)
+            ],
+            'errors': errors,
+        }, status=response_status)
+
+    def prepare_bulk_instance(self, instance):
+        """
+        Hook to fill in anything save() would have computed
+        """
+
+    def resolve_related_objects(self, items):
+        """
+        Return {model: {pk: obj}} for every foreign key referenced by items
+        """
+        fields = [
+            (name, field)
+            for name, field in self.bulk_serializer_class().fields.items()
+            if isinstance(field, PrefetchedPrimaryKeyRelatedField) and not field.read_only
+        ]
+        querysets, ids = {}, {}
+        for name, field in fields:
+            model = field.queryset.model
+            querysets.setdefault(model, field.queryset)
+            model_ids = ids.setdefault(model, set())
+            for item in items:
+                if not isinstance(item, dict):
+                    continue
+                try:
+                    model_ids.add(int(item.get(name)))
+                except (TypeError, ValueError):
+                    pass  # Reported by the item's own validation
+
+        return {model: querysets[model].in_bulk(ids[model]) for model in querysets}
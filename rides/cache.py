@@ -0,0 +1,385 @@
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .db_routers import pinned_to_primary
+
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    Versioned cache of serialized API responses
+
+    Every key embeds a generation number. Any write to a cached model bumps
+    the generation (see rides.signals), which orphans all earlier entries at
+    once instead of tracking which responses a write affected. Hit and miss
+    counters live in the cache too, so shared backends aggregate them
+    across processes.
+    """
+    prefix = 'rides:response'
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+
+    def get_timeout(self):
+        if self.timeout is not None:
+            return self.timeout
+        return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 60)
+
+    @property
+    def generation_key(self):
+        return f'{self.prefix}:generation'
+
+    def generation(self):
+        generation = cache.get(self.generation_key)
+        if generation is None:
+            cache.add(self.generation_key, 1, timeout=None)
+            generation = cache.get(self.generation_key, 1)
+        return generation
+
+    def bump_generation(self):
+        try:
+            cache.incr(self.generation_key)
+        except ValueError:
+            cache.add(self.generation_key, 2, timeout=None)
+
+    @staticmethod
+    def request_digest(request, **kwargs):
+        """
+        Hash of the request's host, URL kwargs and normalized query parameters
+        """
+        normalized = sorted(
+            (name, sorted(values)) for name, values in request.query_params.lists()
+        )
+        # Pagination links are absolute, so the host is part of the key
+        raw = repr((request.build_absolute_uri('/'), sorted(kwargs.items()), normalized))
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def make_key(self, namespace, request, **kwargs):
+        return f'{self.prefix}:{self.generation()}:{namespace}:{self.request_digest(request, **kwargs)}'
+
+    def get(self, key):
+        data = cache.get(key)
+        self._count('hits' if data is not None else 'misses')
+        return data
+
+    def set(self, key, data):
+        cache.set(key, data, self.get_timeout())
+
+    def _count(self, name):
+        counter_key = f'{self.prefix}:{name}'
+        try:
+            cache.incr(counter_key)
+        except ValueError:
+            cache.add(counter_key, 0, timeout=None)
+            cache.incr(counter_key)
+
+    def stats(self):
+        counters = cache.get_many([f'{self.prefix}:hits', f'{self.prefix}:misses'])
+        return {
+            'hits': counters.get(f'{self.prefix}:hits', 0),
+            'misses': counters.get(f'{self.prefix}:misses', 0),
+            'generation': self.generation(),
+        }
+
+
+response_cache = ResponseCache()
+
+
+class RecentEventCache:
+    """
+    Each ride's events from the last `window`, kept in the Django cache
+
+    Entries are (id_ride_event, description, event_type, created_at) tuples
+    per ride. RideEvent writes reload the ride's entry after commit (see
+    rides.signals), events that aged out of the window are dropped on read,
+    and rides missing from the cache are loaded with one query and stored,
+    including rides without recent events, so the cache fills with the rides
+    that are actually read. Server processes also warm it with the whole
+    window at startup, in a background thread (see start_warming).
+
+    Entries live for the window on shared backends. The per-process
+    LocMemCache never sees other processes' writes, so there they expire
+    after RESPONSE_CACHE_TIMEOUT seconds instead.
+    """
+    prefix = 'rides:recent_events'
+
+    def __init__(self, window=timedelta(hours=24)):
+        self.window = window
+        self._warmer = None
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        timeout = int(self.window.total_seconds())
+        if settings.CACHES['default']['BACKEND'].endswith('LocMemCache'):
+            return min(timeout, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 60))
+        return timeout
+
+    def key(self, id_ride):
+        return f'{self.prefix}:{id_ride}'
+
+    def load(self, ride_ids=None):
+        """
+        Query the window's events, grouped by ride in id order
+        """
+        from .models import RideEvent
+
+        events = RideEvent.objects.filter(created_at__gte=timezone.now() - self.window)
+        grouped = {}
+        if ride_ids is not None:
+            events = events.filter(id_ride__in=ride_ids)
+            grouped = {id_ride: [] for id_ride in ride_ids}
+        rows = events.order_by('id_ride_event').values_list(
+            'id_ride', 'id_ride_event', 'description', 'event_type', 'created_at'
+        )
+        for id_ride, *event in rows.iterator(chunk_size=5000):
+            grouped.setdefault(id_ride, []).append(tuple(event))
+        return grouped
+
+    def store(self, grouped):
+        cache.set_many({self.key(id_ride): events for id_ride, events in grouped.items()}, self.timeout)
+
+    def get_many(self, ride_ids, store=True):
+        """
+        Return {id_ride: [event, ...]} of the current window for ride_ids
+
+        store=False still reads the cache but does not add the rides it had
+        to load, for one-off scans such as exports. Contexts pinned to the
+        primary load every ride from the database.
+        """
+        ride_ids = list(dict.fromkeys(ride_ids))
+        if not ride_ids:
+            return {}
+        if pinned_to_primary():
+            return self.load(ride_ids)
+        cached = cache.get_many([self.key(id_ride) for id_ride in ride_ids])
+        events = {id_ride: cached[self.key(id_ride)] for id_ride in ride_ids if self.key(id_ride) in cached}
+        missing = [id_ride for id_ride in ride_ids if id_ride not in events]
+        self._count('hits', len(events))
+        if missing:
+            self._count('misses', len(missing))
+            loaded = self.load(missing)
+            if store:
+                self.store(loaded)
+            events.update(loaded)
+
+        cutoff = timezone.now() - self.window
+        return {
+            id_ride: [event for event in ride_events if event[3] >= cutoff]
+            for id_ride, ride_events in events.items()
+        }
+
+    def refresh(self, ride_ids):
+        ride_ids = set(ride_ids)
+        if ride_ids:
+            self.store(self.load(ride_ids))
+
+    def warm(self, batch_size=5000):
+        """
+        Store the events of every ride with events in the window, in batches
+        of rides
+        """
+        from .models import RideEvent
+
+        rows = RideEvent.objects.filter(created_at__gte=timezone.now() - self.window).order_by(
+            'id_ride', 'id_ride_event'
+        ).values_list('id_ride', 'id_ride_event', 'description', 'event_type', 'created_at')
+        grouped = {}
+        for id_ride, *event in rows.iterator(chunk_size=batch_size):
+            if id_ride not in grouped and len(grouped) >= batch_size:
+                self.store(grouped)
+                grouped = {}
+            grouped.setdefault(id_ride, []).append(tuple(event))
+        self.store(grouped)
+
+    def start_warming(self):
+        """
+        Warm the cache once in a daemon thread, off the request path
+        """
+        with self._lock:
+            if self._warmer is not None:
+                return
+            self._warmer = threading.Thread(target=self._warm, name='recent-event-cache', daemon=True)
+        self._warmer.start()
+
+    def _warm(self):
+        try:
+            self.warm()
+        except Exception:
+            logger.exception('Warming the recent event cache failed')
+        finally:
+            close_old_connections()
+
+    def _count(self, name, amount):
+        counter_key = f'{self.prefix}:{name}'
+        try:
+            cache.incr(counter_key, amount)
+        except ValueError:
+            cache.add(counter_key, 0, timeout=None)
+            cache.incr(counter_key, amount)
+
+    def stats(self):
+        counters = cache.get_many([f'{self.prefix}:hits', f'{self.prefix}:misses'])
+        return {
+            'hits': counters.get(f'{self.prefix}:hits', 0),
+            'misses': counters.get(f'{self.prefix}:misses', 0),
+        }
+
+
+recent_event_cache = RecentEventCache()
+
+
+class CachedReadMixin:
+    """
+    Serve list and retrieve from response_cache
+
+    Permission checks run in initial() before the handler, so cached
+    responses are only returned to requests that could have built them.
+    Requests pinned to the primary neither read nor fill the cache. The
+    validators a ConditionalGetMixin derived while building a response are
+    cached with it.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response('list', super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response('retrieve', super().retrieve, request, *args, **kwargs)
+
+    def _cached_response(self, action, handler, request, *args, **kwargs):
+        if pinned_to_primary():
+            response = handler(request, *args, **kwargs)
+            response['X-Cache'] = 'BYPASS'
+            return response
+
+        key = response_cache.make_key(f'{self.basename}:{action}', request, **kwargs)
+        cached = response_cache.get(key)
+        if cached is not None:
+            data, self.validators = cached
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response_cache.set(key, (response.data, getattr(self, 'validators', None)))
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class NotModified(Exception):
+    """
+    Raised with the 304 response once the validators match the request
+    """
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified support for list and retrieve
+
+    Validators come from the rows the response is built from, so they cost
+    no query and an unchanged filtered page keeps its ETag whatever else is
+    written. A list page's ETag hashes the request, the count it reports
+    and each row's id and modified_at; a detail's hashes the ride's
+    modified_at, which is also its Last-Modified. modified_at moves with
+    every ride save, event write and rider or driver edit (see
+    rides.signals). The current minute is folded into both, so events
+    leaving the 24 hour window still change them.
+
+    Requests whose If-None-Match / If-Modified-Since match get a 304, with
+    the validators, before anything is serialized; cached responses keep
+    the validators they were built with. List ETags are weak, as the
+    count_exact flag is left out of them, and lists send no Last-Modified,
+    since rides deleted from or leaving the filtered set leave no timestamp
+    behind.
+    Keyset (?pagination=cursor) pages are not validated.
+    """
+    modified_field = 'modified_at'
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        use_cursor = getattr(self.paginator, 'use_cursor', None)
+        if page is not None and self.action == 'list' and not (use_cursor and use_cursor(self.request)):
+            # Pages are model instances or values() rows
+            pk_name = queryset.model._meta.pk.attname
+            rows = [
+                (row[pk_name], row[self.modified_field]) if isinstance(row, dict)
+                else (row.pk, getattr(row, self.modified_field))
+                for row in page
+            ]
+            self.set_validators((self.paginator.page.paginator.count, rows), None)
+        return page
+
+    def get_object(self):
+        instance = super().get_object()
+        if self.action == 'retrieve':
+            modified = getattr(instance, self.modified_field)
+            self.set_validators((instance.pk, modified), modified)
+        return instance
+
+    def set_validators(self, state, last_modified):
+        """
+        Derive the validators from state and raise NotModified on a match
+        """
+        minute = timezone.now().replace(second=0, microsecond=0)
+        raw = repr((self.action, response_cache.request_digest(self.request, **self.kwargs), state, minute))
+        etag = quote_etag(hashlib.sha1(raw.encode()).hexdigest())
+        if last_modified is None:
+            # A page's count_exact flag flips once its count is cached
+            etag = f'W/{etag}'
+        else:
+            last_modified = int(max(last_modified, minute).timestamp())
+        self.validators = (etag, last_modified)
+        not_modified = self.get_not_modified_response(self.request)
+        if not_modified is not None:
+            raise NotModified(not_modified)
+
+    def get_not_modified_response(self, request):
+        etag, last_modified = self.validators
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            self.add_validator_headers(response)
+        return response
+
+    def add_validator_headers(self, response):
+        etag, last_modified = self.validators
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+
+    def _conditional_response(self, handler, request, *args, **kwargs):
+        self.validators = None
+        try:
+            response = handler(request, *args, **kwargs)
+        except NotModified as not_modified:
+            return not_modified.response
+        if response.status_code != status.HTTP_200_OK or self.validators is None:
+            return response
+        # Cache hits bring the validators of the response they were built as
+        not_modified = self.get_not_modified_response(request)
+        if not_modified is not None:
+            return not_modified
+        self.add_validator_headers(response)
+        return response
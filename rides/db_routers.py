@@ -0,0 +1,95 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class PinState:
+    """
+    Whether reads of the current request (or command) must use the primary
+    """
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_pin_state = ContextVar('rides_db_pin_state', default=None)
+
+
+def get_pin_state():
+    state = _pin_state.get()
+    if state is None:
+        # Outside a request, e.g. in a management command: pin for the
+        # rest of the context once it writes
+        state = PinState()
+        _pin_state.set(state)
+    return state
+
+
+def start_pin_state(pinned=False):
+    """
+    Begin a fresh pin state; returns (state, token) for end_pin_state
+    """
+    state = PinState(pinned)
+    return state, _pin_state.set(state)
+
+
+def end_pin_state(token):
+    _pin_state.reset(token)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+def pinned_to_primary():
+    """
+    Whether replicas are configured and the current context reads from the
+    primary to see its own writes
+
+    The response, count and recent event caches may have been filled from a
+    lagging replica, so such contexts bypass them.
+    """
+    return bool(replica_aliases()) and get_pin_state().pinned
+
+
+class ReplicaRouter:
+    """
+    Send reads of replica_models to a random replica, everything else
+    (writes included) to the primary
+
+    Reads stay on the primary once the current request has written to one
+    of those models (and, through ReplicaPinningMiddleware's cookie, for
+    REPLICA_PIN_SECONDS afterwards), and while a transaction is open on
+    the primary, so that code always reads its own writes. Without replicas
+    configured the router is a no-op.
+    """
+    replica_models = {
+        'rides.user', 'rides.ride', 'rides.rideevent', 'rides.rideduration', 'rides.driverdailystats',
+    }
+
+    def __init__(self):
+        self.replicas = replica_aliases()
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or model._meta.label_lower not in self.replica_models:
+            return None
+        if get_pin_state().pinned or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.label_lower in self.replica_models:
+            state = get_pin_state()
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,97 @@
+import csv
+import json
+from itertools import islice
+
+from rest_framework.renderers import BaseRenderer
+
+from .serializers import RideRowSerializer, UserSerializer
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline delimited JSON; successful exports stream past the renderer,
+    so it only ever renders error payloads
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode(self.charset) + b'\n'
+
+
+class CSVRenderer(NDJSONRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class Echo:
+    """
+    File-like object whose write() hands back the line for streaming
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_ride_rows(queryset, fields, chunk_size=2000):
+    """
+    Yield serialized rides, reading chunk_size rows at a time
+
+    Rows come from a server-side cursor and each chunk fetches its events
+    with a single query, so memory is bounded by the chunk size.
+    """
+    rows = queryset.values(*RideRowSerializer.get_values_fields(fields)).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        # Exports would otherwise fill the event cache with every ride
+        yield from RideRowSerializer(chunk, fields=fields, cache_events=False).data
+
+
+def buffered(lines, size=500):
+    """
+    Join lines into fewer, larger chunks for the response stream
+    """
+    lines = iter(lines)
+    while True:
+        chunk = ''.join(islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ndjson_lines(rides):
+    for ride in rides:
+        yield json.dumps(ride) + '\n'
+
+
+def csv_columns(fields):
+    """
+    CSV header for the selected ride fields; users are flattened into
+    dotted columns and events are kept as one JSON encoded column
+    """
+    columns = []
+    for name in fields:
+        if name in ('id_rider_data', 'id_driver_data'):
+            columns += [f'{name}.{field}' for field in UserSerializer.Meta.fields]
+        else:
+            columns.append(name)
+    return columns
+
+
+def csv_lines(rides, fields):
+    writer = csv.writer(Echo())
+    yield writer.writerow(csv_columns(fields))
+    for ride in rides:
+        row = []
+        for name in fields:
+            value = ride[name]
+            if name in ('id_rider_data', 'id_driver_data'):
+                row += [value[field] for field in UserSerializer.Meta.fields]
+            elif name == 'todays_ride_events':
+                row.append(json.dumps(value))
+            else:
+                row.append(value)
+        yield writer.writerow(row)
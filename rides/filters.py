@@ -1,21 +1,148 @@
+import math
+
 import django_filters
-from django.db.models import Q
-from .models import Ride
+from django.db.models import F, Value
+from django.db.models.functions import Lower
+from rest_framework.exceptions import ValidationError
+from .geo import Haversine, bounding_box, grid_cells_for_bbox
+from .models import User, Ride, RideEvent
+
+
+class FloatCSVFilter(django_filters.BaseCSVFilter, django_filters.NumberFilter):
+    """
+    Comma separated list of numbers, e.g. ?bbox=-122.5,37.7,-122.3,37.8
+    """
+
+
+# ?rider_email_match= modes and the lookup on lower(email) each one uses
+EMAIL_LOOKUPS = {
+    'exact': 'exact',
+    'prefix': 'startswith',
+    'substring': 'contains',
+}
 
 
 class RideFilter(django_filters.FilterSet):
     """
-    Filter for Ride model supporting status and rider email filtering
+    Filter for Ride model supporting status, rider email and location filtering
     """
     status = django_filters.CharFilter(field_name='status', lookup_expr='iexact')
     rider_email = django_filters.CharFilter(method='filter_rider_email')
-    
+    rider_email_match = django_filters.ChoiceFilter(
+        choices=[(mode, mode) for mode in EMAIL_LOOKUPS], method='filter_rider_email_match'
+    )
+    lat = django_filters.NumberFilter(method='filter_coordinate', min_value=-90, max_value=90)
+    lon = django_filters.NumberFilter(method='filter_coordinate', min_value=-180, max_value=180)
+    radius_km = django_filters.NumberFilter(method='filter_radius')
+    bbox = FloatCSVFilter(method='filter_bbox')
+
     class Meta:
         model = Ride
-        fields = ['status', 'rider_email']
-    
+        fields = ['status', 'rider_email', 'rider_email_match', 'lat', 'lon', 'radius_km', 'bbox']
+
+    # Above this many matching riders the ids are left to a subquery
+    max_rider_ids = 1000
+
     def filter_rider_email(self, queryset, name, value):
         """
-        Filter rides by rider's email address
+        Filter rides by rider's email address, case-insensitively
+
+        ?rider_email_match= picks exact, prefix or substring (the default).
+        Matching riders are looked up first through the lower(email)
+        indexes, then rides are filtered through the id_rider index.
+        """
+        mode = self.form.cleaned_data.get('rider_email_match') or 'substring'
+        riders = User.objects.annotate(email_lower=Lower('email')).filter(
+            **{f'email_lower__{EMAIL_LOOKUPS[mode]}': value.lower()}
+        ).values_list('id_user', flat=True)
+
+        rider_ids = list(riders[:self.max_rider_ids + 1])
+        if len(rider_ids) > self.max_rider_ids:
+            return queryset.filter(id_rider__in=riders)
+        return queryset.filter(id_rider__in=rider_ids)
+
+    def filter_rider_email_match(self, queryset, name, value):
+        """
+        Only read by filter_rider_email
+        """
+        return queryset
+
+    def filter_coordinate(self, queryset, name, value):
+        """
+        lat/lon only take effect together with radius_km or sort_by_distance
+        """
+        return queryset
+
+    def filter_radius(self, queryset, name, value):
+        """
+        Filter rides whose pickup is within radius_km of (lat, lon)
+        """
+        lat = self.form.cleaned_data.get('lat')
+        lon = self.form.cleaned_data.get('lon')
+        if lat is None or lon is None:
+            raise ValidationError({'radius_km': 'lat and lon are required with radius_km.'})
+        lat, lon, radius_km = float(lat), float(lon), float(value)
+        if not math.isfinite(radius_km) or radius_km <= 0:
+            raise ValidationError({'radius_km': 'Must be a positive number.'})
+
+        # The pickup_cell index narrows the rows to the circle's bounding
+        # box, then the exact distance is checked in the same query
+        queryset = self._within_bbox(queryset, *bounding_box(lat, lon, radius_km))
+        return queryset.alias(
+            radius_distance=Haversine(Value(lat), Value(lon), F('pickup_latitude'), F('pickup_longitude'))
+        ).filter(radius_distance__lte=radius_km)
+
+    def filter_bbox(self, queryset, name, value):
+        """
+        Filter rides whose pickup is inside bbox=min_lon,min_lat,max_lon,max_lat
+        """
+        if len(value) != 4:
+            raise ValidationError({'bbox': 'Expected min_lon,min_lat,max_lon,max_lat.'})
+        min_lon, min_lat, max_lon, max_lat = map(float, value)
+        if min_lat > max_lat or min_lon > max_lon:
+            raise ValidationError({'bbox': 'Minimum values must not exceed maximum values.'})
+
+        return self._within_bbox(queryset, min_lat, min_lon, max_lat, max_lon).filter(
+            pickup_latitude__range=(min_lat, max_lat),
+            pickup_longitude__range=(min_lon, max_lon),
+        )
+
+    def _within_bbox(self, queryset, min_lat, min_lon, max_lat, max_lon):
+        cells = grid_cells_for_bbox(min_lat, min_lon, max_lat, max_lon)
+        if cells is not None:
+            return queryset.filter(pickup_cell__in=cells)
+
+        # Too many cells to list, fall back to a plain coordinate range
+        queryset = queryset.filter(pickup_latitude__range=(min_lat, max_lat))
+        if min_lon >= -180.0 and max_lon <= 180.0:
+            queryset = queryset.filter(pickup_longitude__range=(min_lon, max_lon))
+        return queryset
+
+
+class RideEventFilter(django_filters.FilterSet):
+    """
+    Filter for RideEvent model by ride, event type and creation time
+
+    The filters line up with the (id_ride, event_type, created_at) index.
+    """
+    id_ride = django_filters.NumberFilter(field_name='id_ride')
+    event_type = django_filters.BaseCSVFilter(method='filter_event_type')
+    created_after = django_filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = django_filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='lt')
+
+    class Meta:
+        model = RideEvent
+        fields = ['id_ride', 'event_type', 'created_after', 'created_before']
+
+    def filter_event_type(self, queryset, name, value):
+        """
+        Filter by event_type=pickup,dropoff; names or numeric values
         """
-        return queryset.filter(id_rider__email__icontains=value)
+        event_types = set()
+        for item in value:
+            item = item.strip()
+            try:
+                event_types.add(RideEvent.EventType(int(item)) if item.isdigit() else RideEvent.EventType[item.upper()])
+            except (KeyError, ValueError):
+                raise ValidationError({'event_type': f'Unknown event type: {item}'})
+        return queryset.filter(event_type__in=event_types)
@@ -0,0 +1,168 @@
+import math
+from string import Formatter
+
+import numpy as np
+from django.db.models import FloatField, Func
+
+
+# Radius of Earth in kilometers
+EARTH_RADIUS_KM = 6371
+
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    """
+    Calculate the distance between two points on Earth using Haversine formula
+    Returns distance in kilometers
+    """
+    # Convert latitude and longitude from degrees to radians
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+
+    # Haversine formula
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    # Rounding can push a just past 1 for antipodal points, outside asin()'s
+    # domain; clamp like LEAST() in Haversine.formula. This is also SQLite's
+    # HAVERSINE function (see register_sqlite_functions)
+    c = 2 * math.asin(math.sqrt(min(1.0, a)))
+
+    return c * EARTH_RADIUS_KM
+
+
+def calculate_distances(lat1, lon1, lat2, lon2):
+    """
+    Vectorized calculate_distance over NumPy-broadcastable coordinate arrays
+    Returns an array of distances in kilometers
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    c = 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    return c * EARTH_RADIUS_KM
+
+
+def distance_matrix(origins, destinations):
+    """
+    Return the len(origins) x len(destinations) matrix of distances in km
+    between two sequences of (lat, lon) pairs
+    """
+    origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+    destinations = np.asarray(destinations, dtype=float).reshape(-1, 2)
+    return calculate_distances(
+        origins[:, 0:1], origins[:, 1:2],
+        destinations[:, 0], destinations[:, 1],
+    )
+
+
+class Haversine(Func):
+    """
+    Database-side Haversine distance in kilometers between two coordinates
+
+    SQLite calls the HAVERSINE function registered on each new connection
+    (see register_sqlite_functions); every other backend gets the formula
+    inlined from its built-in math functions.
+    """
+    function = 'HAVERSINE'
+    arity = 4
+    output_field = FloatField()
+
+    formula = (
+        '2 * {radius} * ASIN(LEAST(1.0, SQRT('
+        'POWER(SIN(RADIANS(({lat2}) - ({lat1})) / 2), 2) + '
+        'COS(RADIANS({lat1})) * COS(RADIANS({lat2})) * '
+        'POWER(SIN(RADIANS(({lon2}) - ({lon1})) / 2), 2)'
+        ')))'
+    )
+
+    def as_sql(self, compiler, connection, **extra_context):
+        compiled = {}
+        for name, expression in zip(('lat1', 'lon1', 'lat2', 'lon2'), self.get_source_expressions()):
+            compiled[name] = compiler.compile(expression)
+
+        # Arguments appear several times in the formula, so params are
+        # collected in placeholder order rather than argument order
+        sql_parts, params = [], []
+        for literal, field, _, _ in Formatter().parse(self.formula):
+            sql_parts.append(literal)
+            if field == 'radius':
+                sql_parts.append(str(EARTH_RADIUS_KM))
+            elif field:
+                arg_sql, arg_params = compiled[field]
+                sql_parts.append(arg_sql)
+                params.extend(arg_params)
+        return ''.join(sql_parts), params
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, **extra_context)
+
+
+def register_sqlite_functions(sender, connection, **kwargs):
+    """
+    Register HAVERSINE on new SQLite connections (connection_created receiver)
+    """
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(
+            'HAVERSINE', 4, calculate_distance, deterministic=True
+        )
+
+
+# Size of one spatial grid cell in degrees (~5.5 km of latitude)
+GRID_CELL_DEGREES = 0.05
+GRID_ROWS = int(round(180 / GRID_CELL_DEGREES))
+GRID_COLUMNS = int(round(360 / GRID_CELL_DEGREES))
+
+# Above this many cells a radius/bbox lookup filters on raw coordinates instead
+MAX_GRID_CELLS = 2500
+
+
+def _grid_row(lat):
+    return min(max(int(math.floor((lat + 90) / GRID_CELL_DEGREES)), 0), GRID_ROWS - 1)
+
+
+def _grid_column(lon):
+    return int(math.floor((lon + 180) / GRID_CELL_DEGREES)) % GRID_COLUMNS
+
+
+def grid_cell(lat, lon):
+    """
+    Return the fixed-grid cell number containing the given coordinate
+    """
+    return _grid_row(lat) * GRID_COLUMNS + _grid_column(lon)
+
+
+def grid_cells_for_bbox(min_lat, min_lon, max_lat, max_lon):
+    """
+    Return every grid cell overlapping the bounding box, or None when the box
+    covers more than MAX_GRID_CELLS cells
+    """
+    rows = range(_grid_row(min_lat), _grid_row(max_lat) + 1)
+    first_column = int(math.floor((min_lon + 180) / GRID_CELL_DEGREES))
+    last_column = int(math.floor((max_lon + 180) / GRID_CELL_DEGREES))
+    column_count = min(last_column - first_column + 1, GRID_COLUMNS)
+    if len(rows) * column_count > MAX_GRID_CELLS:
+        return None
+
+    # Columns wrap around so boxes crossing the antimeridian still match
+    columns = {(first_column + offset) % GRID_COLUMNS for offset in range(column_count)}
+    return [row * GRID_COLUMNS + column for row in rows for column in sorted(columns)]
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Return (min_lat, min_lon, max_lat, max_lon) enclosing a circle of radius_km
+    """
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = max(lat - lat_delta, -90.0)
+    max_lat = min(lat + lat_delta, 90.0)
+
+    # Near the poles every longitude is within reach
+    widest_lat = max(abs(min_lat), abs(max_lat))
+    if widest_lat >= 90.0:
+        return min_lat, -180.0, max_lat, 180.0
+    lon_delta = lat_delta / math.cos(math.radians(widest_lat))
+    if lon_delta >= 180.0:
+        return min_lat, -180.0, max_lat, 180.0
+    return min_lat, lon - lon_delta, max_lat, lon + lon_delta
@@ -0,0 +1,107 @@
+import re
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from rides.cache import recent_event_cache, response_cache
+from rides.models import RideEvent, ArchivedRideEvent
+
+
+AGE_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+
+def parse_age(value):
+    """
+    Parse an age like 30d, 12h or 2w into a timedelta
+    """
+    match = re.fullmatch(r'(\d+)([mhdw])', value.strip())
+    if match is None:
+        raise CommandError(f'Invalid age {value!r}; use e.g. 30d, 12h or 2w')
+    return timedelta(**{AGE_UNITS[match.group(2)]: int(match.group(1))})
+
+
+class Command(BaseCommand):
+    help = 'Move ride events older than --older-than into the ride_event_archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', default='30d', help='Age cutoff, e.g. 30d, 12h, 2w')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Events moved per transaction')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the events to archive')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - parse_age(options['older_than'])
+        old_events = RideEvent.objects.filter(created_at__lt=cutoff)
+        if options['dry_run']:
+            self.stdout.write(f'{old_events.count()} events created before {cutoff.isoformat()} would be archived')
+            return
+
+        # Cutoffs inside the recent events window also drop cached events
+        self.refresh_cache = cutoff > timezone.now() - recent_event_cache.window
+
+        started = time.monotonic()
+        archived = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            moved = self.archive_batch(old_events, options['batch_size'])
+            if not moved:
+                break
+            archived += moved
+            batches += 1
+            elapsed = max(time.monotonic() - started, 1e-9)
+            self.stdout.write(f'  {archived} events archived ({archived / elapsed:,.0f} events/s)')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {archived} events created before {cutoff.isoformat()}'
+        ))
+
+    def archive_batch(self, old_events, batch_size):
+        """
+        Copy one batch of the oldest events to the archive and delete them,
+        in one transaction so an event is always in exactly one table
+        """
+        with transaction.atomic():
+            events = list(
+                old_events.order_by('id_ride_event').select_for_update().values(
+                    'id_ride_event', 'id_ride', 'description', 'event_type', 'created_at'
+                )[:batch_size]
+            )
+            if not events:
+                return 0
+            ArchivedRideEvent.objects.bulk_create(
+                [
+                    ArchivedRideEvent(
+                        id_ride_event=event['id_ride_event'],
+                        id_ride_id=event['id_ride'],
+                        description=event['description'],
+                        event_type=event['event_type'],
+                        created_at=event['created_at'],
+                    )
+                    for event in events
+                ]
+            )
+            self.delete_events([event['id_ride_event'] for event in events])
+            # The signals that usually invalidate the caches do not run
+            transaction.on_commit(response_cache.bump_generation)
+            if self.refresh_cache:
+                ride_ids = {event['id_ride'] for event in events}
+                transaction.on_commit(lambda: recent_event_cache.refresh(ride_ids))
+        return len(events)
+
+    def delete_events(self, event_ids):
+        """
+        Delete the events with one plain DELETE
+
+        QuerySet.delete() would run the per-event post_delete receivers,
+        which recompute ride durations; archiving changes no duration.
+        """
+        connection = connections[router.db_for_write(RideEvent)]
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {quote_name(RideEvent._meta.db_table)} '
+                f'WHERE {quote_name(RideEvent._meta.pk.column)} IN ({", ".join(["%s"] * len(event_ids))})',
+                event_ids,
+            )
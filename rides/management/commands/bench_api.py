@@ -0,0 +1,88 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+from rides.benchmarks import (
+    BASELINE_PATH, BenchmarkError, compare, load_baseline, run_scenarios, save_baseline, seed_rides,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Time every read endpoint on generated data of each size and compare query counts '
+        'and p50/p99 latency with the committed baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000', help='Comma separated ride counts, e.g. 1000,100000,1000000')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per scenario')
+        parser.add_argument('--only', default=None, help='Only scenarios whose name contains this')
+        parser.add_argument('--baseline', default=str(BASELINE_PATH), help='Baseline JSON file')
+        parser.add_argument('--update-baseline', action='store_true', help='Store this run as the baseline')
+        parser.add_argument(
+            '--latency-threshold', type=float, default=0.5,
+            help='Allowed latency increase as a fraction of the baseline'
+        )
+        parser.add_argument('--latency-slack-ms', type=float, default=2.0, help='Allowed latency increase in ms')
+        parser.add_argument('--query-threshold', type=int, default=0, help='Allowed extra queries')
+        parser.add_argument('--no-latency', action='store_true', help='Only compare query counts')
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the benchmark database and its rides for the next run'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(','))
+        except ValueError:
+            raise CommandError('--sizes takes comma separated integers')
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+
+        # The data goes into a separate test database, never the configured one
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            baseline = load_baseline(options['baseline'])
+            regressions = []
+            for size in sizes:
+                regressions += self.bench(size, baseline, options)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        if options['update_baseline']:
+            save_baseline(baseline, options['baseline'])
+            self.stdout.write(f"Baseline written to {options['baseline']}")
+        elif regressions:
+            raise CommandError('Regressions:\n  ' + '\n  '.join(regressions))
+
+    def bench(self, size, baseline, options):
+        self.stdout.write(f'Seeding {size} rides...')
+        seed_rides(size)
+        cache.clear()
+        try:
+            results = run_scenarios(repeat=options['repeat'], only=options['only'])
+        except BenchmarkError as exc:
+            raise CommandError(str(exc))
+
+        base = baseline.get(str(size), {})
+        self.stdout.write(f'{size} rides{"" if base else " (no baseline)"}')
+        for name, stats in results.items():
+            line = f"  {name:<32} {stats['queries']:>3} queries  p50 {stats['p50_ms']:9.2f} ms  p99 {stats['p99_ms']:9.2f} ms"
+            if name in base:
+                line += f"  (baseline {base[name]['queries']}, {base[name]['p50_ms']:.2f}, {base[name]['p99_ms']:.2f})"
+            self.stdout.write(line)
+
+        if options['update_baseline']:
+            baseline.setdefault(str(size), {}).update(results)
+            return []
+        return compare(
+            results, base,
+            latency_threshold=options['latency_threshold'],
+            query_threshold=options['query_threshold'],
+            latency_slack_ms=options['latency_slack_ms'],
+            latency=not options['no_latency'],
+        )
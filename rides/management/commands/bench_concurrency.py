@@ -0,0 +1,106 @@
+import asyncio
+import itertools
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.benchmarks import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Load the sync (WSGI) and async (ASGI) ride endpoints with N concurrent connections '
+        'and compare throughput and latency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync-url', default='http://127.0.0.1:8000', help='Base URL of the WSGI server')
+        parser.add_argument('--async-url', default='http://127.0.0.1:8001', help='Base URL of the ASGI server')
+        parser.add_argument(
+            '--path', default='rides/?sort_by_distance=true&lat=37.7749&lon=-122.4194',
+            help='Endpoint below /api/v1/ (sync) and /api/v1/async/ (async)'
+        )
+        parser.add_argument('--concurrency', default='50,200,1000', help='Comma separated connection counts')
+        parser.add_argument('--requests-per-connection', type=int, default=5)
+        parser.add_argument('--api-key', required=True, help='Key of an admin user (see create_api_key)')
+        parser.add_argument('--timeout', type=float, default=60, help='Seconds before a request counts as failed')
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency takes comma separated integers')
+        targets = [
+            ('sync', f"{options['sync_url'].rstrip('/')}/api/v1/{options['path']}"),
+            ('async', f"{options['async_url'].rstrip('/')}/api/v1/async/{options['path']}"),
+        ]
+        for name, url in targets:
+            if urlsplit(url).scheme != 'http':
+                raise CommandError(f'Only http:// URLs are supported, got {url}')
+
+        headers = f"Authorization: Api-Key {options['api_key']}\r\n"
+        for concurrency in levels:
+            for name, url in targets:
+                latencies, errors, elapsed = asyncio.run(self.load(
+                    url, concurrency, options['requests_per_connection'], headers, options['timeout']
+                ))
+                self.report(concurrency, name, latencies, errors, elapsed)
+
+    async def load(self, url, concurrency, per_connection, headers, timeout):
+        """
+        Run `concurrency` clients issuing per_connection requests each
+
+        Every request gets a unique _bench= parameter so that neither path
+        answers from the response cache.
+        """
+        latencies = []
+        errors = 0
+        counter = itertools.count()
+        separator = '&' if '?' in url else '?'
+
+        async def client():
+            nonlocal errors
+            for _ in range(per_connection):
+                started = time.perf_counter()
+                try:
+                    status = await self.fetch(f'{url}{separator}_bench={next(counter)}', headers, timeout)
+                except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+                    status = None
+                if status == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - started
+
+    async def fetch(self, url, headers, timeout):
+        """
+        GET url over a fresh HTTP/1.1 connection; returns the status code
+        """
+        parts = urlsplit(url)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, parts.port or 80), timeout
+        )
+        try:
+            target = f'{parts.path}?{parts.query}' if parts.query else parts.path
+            writer.write(
+                f'GET {target} HTTP/1.1\r\nHost: {parts.netloc}\r\n{headers}Connection: close\r\n\r\n'.encode()
+            )
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), timeout)
+            return int(response.split(b' ', 2)[1])
+        finally:
+            writer.close()
+
+    def report(self, concurrency, name, latencies, errors, elapsed):
+        line = f'{concurrency:>5} connections  {name:<5}  {len(latencies):>6} ok  {errors:>5} failed'
+        if latencies:
+            line += (
+                f'  {len(latencies) / elapsed:8.1f} req/s'
+                f'  p50 {percentile(latencies, 50) * 1000:8.1f} ms'
+                f'  p99 {percentile(latencies, 99) * 1000:8.1f} ms'
+            )
+        self.stdout.write(line)
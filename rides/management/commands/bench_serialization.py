@@ -0,0 +1,92 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from rides.models import User, Ride, RideEvent
+from rides.serializers import RideSerializer, RideRowSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare RideSerializer with RideRowSerializer on generated rides'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='20,500,5000', help='Comma separated ride counts')
+        parser.add_argument('--events-per-ride', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=3, help='Best of N runs per size')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+
+        # Everything is generated inside a transaction that is rolled back
+        try:
+            with transaction.atomic():
+                self.seed(max(sizes), options['events_per_ride'])
+                for size in sizes:
+                    self.bench(size, options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, count, events_per_ride):
+        rider = User.objects.create(
+            username='bench.rider', email='bench.rider@example.com',
+            first_name='Bench', last_name='Rider', role='rider',
+        )
+        driver = User.objects.create(
+            username='bench.driver', email='bench.driver@example.com',
+            first_name='Bench', last_name='Driver', role='driver',
+        )
+        now = timezone.now()
+        Ride.objects.bulk_create(
+            Ride(
+                status='completed', id_rider=rider, id_driver=driver,
+                pickup_latitude=37.7749, pickup_longitude=-122.4194,
+                dropoff_latitude=37.7849, dropoff_longitude=-122.4094,
+                pickup_time=now - timedelta(minutes=i),
+            )
+            for i in range(count)
+        )
+        self.ride_ids = list(
+            Ride.objects.filter(id_rider=rider).order_by('id_ride').values_list('id_ride', flat=True)
+        )
+        RideEvent.objects.bulk_create(
+            RideEvent(id_ride_id=id_ride, description=f'Event {i}')
+            for id_ride in self.ride_ids
+            for i in range(events_per_ride)
+        )
+
+    def bench(self, size, repeat):
+        ride_ids = self.ride_ids[:size]
+        queryset = Ride.objects.filter(id_ride__in=ride_ids).select_related(
+            'id_rider', 'id_driver'
+        ).prefetch_related(
+            Prefetch(
+                'ride_events',
+                queryset=RideEvent.objects.filter(created_at__gte=timezone.now() - timedelta(hours=24)),
+                to_attr='recent_events'
+            )
+        )
+        rows = queryset.prefetch_related(None).values(*RideRowSerializer.values_fields)
+
+        model_time = self.best_of(repeat, lambda: RideSerializer(queryset.all(), many=True).data)
+        row_time = self.best_of(repeat, lambda: RideRowSerializer(rows.all()).data)
+        self.stdout.write(
+            f'{size:>6} rides  RideSerializer {model_time * 1000:9.1f} ms  '
+            f'RideRowSerializer {row_time * 1000:9.1f} ms  speedup {model_time / row_time:5.1f}x'
+        )
+
+    def best_of(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
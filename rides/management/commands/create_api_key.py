@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from rides.models import User, ApiKey
+
+
+class Command(BaseCommand):
+    help = 'Create an API key for a user and print it (it is not stored)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the user the key acts as')
+        parser.add_argument('--name', default='', help='What the key is for')
+        parser.add_argument('--expires-in-days', type=int, default=None, help='Default: never expires')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options['email']).first()
+        if user is None:
+            raise CommandError(f"No user with email {options['email']}")
+        expires_at = None
+        if options['expires_in_days'] is not None:
+            expires_at = timezone.now() + timedelta(days=options['expires_in_days'])
+
+        api_key, key = ApiKey.generate(user, name=options['name'], expires_at=expires_at)
+        self.stdout.write(f'Created API key {api_key.prefix} for {user.email}; store it now, it is not shown again:')
+        self.stdout.write(key)
@@ -1,16 +1,127 @@
+from django.contrib.auth.hashers import make_password
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
+from itertools import islice
+import multiprocessing
 import random
+import time
 from rides.models import User, Ride, RideEvent
+from rides.signals import bulk_created
+
+
+# San Francisco Bay Area coordinates for realistic data
+PICKUP_LOCATIONS = [
+    (37.7749, -122.4194),  # San Francisco
+    (37.4419, -122.1430),  # Palo Alto
+    (37.6879, -122.4702),  # San Mateo
+    (37.5407, -122.2959),  # Redwood City
+    (37.3861, -122.0839),  # Mountain View
+]
+
+DROPOFF_LOCATIONS = [
+    (37.7849, -122.4094),  # SF Downtown
+    (37.4519, -122.1330),  # Stanford
+    (37.6979, -122.4802),  # San Mateo Downtown
+    (37.5507, -122.2859),  # Redwood City Downtown
+    (37.3961, -122.0739),  # Mountain View Downtown
+]
+
+EVENT_DESCRIPTIONS = [
+    'Ride requested',
+    'Driver assigned',
+    'Driver en route to pickup',
+    'Status changed to pickup',
+    'Passenger picked up',
+    'Status changed to dropoff',
+    'Passenger dropped off',
+    'Ride completed',
+]
+
+STATUSES = ['en-route', 'pickup', 'dropoff', 'completed']
+
+NAMED_DRIVERS = [
+    ('Chris', 'H', 'chris.h@wingz.com'),
+    ('Howard', 'Y', 'howard.y@wingz.com'),
+    ('Randy', 'W', 'randy.w@wingz.com'),
+]
+
+NAMED_RIDERS = [
+    ('John', 'Doe', 'john.doe@example.com'),
+    ('Jane', 'Smith', 'jane.smith@example.com'),
+    ('Bob', 'Johnson', 'bob.johnson@example.com'),
+    ('Alice', 'Williams', 'alice.williams@example.com'),
+    ('Charlie', 'Brown', 'charlie.brown@example.com'),
+]
+
+
+def generate_chunk(chunk_index, chunk_size, seed, rider_ids, driver_ids, events_per_ride, now):
+    """
+    Generate chunk_size rides as plain tuples
+
+    Each chunk has its own random generator derived from the seed, so the
+    output is the same whether chunks are generated in this process or in
+    a pool of workers. Returns [(ride fields, [(description, created_at)])].
+    """
+    rng = random.Random(None if seed is None else f'{seed}:{chunk_index}')
+    rows = []
+    for _ in range(chunk_size):
+        pickup_lat, pickup_lon = rng.choice(PICKUP_LOCATIONS)
+        dropoff_lat, dropoff_lon = rng.choice(DROPOFF_LOCATIONS)
+
+        # Random pickup time in the last 30 days
+        pickup_time = now - timedelta(
+            days=rng.randint(0, 30),
+            hours=rng.randint(0, 23),
+            minutes=rng.randint(0, 59)
+        )
+        ride = (
+            rng.choice(STATUSES),
+            rng.choice(rider_ids),
+            rng.choice(driver_ids),
+            # Add some random variation to coordinates
+            pickup_lat + rng.uniform(-0.01, 0.01),
+            pickup_lon + rng.uniform(-0.01, 0.01),
+            dropoff_lat + rng.uniform(-0.01, 0.01),
+            dropoff_lon + rng.uniform(-0.01, 0.01),
+            pickup_time,
+        )
+
+        events = []
+        num_events = events_per_ride if events_per_ride is not None else rng.randint(3, 8)
+        for j in range(num_events):
+            event_time = pickup_time + timedelta(minutes=j * rng.randint(2, 15))
+
+            # Make sure event_time is not in the future
+            if event_time > now:
+                event_time = now - timedelta(minutes=rng.randint(1, 60))
+            events.append((EVENT_DESCRIPTIONS[min(j, len(EVENT_DESCRIPTIONS) - 1)], event_time))
+        rows.append((ride, events))
+    return rows
 
 
 class Command(BaseCommand):
     help = 'Create sample data for testing the API'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--rides', type=int, default=50, help='Number of rides to create')
+        parser.add_argument('--riders', type=int, default=len(NAMED_RIDERS), help='Number of riders')
+        parser.add_argument('--drivers', type=int, default=len(NAMED_DRIVERS), help='Number of drivers')
+        parser.add_argument(
+            '--events-per-ride', type=int, default=None,
+            help='Events per ride (default: random 3-8)'
+        )
+        parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible data')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rides per bulk_create batch')
+        parser.add_argument(
+            '--workers', type=int, default=0,
+            help='Generator processes (default: generate in this process)'
+        )
+
     def handle(self, *args, **options):
         self.stdout.write('Creating sample data...')
-        
+
         # Create admin user
         admin_user, created = User.objects.get_or_create(
             email='admin@wingz.com',
@@ -27,138 +138,126 @@ class Command(BaseCommand):
             admin_user.set_password('admin123')
             admin_user.save()
             self.stdout.write('Created admin user')
-        
-        # Create drivers
-        drivers = []
-        driver_data = [
-            ('Chris', 'H', 'chris.h@wingz.com'),
-            ('Howard', 'Y', 'howard.y@wingz.com'),
-            ('Randy', 'W', 'randy.w@wingz.com'),
-        ]
-        
-        for first, last, email in driver_data:
-            driver, created = User.objects.get_or_create(
-                email=email,
-                defaults={
-                    'username': email.split('@')[0],
-                    'first_name': first,
-                    'last_name': last,
-                    'role': 'driver',
-                    'phone_number': f'+1-555-{random.randint(1000, 9999)}',
-                }
-            )
-            if created:
-                driver.set_password('driver123')
-                driver.save()
-            drivers.append(driver)
-        
-        # Create riders
-        riders = []
-        rider_data = [
-            ('John', 'Doe', 'john.doe@example.com'),
-            ('Jane', 'Smith', 'jane.smith@example.com'),
-            ('Bob', 'Johnson', 'bob.johnson@example.com'),
-            ('Alice', 'Williams', 'alice.williams@example.com'),
-            ('Charlie', 'Brown', 'charlie.brown@example.com'),
-        ]
-        
-        for first, last, email in rider_data:
-            rider, created = User.objects.get_or_create(
-                email=email,
-                defaults={
-                    'username': email.split('@')[0],
-                    'first_name': first,
-                    'last_name': last,
-                    'role': 'rider',
-                    'phone_number': f'+1-555-{random.randint(1000, 9999)}',
-                }
+
+        rng = random.Random(options['seed'])
+        driver_ids = self.create_users('driver', NAMED_DRIVERS, options['drivers'], 'wingz.com', rng)
+        rider_ids = self.create_users('rider', NAMED_RIDERS, options['riders'], 'example.com', rng)
+
+        self.create_rides(options, rider_ids, driver_ids)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully created sample data:\n'
+                f'- {User.objects.count()} users\n'
+                f'- {Ride.objects.count()} rides\n'
+                f'- {RideEvent.objects.count()} ride events\n'
+                f'\nAdmin credentials: admin@wingz.com / admin123'
             )
-            if created:
-                rider.set_password('rider123')
-                rider.save()
-            riders.append(rider)
-        
-        # Create sample rides
-        statuses = ['en-route', 'pickup', 'dropoff', 'completed']
-        
-        # San Francisco Bay Area coordinates for realistic data
-        pickup_locations = [
-            (37.7749, -122.4194),  # San Francisco
-            (37.4419, -122.1430),  # Palo Alto
-            (37.6879, -122.4702),  # San Mateo
-            (37.5407, -122.2959),  # Redwood City
-            (37.3861, -122.0839),  # Mountain View
+        )
+
+    def create_users(self, role, named, count, domain, rng):
+        """
+        Make sure `count` users with the role exist and return their ids
+
+        The first users are the named ones; any beyond that are numbered.
+        Passwords are hashed once per role rather than once per user.
+        """
+        people = list(named[:count])
+        people += [
+            (role.capitalize(), str(n), f'{role}{n}@{domain}')
+            for n in range(len(people) + 1, count + 1)
         ]
-        
-        dropoff_locations = [
-            (37.7849, -122.4094),  # SF Downtown
-            (37.4519, -122.1330),  # Stanford
-            (37.6979, -122.4802),  # San Mateo Downtown
-            (37.5507, -122.2859),  # Redwood City Downtown
-            (37.3961, -122.0739),  # Mountain View Downtown
+        emails = [email for _, _, email in people]
+        existing = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+
+        password = make_password(f'{role}123')
+        User.objects.bulk_create(
+            (
+                User(
+                    username=email.split('@')[0],
+                    first_name=first,
+                    last_name=last,
+                    email=email,
+                    role=role,
+                    phone_number=f'+1-555-{rng.randint(1000, 9999)}',
+                    password=password,
+                )
+                for first, last, email in people
+                if email not in existing
+            ),
+            batch_size=5000,
+        )
+        return list(User.objects.filter(email__in=emails).values_list('id_user', flat=True))
+
+    def create_rides(self, options, rider_ids, driver_ids):
+        total, batch_size = options['rides'], options['batch_size']
+        chunks = [
+            (index, min(batch_size, total - start))
+            for index, start in enumerate(range(0, total, batch_size))
         ]
-        
-        for i in range(50):
-            pickup_lat, pickup_lon = random.choice(pickup_locations)
-            dropoff_lat, dropoff_lon = random.choice(dropoff_locations)
-            
-            # Add some random variation to coordinates
-            pickup_lat += random.uniform(-0.01, 0.01)
-            pickup_lon += random.uniform(-0.01, 0.01)
-            dropoff_lat += random.uniform(-0.01, 0.01)
-            dropoff_lon += random.uniform(-0.01, 0.01)
-            
-            # Random pickup time in the last 30 days
-            pickup_time = timezone.now() - timedelta(
-                days=random.randint(0, 30),
-                hours=random.randint(0, 23),
-                minutes=random.randint(0, 59)
+        args = (options['seed'], rider_ids, driver_ids, options['events_per_ride'], timezone.now())
+
+        started = time.monotonic()
+        written_rides = written_events = 0
+        for rows in self.generate(chunks, args, options['workers']):
+            rides_written, events_written = self.write_chunk(rows)
+            written_rides += rides_written
+            written_events += events_written
+
+            elapsed = max(time.monotonic() - started, 1e-9)
+            self.stdout.write(
+                f'  {written_rides}/{total} rides, {written_events} events '
+                f'({written_rides / elapsed:,.0f} rides/s)'
             )
-            
-            ride = Ride.objects.create(
-                status=random.choice(statuses),
-                id_rider=random.choice(riders),
-                id_driver=random.choice(drivers),
+
+    def generate(self, chunks, args, workers):
+        """
+        Yield generated chunks in order, at most 2 * workers ahead of the writer
+        """
+        if workers <= 0:
+            for index, size in chunks:
+                yield generate_chunk(index, size, *args)
+            return
+
+        with multiprocessing.Pool(workers) as pool:
+            pending = []
+            chunks = iter(chunks)
+            for index, size in islice(chunks, 2 * workers):
+                pending.append(pool.apply_async(generate_chunk, (index, size, *args)))
+            while pending:
+                rows = pending.pop(0).get()
+                for index, size in islice(chunks, 1):
+                    pending.append(pool.apply_async(generate_chunk, (index, size, *args)))
+                yield rows
+
+    def write_chunk(self, rows):
+        rides = []
+        for (status, rider_id, driver_id, pickup_lat, pickup_lon,
+             dropoff_lat, dropoff_lon, pickup_time), _ in rows:
+            ride = Ride(
+                status=status,
+                id_rider_id=rider_id,
+                id_driver_id=driver_id,
                 pickup_latitude=pickup_lat,
                 pickup_longitude=pickup_lon,
                 dropoff_latitude=dropoff_lat,
                 dropoff_longitude=dropoff_lon,
                 pickup_time=pickup_time,
             )
-            
-            # Create some ride events
-            event_descriptions = [
-                'Ride requested',
-                'Driver assigned',
-                'Driver en route to pickup',
-                'Status changed to pickup',
-                'Passenger picked up',
-                'Status changed to dropoff',
-                'Passenger dropped off',
-                'Ride completed',
-            ]
-            
-            # Create 3-8 events per ride
-            num_events = random.randint(3, 8)
-            for j in range(num_events):
-                event_time = pickup_time + timedelta(minutes=j * random.randint(2, 15))
-                
-                # Make sure event_time is not in the future
-                if event_time > timezone.now():
-                    event_time = timezone.now() - timedelta(minutes=random.randint(1, 60))
-                
-                RideEvent.objects.create(
-                    id_ride=ride,
-                    description=event_descriptions[min(j, len(event_descriptions) - 1)],
-                    created_at=event_time,
+            ride.set_pickup_cell()
+            rides.append(ride)
+
+        with transaction.atomic():
+            rides = Ride.objects.bulk_create(rides)
+            events = [
+                RideEvent(
+                    id_ride_id=ride.id_ride, description=description,
+                    event_type=RideEvent.classify(description), created_at=created_at,
                 )
-        
-        self.stdout.write(
-            self.style.SUCCESS(
-                f'Successfully created sample data:\n'
-                f'- {User.objects.count()} users\n'
-                f'- {Ride.objects.count()} rides\n'
-                f'- {RideEvent.objects.count()} ride events\n'
-                f'\nAdmin credentials: admin@wingz.com / admin123'
-            )
-        )
+                for ride, (_, ride_events) in zip(rides, rows)
+                for description, created_at in ride_events
+            ]
+            events = RideEvent.objects.bulk_create(events)
+            bulk_created.send(sender=Ride, instances=rides)
+            bulk_created.send(sender=RideEvent, instances=events)
+        return len(rides), len(events)
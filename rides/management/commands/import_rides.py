@@ -0,0 +1,237 @@
+import csv
+import json
+import math
+import mmap
+import os
+import time
+from datetime import timezone as dt_timezone
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from rides.models import User, Ride, RideEvent, ImportCheckpoint
+from rides.signals import bulk_created
+
+
+RIDE_STATUSES = {value for value, _ in Ride.STATUS_CHOICES}
+# Coordinate columns and the largest absolute value each may take
+FLOAT_FIELDS = {'pickup_latitude': 90, 'pickup_longitude': 180, 'dropoff_latitude': 90, 'dropoff_longitude': 180}
+
+
+class RowError(Exception):
+    pass
+
+
+def read_lines(path, use_mmap=False, offset=0):
+    """
+    Lazily yield (line, end offset) pairs starting at byte offset
+    """
+    with open(path, 'rb') as file:
+        if use_mmap and os.path.getsize(path) > 0:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                mapped.seek(offset)
+                for line in iter(mapped.readline, b''):
+                    yield line, mapped.tell()
+            return
+        file.seek(offset)
+        for line in file:
+            offset += len(line)
+            yield line, offset
+
+
+def lookup(row, *keys):
+    """
+    Return the first present value among keys; dotted keys also look
+    inside nested objects, so both export formats can be imported
+    """
+    for key in keys:
+        if key in row:
+            return row[key]
+        head, _, tail = key.partition('.')
+        if tail and isinstance(row.get(head), dict) and tail in row[head]:
+            return row[head][tail]
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Import rides and their events from an NDJSON or CSV file'
+    # Emails whose user id is kept between batches
+    max_cached_users = 500000
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON or CSV file, one ride per line')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], help='Default: from the file extension')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per transaction')
+        parser.add_argument('--mmap', action='store_true', help='Read the file through mmap')
+        parser.add_argument('--restart', action='store_true', help='Ignore any saved checkpoint')
+        parser.add_argument('--max-errors', type=int, default=1000, help='Abort after this many bad rows')
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['path'])
+        if not os.path.exists(path):
+            raise CommandError(f'No such file: {path}')
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        self.max_errors = options['max_errors']
+        self.errors = 0
+        self.user_ids = {}
+
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(source=path)
+        if options['restart']:
+            checkpoint.offset, checkpoint.rows = 0, 0
+            checkpoint.save()
+        if checkpoint.offset > os.path.getsize(path):
+            raise CommandError('Checkpoint is beyond the end of the file; use --restart')
+        if checkpoint.offset:
+            self.stdout.write(f'Resuming after row {checkpoint.rows} (byte {checkpoint.offset})')
+
+        self.header = None
+        if file_format == 'csv':
+            with open(path, 'rb') as file:
+                first_line = file.readline()
+            self.header = next(csv.reader([first_line.decode('utf-8')]), [])
+            checkpoint.offset = max(checkpoint.offset, len(first_line))
+        lines = read_lines(path, options['mmap'], checkpoint.offset)
+
+        started = time.monotonic()
+        imported = 0
+        while True:
+            batch = list(islice(lines, options['batch_size']))
+            if not batch:
+                break
+            rides, events = self.build_batch(batch, checkpoint.rows)
+            with transaction.atomic():
+                rides = Ride.objects.bulk_create(rides)
+                ride_events = [
+                    RideEvent(
+                        id_ride_id=ride.id_ride, description=description,
+                        event_type=RideEvent.classify(description), created_at=created_at,
+                    )
+                    for ride, ride_event_rows in zip(rides, events)
+                    for description, created_at in ride_event_rows
+                ]
+                ride_events = RideEvent.objects.bulk_create(ride_events)
+
+                checkpoint.offset = batch[-1][1]
+                checkpoint.rows += len(batch)
+                checkpoint.save(update_fields=['offset', 'rows', 'updated_at'])
+
+                bulk_created.send(sender=Ride, instances=rides)
+                bulk_created.send(sender=RideEvent, instances=ride_events)
+
+            imported += len(rides)
+            elapsed = max(time.monotonic() - started, 1e-9)
+            self.stdout.write(
+                f'  {checkpoint.rows} rows read, {imported} rides imported, '
+                f'{self.errors} rejected ({imported / elapsed:,.0f} rows/s)'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} rides from {path} ({self.errors} rows rejected)'
+        ))
+
+    def build_batch(self, batch, first_row):
+        """
+        Parse and validate a batch of lines into unsaved rides and events
+        """
+        parsed = []
+        for number, (line, _) in enumerate(batch, start=first_row + 1):
+            if not line.strip():
+                continue
+            try:
+                parsed.append((number, self.parse_line(line)))
+            except (RowError, ValueError, KeyError, TypeError, ValidationError) as error:
+                self.reject(number, error)
+
+        self.resolve_users(
+            {email for _, row in parsed for email in (row['rider_email'], row['driver_email'])}
+        )
+
+        rides, events = [], []
+        for number, row in parsed:
+            rider_id = self.user_ids.get(row['rider_email'])
+            driver_id = self.user_ids.get(row['driver_email'])
+            if rider_id is None or driver_id is None:
+                missing = row['rider_email'] if rider_id is None else row['driver_email']
+                self.reject(number, f'Unknown user {missing}')
+                continue
+            ride = Ride(
+                status=row['status'],
+                id_rider_id=rider_id,
+                id_driver_id=driver_id,
+                pickup_time=row['pickup_time'],
+                **{name: row[name] for name in FLOAT_FIELDS},
+            )
+            ride.set_pickup_cell()
+            rides.append(ride)
+            events.append(row['events'])
+        return rides, events
+
+    def parse_line(self, line):
+        text = line.decode('utf-8')
+        if self.header is not None:
+            values = next(csv.reader([text]))
+            if len(values) != len(self.header):
+                raise RowError(f'Expected {len(self.header)} columns, got {len(values)}')
+            row = dict(zip(self.header, values))
+        else:
+            row = json.loads(text)
+            if not isinstance(row, dict):
+                raise RowError('Expected a JSON object')
+
+        status = row.get('status')
+        if status not in RIDE_STATUSES:
+            raise RowError(f'Invalid status {status!r}')
+
+        parsed = {'status': status}
+        for name, limit in FLOAT_FIELDS.items():
+            value = Ride._meta.get_field(name).to_python(row.get(name))
+            if value is None or not math.isfinite(value) or abs(value) > limit:
+                raise RowError(f'Invalid {name} {row.get(name)!r}')
+            parsed[name] = value
+        parsed['pickup_time'] = self.parse_datetime(row.get('pickup_time'))
+        parsed['rider_email'] = lookup(row, 'rider_email', 'id_rider_data.email')
+        parsed['driver_email'] = lookup(row, 'driver_email', 'id_driver_data.email')
+        if not parsed['rider_email'] or not parsed['driver_email']:
+            raise RowError('rider_email and driver_email are required')
+
+        events = lookup(row, 'events', 'todays_ride_events') or []
+        if isinstance(events, str):
+            events = json.loads(events)
+        parsed['events'] = [
+            (event['description'], self.parse_datetime(event['created_at']))
+            for event in events
+        ]
+        return parsed
+
+    def parse_datetime(self, value):
+        if not value:
+            raise RowError('Missing timestamp')
+        parsed = RideEvent._meta.get_field('created_at').to_python(value)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, dt_timezone.utc)
+        return parsed
+
+    def resolve_users(self, emails):
+        """
+        Fill the email -> id cache with one query for any unseen emails
+        """
+        # Keep the cache bounded on imports touching millions of users;
+        # cleared before looking, so this batch's emails are all looked up
+        if len(self.user_ids) > self.max_cached_users:
+            self.user_ids.clear()
+        missing = [email for email in emails if email not in self.user_ids]
+        if not missing:
+            return
+        found = dict(User.objects.filter(email__in=missing).values_list('email', 'id_user'))
+        for email in missing:
+            self.user_ids[email] = found.get(email)
+
+    def reject(self, number, error):
+        self.errors += 1
+        if self.errors <= 20:
+            self.stderr.write(f'Row {number}: {error}')
+        if self.errors > self.max_errors:
+            raise CommandError(f'Aborting after {self.errors} rejected rows')
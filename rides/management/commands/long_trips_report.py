@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.reports import long_trips, rebuild_ride_durations
+from rides.serializers import LongTripsQuerySerializer
+
+
+class Command(BaseCommand):
+    help = 'Print the count of trips over --min-hours per month and driver'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-hours', type=float, default=1)
+        parser.add_argument('--from', dest='month_from', help='First month, YYYY-MM')
+        parser.add_argument('--to', dest='month_to', help='Last month, YYYY-MM')
+        parser.add_argument('--driver', type=int, help='Only this driver id')
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Recompute the ride_duration table from ride events first'
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            started = time.monotonic()
+            total = rebuild_ride_durations()
+            self.stdout.write(f'Rebuilt {total} ride durations in {time.monotonic() - started:.1f}s')
+
+        params = LongTripsQuerySerializer(data={
+            name: options[name] for name in ('min_hours', 'month_from', 'month_to', 'driver')
+            if options[name] is not None
+        })
+        if not params.is_valid():
+            raise CommandError(params.errors)
+
+        started = time.monotonic()
+        report = long_trips(**params.validated_data)
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(f"{'Month':<8} {'Driver':<30} Count of Trips > {params.validated_data['min_hours']:g} hr")
+        for row in report:
+            self.stdout.write(f"{row['month']:<8} {row['driver']:<30} {row['count']}")
+        self.stdout.write(f'{len(report)} rows in {elapsed * 1000:.1f} ms')
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rides.reports import rebuild_driver_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the driver_daily_stats rollup from the ride table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rollup rows per insert')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        total = rebuild_driver_daily_stats(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {total} driver daily rows in {time.monotonic() - started:.1f}s'
+        ))
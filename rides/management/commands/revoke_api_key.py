@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.models import ApiKey
+
+
+class Command(BaseCommand):
+    help = 'Revoke an API key by its prefix (the part before the dot)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('prefix')
+
+    def handle(self, *args, **options):
+        api_key = ApiKey.objects.filter(prefix=options['prefix'].split('.', 1)[0]).first()
+        if api_key is None:
+            raise CommandError(f"No API key with prefix {options['prefix']}")
+        if api_key.revoked_at is not None:
+            self.stdout.write(f'API key {api_key.prefix} was already revoked at {api_key.revoked_at}')
+            return
+        api_key.revoke()
+        self.stdout.write(self.style.SUCCESS(f'Revoked API key {api_key.prefix}'))
+        if settings.CACHES['default']['BACKEND'].endswith('LocMemCache'):
+            # The API key cache generation cannot reach the server processes
+            self.stdout.write(self.style.WARNING(
+                f'The cache is local to each process: running servers refuse the key '
+                f'within API_KEY_CACHE_TTL ({settings.API_KEY_CACHE_TTL}) seconds'
+            ))
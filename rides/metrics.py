@@ -0,0 +1,226 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from rest_framework.renderers import BaseRenderer
+
+
+# Request phases timed in seconds, in Server-Timing order
+PHASES = ['db', 'view', 'serialize', 'render', 'total']
+QUANTILES = [0.5, 0.95, 0.99]
+
+
+class RequestMetrics:
+    """
+    Query count and phase timings of one request
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.durations = dict.fromkeys(PHASES, 0.0)
+        self.view_started = None
+        self.view_finished = None
+
+    def add(self, phase, seconds):
+        self.durations[phase] += seconds
+
+    def server_timing(self):
+        entries = [f'db;dur={self.durations["db"] * 1000:.1f};desc="{self.queries} queries"']
+        entries += [f'{phase};dur={self.durations[phase] * 1000:.1f}' for phase in PHASES[1:]]
+        return ', '.join(entries)
+
+
+_current = ContextVar('rides_request_metrics', default=None)
+
+
+def start_request_metrics():
+    """
+    Begin collecting for a request; returns (metrics, token) for end_request_metrics
+    """
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def end_request_metrics(token):
+    _current.reset(token)
+
+
+def current_request_metrics():
+    return _current.get()
+
+
+@contextmanager
+def timed(phase):
+    """
+    Add the time spent in the block to the current request's phase
+    """
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(phase, time.perf_counter() - started)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper counting the current request's queries and DB time
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.add('db', time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    Wrap every query of new connections in record_query (connection_created receiver)
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Histogram:
+    """
+    Fixed log-scale buckets between `lowest` and `highest`, each `growth`
+    times wider than the last
+
+    Memory and update cost are constant; quantiles are interpolated within
+    a bucket, so they are accurate to about one bucket width.
+    """
+
+    def __init__(self, lowest, highest, growth=2 ** 0.25):
+        self.bounds = []
+        bound = lowest
+        while bound < highest:
+            self.bounds.append(bound)
+            bound *= growth
+        self.bounds.append(highest)
+        # The last bucket holds everything above `highest`
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(lower + (upper - lower) * (rank - cumulative) / count, self.max)
+            cumulative += count
+        return self.max
+
+
+class EndpointMetrics:
+    """
+    In-process histograms of request phases and query counts per endpoint
+
+    Endpoints are labelled `<METHOD> <url name>`, e.g. `GET ride-list`.
+    Every process keeps its own numbers.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def observe(self, endpoint, metrics):
+        with self.lock:
+            histograms = self.endpoints.get(endpoint)
+            if histograms is None:
+                histograms = self.endpoints[endpoint] = {
+                    **{phase: Histogram(0.0001, 60.0) for phase in PHASES},
+                    'queries': Histogram(1, 10000),
+                }
+            for phase, seconds in metrics.durations.items():
+                histograms[phase].observe(seconds)
+            histograms['queries'].observe(metrics.queries)
+
+    def clear(self):
+        with self.lock:
+            self.endpoints.clear()
+
+    def snapshot(self):
+        """
+        {endpoint: {name: (quantile values, sum, count)}}
+        """
+        with self.lock:
+            return {
+                endpoint: {
+                    name: ([histogram.quantile(q) for q in QUANTILES], histogram.sum, histogram.count)
+                    for name, histogram in histograms.items()
+                }
+                for endpoint, histograms in self.endpoints.items()
+            }
+
+
+endpoint_metrics = EndpointMetrics()
+
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_lines(snapshot, counters=()):
+    """
+    Render an EndpointMetrics snapshot and (name, help, type, value) counters
+    in the Prometheus text exposition format
+    """
+    families = [
+        ('rides_request_seconds', 'Request phase durations per endpoint', PHASES),
+        ('rides_request_queries', 'SQL queries per request per endpoint', ['queries']),
+    ]
+    for family, help_text, names in families:
+        yield f'# HELP {family} {help_text}'
+        yield f'# TYPE {family} summary'
+        for endpoint, histograms in sorted(snapshot.items()):
+            for name in names:
+                quantiles, total, count = histograms[name]
+                labels = f'endpoint="{prometheus_label(endpoint)}"'
+                if family == 'rides_request_seconds':
+                    labels += f',phase="{name}"'
+                for q, value in zip(QUANTILES, quantiles):
+                    yield f'{family}{{{labels},quantile="{q}"}} {value:.6g}'
+                yield f'{family}_sum{{{labels}}} {total:.6g}'
+                yield f'{family}_count{{{labels}}} {count}'
+
+    for name, help_text, metric_type, value in counters:
+        yield f'# HELP {name} {help_text}'
+        yield f'# TYPE {name} {metric_type}'
+        yield f'{name} {value}'
+
+
+class PrometheusRenderer(BaseRenderer):
+    """
+    Text exposition format; takes the already formatted text
+    """
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, str):
+            # Error responses, e.g. {'detail': ...}
+            data = ''.join(f'# {key}: {value}\n' for key, value in data.items())
+        return data.encode(self.charset)
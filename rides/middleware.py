@@ -0,0 +1,112 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .db_routers import end_pin_state, replica_aliases, start_pin_state
+from .metrics import current_request_metrics, end_request_metrics, endpoint_metrics, start_request_metrics
+
+
+class ReplicaPinningMiddleware:
+    """
+    Scope ReplicaRouter's primary pinning to each request
+
+    A request that writes is answered with a cookie that keeps the client's
+    reads on the primary for REPLICA_PIN_SECONDS, long enough for the
+    replicas to catch up.
+    """
+    sync_capable = True
+    async_capable = True
+    cookie_name = 'rides_pin_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = bool(replica_aliases())
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, token = start_pin_state(self.cookie_name in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            end_pin_state(token)
+        return self.process_response(state, response)
+
+    async def __acall__(self, request):
+        state, token = start_pin_state(self.cookie_name in request.COOKIES)
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_pin_state(token)
+        return self.process_response(state, response)
+
+    def process_response(self, state, response):
+        if self.enabled and state.wrote:
+            response.set_cookie(
+                self.cookie_name, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax'
+            )
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Time each request and count its SQL queries
+
+    Reports db (query count and time), view, serialize, render and total
+    durations in a Server-Timing header and adds them to endpoint_metrics,
+    served by GET /api/v1/metrics/. Keep it first in MIDDLEWARE so that
+    total covers the other middleware as well.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token = start_request_metrics()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request_metrics(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics, token = start_request_metrics()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request_metrics(token)
+        return self.finish(request, response, metrics)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        current_request_metrics().view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        metrics = current_request_metrics()
+        metrics.view_finished = time.perf_counter()
+
+        def rendered(response):
+            metrics.add('render', time.perf_counter() - metrics.view_finished)
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, metrics):
+        finished = time.perf_counter()
+        if metrics.view_started is not None:
+            metrics.add('view', (metrics.view_finished or finished) - metrics.view_started)
+        metrics.add('total', finished - metrics.started)
+
+        match = getattr(request, 'resolver_match', None)
+        endpoint = f'{request.method} {match.view_name if match else "unmatched"}'
+        endpoint_metrics.observe(endpoint, metrics)
+        response['Server-Timing'] = metrics.server_timing()
+        return response
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:08
+
+import math
+
+from django.db import migrations, models
+
+
+# The grid of rides.geo when this migration was written, frozen here so
+# later changes to the app code cannot change what the migration does
+GRID_CELL_DEGREES = 0.05
+GRID_ROWS = 3600
+GRID_COLUMNS = 7200
+
+
+def grid_cell(lat, lon):
+    row = min(max(int(math.floor((lat + 90) / GRID_CELL_DEGREES)), 0), GRID_ROWS - 1)
+    column = int(math.floor((lon + 180) / GRID_CELL_DEGREES)) % GRID_COLUMNS
+    return row * GRID_COLUMNS + column
+
+
+def backfill_pickup_cells(apps, schema_editor):
+    Ride = apps.get_model('rides', 'Ride')
+    batch = []
+    for ride in Ride.objects.only('pickup_latitude', 'pickup_longitude').iterator(chunk_size=2000):
+        ride.pickup_cell = grid_cell(ride.pickup_latitude, ride.pickup_longitude)
+        batch.append(ride)
+        if len(batch) >= 2000:
+            Ride.objects.bulk_update(batch, ['pickup_cell'])
+            batch = []
+    if batch:
+        Ride.objects.bulk_update(batch, ['pickup_cell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='pickup_cell',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['pickup_cell'], name='ride_pickup__13df77_idx'),
+        ),
+        migrations.RunPython(backfill_pickup_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:11
+
+from django.db import migrations, models
+
+
+COUNTED_TABLES = ['ride', 'ride_event']
+
+
+def create_sqlite_counters(apps, schema_editor):
+    """
+    Seed table_row_count and keep it current with INSERT/DELETE triggers
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in COUNTED_TABLES:
+        schema_editor.execute(
+            f"INSERT INTO table_row_count (table_name, row_count) SELECT '{table}', COUNT(*) FROM {table}"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {table}_count_insert AFTER INSERT ON {table} BEGIN "
+            f"UPDATE table_row_count SET row_count = row_count + 1 WHERE table_name = '{table}'; END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {table}_count_delete AFTER DELETE ON {table} BEGIN "
+            f"UPDATE table_row_count SET row_count = row_count - 1 WHERE table_name = '{table}'; END"
+        )
+
+
+def drop_sqlite_counters(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in COUNTED_TABLES:
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_count_insert")
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_count_delete")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0002_ride_pickup_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableRowCount',
+            fields=[
+                ('table_name', models.CharField(max_length=63, primary_key=True, serialize=False)),
+                ('row_count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'table_row_count',
+            },
+        ),
+        migrations.RunPython(create_sqlite_counters, drop_sqlite_counters),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0003_table_row_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='modified_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['modified_at'], name='ride_modifie_cca839_idx'),
+        ),
+    ]
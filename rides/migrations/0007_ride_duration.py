@@ -0,0 +1,72 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:24
+
+from datetime import timezone as dt_timezone
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, Min, Q
+
+
+# Events are matched by description here; event_type only came in 0009
+PICKUP_EVENT = 'Status changed to pickup'
+DROPOFF_EVENT = 'Status changed to dropoff'
+BATCH_SIZE = 5000
+
+
+def backfill_ride_durations(apps, schema_editor):
+    """
+    One row per ride from its earliest pickup to its latest dropoff event
+    """
+    RideEvent = apps.get_model('rides', 'RideEvent')
+    RideDuration = apps.get_model('rides', 'RideDuration')
+    rows = RideEvent.objects.filter(description__in=[PICKUP_EVENT, DROPOFF_EVENT]).values(
+        'id_ride', 'id_ride__id_driver'
+    ).annotate(
+        pickup_at=Min('created_at', filter=Q(description=PICKUP_EVENT)),
+        dropoff_at=Max('created_at', filter=Q(description=DROPOFF_EVENT)),
+    ).order_by()
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        pickup_at, dropoff_at = row['pickup_at'], row['dropoff_at']
+        if not (pickup_at and dropoff_at and pickup_at < dropoff_at):
+            continue
+        batch.append(RideDuration(
+            id_ride_id=row['id_ride'],
+            id_driver_id=row['id_ride__id_driver'],
+            pickup_at=pickup_at,
+            dropoff_at=dropoff_at,
+            duration_seconds=(dropoff_at - pickup_at).total_seconds(),
+            month=pickup_at.astimezone(dt_timezone.utc).date().replace(day=1),
+        ))
+        if len(batch) >= BATCH_SIZE:
+            RideDuration.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        RideDuration.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0006_import_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideDuration',
+            fields=[
+                ('id_ride', models.OneToOneField(db_column='id_ride', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='duration', serialize=False, to='rides.ride')),
+                ('pickup_at', models.DateTimeField()),
+                ('dropoff_at', models.DateTimeField()),
+                ('duration_seconds', models.FloatField()),
+                ('month', models.DateField()),
+                ('id_driver', models.ForeignKey(db_column='id_driver', on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'ride_duration',
+                'indexes': [models.Index(fields=['duration_seconds', 'month', 'id_driver'], name='ride_durati_duratio_3dee80_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_ride_durations, migrations.RunPython.noop),
+    ]
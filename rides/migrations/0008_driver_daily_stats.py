@@ -0,0 +1,70 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:26
+
+import math
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+EARTH_RADIUS_KM = 6371
+BATCH_SIZE = 5000
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def backfill_driver_daily_stats(apps, schema_editor):
+    """
+    Ride count and summed distance per driver, UTC pickup day and status
+    """
+    Ride = apps.get_model('rides', 'Ride')
+    DriverDailyStats = apps.get_model('rides', 'DriverDailyStats')
+    totals = defaultdict(lambda: [0, 0.0])
+    rides = Ride.objects.values_list(
+        'id_driver', 'pickup_time', 'status',
+        'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude',
+    )
+    for id_driver, pickup_time, status, *coordinates in rides.iterator(chunk_size=BATCH_SIZE):
+        total = totals[id_driver, pickup_time.astimezone(dt_timezone.utc).date(), status]
+        total[0] += 1
+        total[1] += haversine(*coordinates)
+    DriverDailyStats.objects.bulk_create(
+        (
+            DriverDailyStats(id_driver_id=id_driver, day=day, status=status, ride_count=count, distance_km=distance)
+            for (id_driver, day, status), (count, distance) in totals.items()
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0007_ride_duration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('en-route', 'En Route'), ('pickup', 'Pickup'), ('dropoff', 'Dropoff'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('ride_count', models.IntegerField(default=0)),
+                ('distance_km', models.FloatField(default=0)),
+                ('id_driver', models.ForeignKey(db_column='id_driver', on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'driver_daily_stats',
+                'indexes': [models.Index(fields=['day', 'id_driver'], name='driver_dail_day_f74def_idx')],
+                'constraints': [models.UniqueConstraint(fields=('id_driver', 'day', 'status'), name='driver_daily_stats_key')],
+            },
+        ),
+        migrations.RunPython(backfill_driver_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:27
+
+from django.db import migrations, models
+from django.db.models import Case, Max, Min, Value, When
+
+
+BATCH_SIZE = 10000
+
+
+def classify_event_types(apps, schema_editor):
+    """
+    Set event_type from the description, one primary key range per UPDATE
+    """
+    RideEvent = apps.get_model('rides', 'RideEvent')
+    # The field's frozen choices map each known description to its type
+    classify = Case(
+        *[
+            When(description=label, then=Value(value))
+            for value, label in RideEvent._meta.get_field('event_type').choices
+            if value
+        ],
+        default=Value(0),
+    )
+    bounds = RideEvent.objects.aggregate(first=Min('id_ride_event'), last=Max('id_ride_event'))
+    if bounds['first'] is None:
+        return
+    for start in range(bounds['first'], bounds['last'] + 1, BATCH_SIZE):
+        RideEvent.objects.filter(
+            id_ride_event__gte=start, id_ride_event__lt=start + BATCH_SIZE
+        ).update(event_type=classify)
+
+
+class Migration(migrations.Migration):
+    # Each classification batch commits on its own instead of locking the
+    # whole event table for the duration of the migration
+    atomic = False
+
+    dependencies = [
+        ('rides', '0008_driver_daily_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rideevent',
+            name='event_type',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Other'), (1, 'Ride requested'), (2, 'Driver assigned'), (3, 'Driver en route to pickup'), (4, 'Status changed to pickup'), (5, 'Passenger picked up'), (6, 'Status changed to dropoff'), (7, 'Passenger dropped off'), (8, 'Ride completed'), (9, 'Status changed to en-route'), (10, 'Status changed to completed'), (11, 'Status changed to cancelled')], default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='rideevent',
+            index=models.Index(fields=['id_ride', 'event_type', 'created_at'], name='ride_event_id_ride_afb3d8_idx'),
+        ),
+        migrations.RunPython(classify_event_types, migrations.RunPython.noop),
+    ]
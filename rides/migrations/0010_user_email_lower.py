@@ -0,0 +1,43 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:29
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+def create_postgres_email_indexes(apps, schema_editor):
+    """
+    Prefix (LIKE 'x%') and substring (LIKE '%x%') rider email lookups on
+    lower(email); the plain expression index only serves exact matches
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS user_email_lower_pattern_idx ON "user" (LOWER(email) text_pattern_ops)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS user_email_lower_trgm_idx ON "user" USING gin (LOWER(email) gin_trgm_ops)'
+    )
+
+
+def drop_postgres_email_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS user_email_lower_pattern_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS user_email_lower_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('rides', '0009_ride_event_event_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='user_email_lower_idx'),
+        ),
+        migrations.RunPython(create_postgres_email_indexes, drop_postgres_email_indexes),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0010_user_email_lower'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRideEvent',
+            fields=[
+                ('id_ride_event', models.IntegerField(primary_key=True, serialize=False)),
+                ('description', models.CharField(max_length=255)),
+                ('event_type', models.PositiveSmallIntegerField(choices=[(0, 'Other'), (1, 'Ride requested'), (2, 'Driver assigned'), (3, 'Driver en route to pickup'), (4, 'Status changed to pickup'), (5, 'Passenger picked up'), (6, 'Status changed to dropoff'), (7, 'Passenger dropped off'), (8, 'Ride completed'), (9, 'Status changed to en-route'), (10, 'Status changed to completed'), (11, 'Status changed to cancelled')], default=0)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('id_ride', models.ForeignKey(db_column='id_ride', on_delete=django.db.models.deletion.CASCADE, related_name='archived_events', to='rides.ride')),
+            ],
+            options={
+                'db_table': 'ride_event_archive',
+                'indexes': [models.Index(fields=['id_ride', 'created_at'], name='ride_event__id_ride_e3dd75_idx')],
+            },
+        ),
+    ]
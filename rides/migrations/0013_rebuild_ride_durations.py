@@ -0,0 +1,64 @@
+# Generated by Django 5.2.1 on 2026-10-17 09:41
+
+from datetime import timezone as dt_timezone
+
+from django.db import migrations
+from django.db.models import Max, Min, Q
+
+
+# RideEvent.EventType values of the pickup and dropoff status changes
+PICKUP_EVENT = 4
+DROPOFF_EVENT = 6
+BATCH_SIZE = 5000
+
+
+def rebuild_ride_durations(apps, schema_editor):
+    """
+    Recompute every duration from the classified hot and archived events
+
+    0007 matched events by description; the app now maintains durations
+    from event_type across both event tables, so rows are rebuilt from the
+    same events. A ride counts from its earliest pickup to its latest dropoff.
+    """
+    RideDuration = apps.get_model('rides', 'RideDuration')
+    bounds = {}
+    for event_model in [apps.get_model('rides', 'RideEvent'), apps.get_model('rides', 'ArchivedRideEvent')]:
+        rows = event_model.objects.filter(event_type__in=[PICKUP_EVENT, DROPOFF_EVENT]).values(
+            'id_ride', 'id_ride__id_driver'
+        ).annotate(
+            pickup_at=Min('created_at', filter=Q(event_type=PICKUP_EVENT)),
+            dropoff_at=Max('created_at', filter=Q(event_type=DROPOFF_EVENT)),
+        ).order_by()
+        for row in rows.iterator(chunk_size=BATCH_SIZE):
+            id_driver, pickup_at, dropoff_at = bounds.get(row['id_ride'], (row['id_ride__id_driver'], None, None))
+            pickup_at = min(filter(None, [pickup_at, row['pickup_at']]), default=None)
+            dropoff_at = max(filter(None, [dropoff_at, row['dropoff_at']]), default=None)
+            bounds[row['id_ride']] = (id_driver, pickup_at, dropoff_at)
+
+    RideDuration.objects.all().delete()
+    RideDuration.objects.bulk_create(
+        (
+            RideDuration(
+                id_ride_id=id_ride,
+                id_driver_id=id_driver,
+                pickup_at=pickup_at,
+                dropoff_at=dropoff_at,
+                duration_seconds=(dropoff_at - pickup_at).total_seconds(),
+                month=pickup_at.astimezone(dt_timezone.utc).date().replace(day=1),
+            )
+            for id_ride, (id_driver, pickup_at, dropoff_at) in bounds.items()
+            if pickup_at and dropoff_at and pickup_at < dropoff_at
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0012_api_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_ride_durations, migrations.RunPython.noop),
+    ]
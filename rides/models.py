@@ -1,7 +1,13 @@
-from django.db import models
+import hashlib
+import hmac
+import secrets
+
+from django.db import models, transaction
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
-from datetime import timedelta
+
+from .geo import grid_cell
 
 
 class User(AbstractUser):
@@ -20,6 +26,10 @@ class User(AbstractUser):
 
     class Meta:
         db_table = 'user'
+        indexes = [
+            # Case-insensitive exact rider email lookups (see RideFilter)
+            models.Index(Lower('email'), name='user_email_lower_idx'),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.email})"
@@ -56,6 +66,9 @@ class Ride(models.Model):
     dropoff_latitude = models.FloatField()
     dropoff_longitude = models.FloatField()
     pickup_time = models.DateTimeField()
+    pickup_cell = models.IntegerField(null=True, editable=False)
+    # Also touched on new RideEvents and rider or driver edits (see rides.signals)
+    modified_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'ride'
@@ -64,16 +77,49 @@ class Ride(models.Model):
             models.Index(fields=['status']),
             models.Index(fields=['id_rider']),
             models.Index(fields=['id_driver']),
+            models.Index(fields=['pickup_cell']),
+            models.Index(fields=['modified_at']),
         ]
 
     def __str__(self):
         return f"Ride {self.id_ride}: {self.status}"
 
+    def set_pickup_cell(self):
+        """
+        Recompute the spatial grid cell, e.g. before bulk_create()
+        """
+        self.pickup_cell = grid_cell(self.pickup_latitude, self.pickup_longitude)
+
+    def save(self, *args, **kwargs):
+        # Keep the spatial grid cell in sync with the pickup coordinates
+        self.set_pickup_cell()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'pickup_latitude', 'pickup_longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'pickup_cell'}
+        # Rollups updated by save signals commit or roll back with the ride
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 
 class RideEvent(models.Model):
     """
     RideEvent model as per requirements
     """
+    class EventType(models.IntegerChoices):
+        # Labels are the descriptions each type is classified from
+        OTHER = 0, 'Other'
+        RIDE_REQUESTED = 1, 'Ride requested'
+        DRIVER_ASSIGNED = 2, 'Driver assigned'
+        DRIVER_EN_ROUTE = 3, 'Driver en route to pickup'
+        PICKUP = 4, 'Status changed to pickup'
+        PASSENGER_PICKED_UP = 5, 'Passenger picked up'
+        DROPOFF = 6, 'Status changed to dropoff'
+        PASSENGER_DROPPED_OFF = 7, 'Passenger dropped off'
+        RIDE_COMPLETED = 8, 'Ride completed'
+        EN_ROUTE = 9, 'Status changed to en-route'
+        COMPLETED = 10, 'Status changed to completed'
+        CANCELLED = 11, 'Status changed to cancelled'
+
     id_ride_event = models.AutoField(primary_key=True)
     id_ride = models.ForeignKey(
         Ride, 
@@ -82,14 +128,233 @@ class RideEvent(models.Model):
         db_column='id_ride'
     )
     description = models.CharField(max_length=255)
-    created_at = models.DateTimeField(auto_now_add=True)
+    event_type = models.PositiveSmallIntegerField(
+        choices=EventType.choices, default=EventType.OTHER, editable=False
+    )
+    # Not auto_now_add, so imports and generated data can keep historical times
+    created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         db_table = 'ride_event'
         indexes = [
             models.Index(fields=['created_at']),
             models.Index(fields=['id_ride', 'created_at']),
+            models.Index(fields=['id_ride', 'event_type', 'created_at']),
         ]
 
     def __str__(self):
         return f"Event {self.id_ride_event}: {self.description}"
+
+    @classmethod
+    def classify(cls, description):
+        """
+        Return the EventType of a description, OTHER when it is not a known one
+        """
+        return EVENT_TYPES_BY_DESCRIPTION.get(description, cls.EventType.OTHER)
+
+    def set_event_type(self):
+        """
+        Recompute event_type from the description, e.g. before bulk_create()
+        """
+        self.event_type = self.classify(self.description)
+
+    def save(self, *args, **kwargs):
+        # Keep the event type in sync with the description
+        self.set_event_type()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'description' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'event_type'}
+        super().save(*args, **kwargs)
+
+
+EVENT_TYPES_BY_DESCRIPTION = {
+    event_type.label: event_type
+    for event_type in RideEvent.EventType
+    if event_type != RideEvent.EventType.OTHER
+}
+
+
+class TableRowCount(models.Model):
+    """
+    Row counts of large tables, maintained by database triggers
+
+    Used as a cheap count estimate on backends without planner statistics
+    (SQLite); PostgreSQL reads pg_class.reltuples instead.
+    """
+    table_name = models.CharField(max_length=63, primary_key=True)
+    row_count = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'table_row_count'
+
+    def __str__(self):
+        return f"{self.table_name}: {self.row_count}"
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Progress of a resumable import_rides run
+
+    Updated in the same transaction as each imported batch, so a resumed
+    import continues exactly after the last committed row.
+    """
+    source = models.CharField(max_length=1024, primary_key=True)
+    offset = models.BigIntegerField(default=0)
+    rows = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'import_checkpoint'
+
+    def __str__(self):
+        return f"{self.source} @ {self.offset}"
+
+
+class RideDuration(models.Model):
+    """
+    Pickup to dropoff time of each ride, kept up to date from its events
+
+    Holds one row per ride that has a 'Status changed to pickup' event
+    followed by a 'Status changed to dropoff' event; see rides.reports.
+    """
+    id_ride = models.OneToOneField(
+        Ride,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='duration',
+        db_column='id_ride'
+    )
+    id_driver = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_column='id_driver'
+    )
+    pickup_at = models.DateTimeField()
+    dropoff_at = models.DateTimeField()
+    duration_seconds = models.FloatField()
+    # First day of the pickup month (UTC), the report's grouping key
+    month = models.DateField()
+
+    class Meta:
+        db_table = 'ride_duration'
+        indexes = [
+            models.Index(fields=['duration_seconds', 'month', 'id_driver']),
+        ]
+
+    def __str__(self):
+        return f"Ride {self.id_ride_id}: {self.duration_seconds:.0f}s"
+
+
+class DriverDailyStats(models.Model):
+    """
+    Rides per driver, pickup day (UTC) and status, kept up to date from ride
+    saves and deletes; see rides.reports
+    """
+    id_driver = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_column='id_driver'
+    )
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=Ride.STATUS_CHOICES)
+    ride_count = models.IntegerField(default=0)
+    # Sum of pickup to dropoff straight-line distances
+    distance_km = models.FloatField(default=0)
+
+    class Meta:
+        db_table = 'driver_daily_stats'
+        constraints = [
+            models.UniqueConstraint(fields=['id_driver', 'day', 'status'], name='driver_daily_stats_key'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'id_driver']),
+        ]
+
+    def __str__(self):
+        return f"Driver {self.id_driver_id} {self.day} {self.status}: {self.ride_count}"
+
+
+class ArchivedRideEvent(models.Model):
+    """
+    A RideEvent moved out of the hot ride_event table by archive_ride_events
+
+    Keeps the original primary key and columns; read through the ride
+    history endpoint.
+    """
+    id_ride_event = models.IntegerField(primary_key=True)
+    id_ride = models.ForeignKey(
+        Ride,
+        on_delete=models.CASCADE,
+        related_name='archived_events',
+        db_column='id_ride'
+    )
+    description = models.CharField(max_length=255)
+    event_type = models.PositiveSmallIntegerField(
+        choices=RideEvent.EventType.choices, default=RideEvent.EventType.OTHER
+    )
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'ride_event_archive'
+        indexes = [
+            models.Index(fields=['id_ride', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Archived event {self.id_ride_event}: {self.description}"
+
+
+class ApiKey(models.Model):
+    """
+    API key of a user for the `Authorization: Api-Key <key>` header
+
+    Keys are '<prefix>.<secret>'. Only the prefix, to find the row, and a
+    SHA-256 hash of the whole key are stored; the key itself is shown once,
+    when it is created.
+    """
+    id_api_key = models.AutoField(primary_key=True)
+    id_user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='api_keys',
+        db_column='id_user'
+    )
+    name = models.CharField(max_length=100, blank=True)
+    prefix = models.CharField(max_length=16, unique=True, editable=False)
+    key_hash = models.CharField(max_length=64, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    revoked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'api_key'
+
+    def __str__(self):
+        return f"{self.prefix} ({self.name or self.id_user_id})"
+
+    @staticmethod
+    def hash_key(key):
+        # Keys are 256 random bits, so a fast hash is enough at rest
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def generate(cls, user, name='', expires_at=None):
+        """
+        Create a key for user; returns (api_key, key) and key is not kept
+        """
+        prefix = secrets.token_hex(6)
+        key = f'{prefix}.{secrets.token_urlsafe(32)}'
+        api_key = cls.objects.create(
+            id_user=user, name=name, prefix=prefix, key_hash=cls.hash_key(key), expires_at=expires_at
+        )
+        return api_key, key
+
+    def matches(self, key):
+        return hmac.compare_digest(self.key_hash, self.hash_key(key))
+
+    def revoke(self):
+        self.revoked_at = timezone.now()
+        self.save(update_fields=['revoked_at'])
@@ -0,0 +1,348 @@
+import base64
+import hashlib
+import json
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import InvalidPage, Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .db_routers import pinned_to_primary
+
+
+Cursor = namedtuple('Cursor', ['value', 'pk', 'reverse'])
+
+
+def estimate_row_count(model, using='default'):
+    """
+    Return a cheap estimate of the number of rows in model's table, or None
+
+    PostgreSQL answers from the planner statistics in pg_class; other
+    backends read the trigger-maintained table_row_count table.
+    """
+    from .models import TableRowCount
+
+    table = model._meta.db_table
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [table])
+            row = cursor.fetchone()
+        # reltuples is -1 until the table has been vacuumed or analyzed
+        if row is None or row[0] is None or row[0] < 0:
+            return None
+        return row[0]
+
+    row_count = TableRowCount.objects.using(using).filter(table_name=table).values_list(
+        'row_count', flat=True
+    ).first()
+    return row_count
+
+
+class CountedPaginator(DjangoPaginator):
+    """
+    Django paginator that can be handed an already known total count
+    """
+
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        if count is not None:
+            self.__dict__['count'] = count
+
+
+class CachedCountPagination(PageNumberPagination):
+    """
+    Page number pagination that avoids an exact COUNT(*) on every request
+
+    Unfiltered lists report the table's estimated row count. Filtered lists
+    count exactly once and then serve that count from the cache for
+    count_cache_timeout seconds, keyed by the view's normalized filterset
+    values. The response's count_exact flag is true only when the count was
+    computed by the current request. Requests pinned to the primary always
+    count exactly.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    count_cache_timeout = 30
+    # Estimates below this are counted exactly, which is cheap at that size
+    exact_count_threshold = 10000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.known_count, self.count_exact = self.get_count(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset for async views
+
+        The count runs in a worker thread; the page itself is read with
+        the async ORM.
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.known_count, self.count_exact = await sync_to_async(self.get_count)(queryset, request, view)
+        if self.known_count is None:
+            self.known_count = await queryset.acount()
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        page_number = self.get_page_number(request, paginator)
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+
+        bottom = (number - 1) * page_size
+        rows = [row async for row in queryset[bottom:bottom + page_size].aiterator()]
+        self.page = paginator._get_page(rows, number, paginator)
+        return rows
+
+    def django_paginator_class(self, object_list, per_page):
+        return CountedPaginator(object_list, per_page, count=self.known_count)
+
+    def get_count(self, queryset, request, view):
+        """
+        Return (count, exact); a count of None lets the paginator count exactly
+        """
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.exact_count_threshold:
+                return estimate, False
+            return None, True
+
+        key = self.get_count_cache_key(queryset, request, view)
+        if key is None or pinned_to_primary():
+            return None, True
+        count = cache.get(key)
+        if count is not None:
+            return count, False
+        count = queryset.count()
+        cache.set(key, count, self.count_cache_timeout)
+        return count, True
+
+    def get_count_cache_key(self, queryset, request, view):
+        filterset_class = getattr(view, 'filterset_class', None)
+        if filterset_class is None:
+            return None
+        filterset = filterset_class(request.query_params, queryset=queryset, request=request)
+        if not filterset.is_valid():
+            return None
+        normalized = sorted(
+            (name, str(value))
+            for name, value in filterset.form.cleaned_data.items()
+            if value not in (None, '', [])
+        )
+        digest = hashlib.sha256(repr(normalized).encode()).hexdigest()
+        return f'count:{queryset.model._meta.label_lower}:{digest}'
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'count_exact': self.count_exact,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_exact'] = {'type': 'boolean'}
+        return response_schema
+
+
+class ReportPagination(PageNumberPagination):
+    """
+    Plain page numbers for grouped report rows, whose count is the number of
+    groups rather than anything the table statistics could estimate
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination over a (field, unique tiebreaker) ordering
+
+    Each page is fetched with a range condition on the ordering columns
+    instead of an OFFSET, and no COUNT query is issued. Cursors are opaque
+    base64 tokens holding the boundary row's ordering values.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering, page_size=None):
+        self.ordering = ordering
+        self.page_size = page_size or api_settings.PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request)
+        return self.set_page(list(queryset[:self.page_size + 1]))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset for async views, reading the page with the async ORM
+        """
+        queryset = self.get_page_queryset(queryset, request)
+        return self.set_page([row async for row in queryset[:self.page_size + 1].aiterator()])
+
+    def get_page_queryset(self, queryset, request):
+        """
+        Apply the cursor's range condition and the page ordering
+        """
+        self.base_url = request.build_absolute_uri()
+        field, tiebreaker = self.ordering
+        # Keyset pages replace the ordering, so any other one would be ignored
+        requested = list(queryset.query.order_by)
+        if requested and requested != [field, tiebreaker][:len(requested)]:
+            raise ValidationError({
+                'detail': f'Cursor pagination orders by {field} and cannot be combined with another ordering.'
+            })
+        self.value_field = queryset.model._meta.get_field(field)
+        self.cursor = cursor = self.decode_cursor(request)
+
+        reverse = cursor.reverse if cursor else False
+        if cursor is not None:
+            try:
+                value = self.value_field.to_python(cursor.value)
+            except (DjangoValidationError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            # The plain range on `field` lets the database seek its index;
+            # the OR only breaks ties between rows sharing that value
+            if reverse:
+                queryset = queryset.filter(**{f'{field}__lte': value}).filter(
+                    Q(**{f'{field}__lt': value}) | Q(**{f'{tiebreaker}__lt': cursor.pk})
+                )
+            else:
+                queryset = queryset.filter(**{f'{field}__gte': value}).filter(
+                    Q(**{f'{field}__gt': value}) | Q(**{f'{tiebreaker}__gt': cursor.pk})
+                )
+
+        if reverse:
+            return queryset.order_by(f'-{field}', f'-{tiebreaker}')
+        return queryset.order_by(field, tiebreaker)
+
+    def set_page(self, results):
+        """
+        Keep the page out of up to page_size + 1 fetched rows
+        """
+        cursor = self.cursor
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if cursor is not None and cursor.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            return Cursor(value=payload['v'], pk=int(payload['pk']), reverse=bool(payload['r']))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        field, tiebreaker = self.ordering
+        # Rows are model instances, or dicts when paginating a values() queryset
+        if isinstance(row, dict):
+            value, pk = row[field], row[tiebreaker]
+        else:
+            value, pk = getattr(row, self.value_field.attname), getattr(row, tiebreaker)
+        payload = {
+            'v': value.isoformat() if hasattr(value, 'isoformat') else value,
+            'pk': pk,
+            'r': reverse,
+        }
+        encoded = base64.urlsafe_b64encode(json.dumps(payload).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+
+class OptInCursorPagination(CachedCountPagination):
+    """
+    Page number pagination that switches to keyset pagination per request
+
+    Clients opt in with ?pagination=cursor (and then follow the returned
+    next/previous links, which carry ?cursor=). Subclasses set
+    cursor_ordering to a (field, unique tiebreaker) pair backed by an index.
+    """
+    cursor_ordering = None
+    mode_query_param = 'pagination'
+
+    def use_cursor(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or KeysetPagination.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.use_cursor(request):
+            self.keyset = None
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = KeysetPagination(self.cursor_ordering, self.get_page_size(request))
+        self.display_page_controls = False
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        if not self.use_cursor(request):
+            self.keyset = None
+            return await super().apaginate_queryset(queryset, request, view)
+
+        self.keyset = KeysetPagination(self.cursor_ordering, self.get_page_size(request))
+        return await self.keyset.apaginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class RidePagination(OptInCursorPagination):
+    cursor_ordering = ('pickup_time', 'id_ride')
+
+
+class RideEventPagination(OptInCursorPagination):
+    cursor_ordering = ('created_at', 'id_ride_event')
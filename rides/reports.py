@@ -0,0 +1,286 @@
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate
+
+from .geo import Haversine, calculate_distance
+from .models import User, Ride, RideEvent, ArchivedRideEvent, RideDuration, DriverDailyStats
+
+
+# Event types that mark the start and the end of a trip
+PICKUP_EVENT = RideEvent.EventType.PICKUP
+DROPOFF_EVENT = RideEvent.EventType.DROPOFF
+DURATION_EVENTS = [PICKUP_EVENT, DROPOFF_EVENT]
+
+
+def duration_rows(event_models, ride_ids=None):
+    """
+    Yield (id_ride, id_driver, pickup_at, dropoff_at) per ride from its events
+
+    Uses the earliest pickup and the latest dropoff across all event_models
+    (hot and archived events), so a ride counts once even if a status was set
+    twice. Rides without a pickup before a dropoff are skipped, like the
+    pickup < dropoff join in the reporting SQL.
+    """
+    bounds = {}
+    for event_model in event_models:
+        events = event_model.objects.filter(event_type__in=DURATION_EVENTS)
+        if ride_ids is not None:
+            events = events.filter(id_ride__in=ride_ids)
+        rows = events.values('id_ride', 'id_ride__id_driver').annotate(
+            pickup_at=Min('created_at', filter=Q(event_type=PICKUP_EVENT)),
+            dropoff_at=Max('created_at', filter=Q(event_type=DROPOFF_EVENT)),
+        ).order_by()
+        for row in rows.iterator(chunk_size=5000):
+            known = bounds.get(row['id_ride'])
+            pickup_at, dropoff_at = row['pickup_at'], row['dropoff_at']
+            if known is not None:
+                pickup_at = min(filter(None, [pickup_at, known[1]]), default=None)
+                dropoff_at = max(filter(None, [dropoff_at, known[2]]), default=None)
+            bounds[row['id_ride']] = (row['id_ride__id_driver'], pickup_at, dropoff_at)
+
+    for id_ride, (id_driver, pickup_at, dropoff_at) in bounds.items():
+        if pickup_at and dropoff_at and pickup_at < dropoff_at:
+            yield id_ride, id_driver, pickup_at, dropoff_at
+
+
+def make_durations(duration_model, rows):
+    for id_ride, id_driver, pickup_at, dropoff_at in rows:
+        yield duration_model(
+            id_ride_id=id_ride,
+            id_driver_id=id_driver,
+            pickup_at=pickup_at,
+            dropoff_at=dropoff_at,
+            duration_seconds=(dropoff_at - pickup_at).total_seconds(),
+            month=pickup_at.astimezone(dt_timezone.utc).date().replace(day=1),
+        )
+
+
+def refresh_ride_durations(ride_ids):
+    """
+    Recompute the duration rows of the given rides from their events
+    """
+    ride_ids = set(ride_ids)
+    if not ride_ids:
+        return
+    durations = list(make_durations(
+        RideDuration, duration_rows([RideEvent, ArchivedRideEvent], ride_ids)
+    ))
+    with transaction.atomic():
+        RideDuration.objects.filter(id_ride__in=ride_ids).exclude(
+            id_ride__in=[duration.id_ride_id for duration in durations]
+        ).delete()
+        RideDuration.objects.bulk_create(
+            durations,
+            update_conflicts=True,
+            unique_fields=['id_ride'],
+            update_fields=['id_driver', 'pickup_at', 'dropoff_at', 'duration_seconds', 'month'],
+        )
+
+
+def rebuild_ride_durations(event_models=None, duration_model=RideDuration, batch_size=5000):
+    """
+    Recreate the whole duration table from ride events; returns the row count
+
+    Takes the models as arguments so migrations can pass historical ones.
+    """
+    if event_models is None:
+        event_models = [RideEvent, ArchivedRideEvent]
+    total = 0
+    with transaction.atomic():
+        duration_model.objects.all().delete()
+        durations = make_durations(duration_model, duration_rows(event_models))
+        while True:
+            batch = list(islice(durations, batch_size))
+            if not batch:
+                return total
+            duration_model.objects.bulk_create(batch)
+            total += len(batch)
+
+
+def long_trips(min_hours=1, month_from=None, month_to=None, driver=None):
+    """
+    Count of trips longer than min_hours per month and driver
+
+    Same result as the reporting SQL in the README, read from the
+    ride_duration table instead of self-joining ride_event.
+    """
+    durations = RideDuration.objects.filter(duration_seconds__gt=min_hours * 3600)
+    if month_from:
+        durations = durations.filter(month__gte=month_from)
+    if month_to:
+        durations = durations.filter(month__lte=month_to)
+    if driver:
+        durations = durations.filter(id_driver=driver)
+    counts = list(durations.values('month', 'id_driver').annotate(count=Count('*')).order_by())
+
+    names = {
+        id_user: f'{first_name} {last_name[:1]}'
+        for id_user, first_name, last_name in User.objects.filter(
+            id_user__in={row['id_driver'] for row in counts}
+        ).values_list('id_user', 'first_name', 'last_name')
+    }
+    report = [
+        {
+            'month': row['month'].strftime('%Y-%m'),
+            'id_driver': row['id_driver'],
+            'driver': names.get(row['id_driver'], ''),
+            'count': row['count'],
+        }
+        for row in counts
+    ]
+    report.sort(key=lambda row: (row['month'], row['driver'], row['id_driver']))
+    return report
+
+
+# Ride fields that decide a ride's DriverDailyStats row and distance
+DAILY_STATS_FIELDS = [
+    'id_driver', 'pickup_time', 'status',
+    'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude',
+]
+
+
+def daily_stats_entry(id_driver, pickup_time, status, pickup_lat, pickup_lon, dropoff_lat, dropoff_lon):
+    """
+    Return ((id_driver, day, status), distance_km) for one ride's values
+    """
+    day = pickup_time.astimezone(dt_timezone.utc).date()
+    return (id_driver, day, status), calculate_distance(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon)
+
+
+def ride_daily_stats_entry(ride):
+    return daily_stats_entry(
+        ride.id_driver_id, ride.pickup_time, ride.status,
+        ride.pickup_latitude, ride.pickup_longitude, ride.dropoff_latitude, ride.dropoff_longitude,
+    )
+
+
+def apply_daily_stats_deltas(deltas, lock_batch_size=100):
+    """
+    Add {(id_driver, day, status): (ride count, distance_km)} to the rollup
+
+    Missing rows are inserted empty first and exactly the touched rows are
+    locked, in primary key order, before they are changed, so concurrent
+    writers add up instead of racing or deadlocking. Keys are looked up per
+    (day, status) with their drivers, lock_batch_size pairs per query.
+    Rows are only inserted for keys that gain rides: removals always hit an
+    existing row, unless it went with a driver being deleted.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta[0] or delta[1]}
+    if not deltas:
+        return
+    drivers = defaultdict(set)
+    for id_driver, day, status in deltas:
+        drivers[day, status].add(id_driver)
+    groups = sorted(drivers.items())
+    with transaction.atomic():
+        DriverDailyStats.objects.bulk_create(
+            [
+                DriverDailyStats(id_driver_id=id_driver, day=day, status=status)
+                for (id_driver, day, status), (count, _) in deltas.items()
+                if count > 0
+            ],
+            ignore_conflicts=True,
+        )
+        changed = []
+        for start in range(0, len(groups), lock_batch_size):
+            keys = Q()
+            for (day, status), id_drivers in groups[start:start + lock_batch_size]:
+                keys |= Q(day=day, status=status, id_driver__in=sorted(id_drivers))
+            for row in DriverDailyStats.objects.select_for_update().filter(keys).order_by('pk'):
+                delta = deltas.get((row.id_driver_id, row.day, row.status))
+                if delta is not None:
+                    row.ride_count += delta[0]
+                    row.distance_km += delta[1]
+                    changed.append(row)
+        DriverDailyStats.objects.bulk_update(changed, ['ride_count', 'distance_km'])
+
+
+def daily_stats_deltas(added=(), removed=()):
+    """
+    Deltas for rides entering (added) and leaving (removed) the rollup
+    """
+    deltas = defaultdict(lambda: [0, 0.0])
+    for entries, sign in ((added, 1), (removed, -1)):
+        for key, distance in entries:
+            deltas[key][0] += sign
+            deltas[key][1] += sign * distance
+    return deltas
+
+
+def rebuild_driver_daily_stats(ride_model=Ride, stats_model=DriverDailyStats, batch_size=5000):
+    """
+    Recreate the whole rollup from the ride table; returns the row count
+
+    Takes the models as arguments so migrations can pass historical ones.
+    """
+    # Days are UTC dates, like the ones the signals add rides under
+    rows = ride_model.objects.annotate(day=TruncDate('pickup_time', tzinfo=dt_timezone.utc)).values(
+        'id_driver', 'day', 'status'
+    ).annotate(
+        ride_count=Count('*'),
+        distance_km=Sum(Haversine(
+            F('pickup_latitude'), F('pickup_longitude'), F('dropoff_latitude'), F('dropoff_longitude')
+        )),
+    ).order_by()
+    stats = (
+        stats_model(
+            id_driver_id=row['id_driver'], day=row['day'], status=row['status'],
+            ride_count=row['ride_count'], distance_km=row['distance_km'] or 0,
+        )
+        for row in rows.iterator(chunk_size=batch_size)
+    )
+    total = 0
+    with transaction.atomic():
+        stats_model.objects.all().delete()
+        while True:
+            batch = list(islice(stats, batch_size))
+            if not batch:
+                return total
+            stats_model.objects.bulk_create(batch)
+            total += len(batch)
+
+
+def driver_daily_stats(day_from=None, day_to=None, driver=None):
+    """
+    One row per driver and day with ride counts per status, the average
+    distance of non-cancelled rides and the cancellation rate
+
+    Reads only the driver_daily_stats rollup.
+    """
+    stats = DriverDailyStats.objects.all()
+    if day_from:
+        stats = stats.filter(day__gte=day_from)
+    if day_to:
+        stats = stats.filter(day__lte=day_to)
+    if driver:
+        stats = stats.filter(id_driver=driver)
+    not_cancelled = ~Q(status='cancelled')
+    return stats.values('day', 'id_driver').annotate(
+        rides=Sum('ride_count'),
+        completed_rides=Sum('ride_count', filter=not_cancelled),
+        completed_distance_km=Sum('distance_km', filter=not_cancelled),
+        **{
+            f'status_{status}': Sum('ride_count', filter=Q(status=status))
+            for status, _ in Ride.STATUS_CHOICES
+        },
+    ).filter(rides__gt=0).order_by('day', 'id_driver')
+
+
+def driver_daily_row(row):
+    """
+    Shape a driver_daily_stats() row for the API
+    """
+    rides = row['rides']
+    completed = row['completed_rides'] or 0
+    return {
+        'day': row['day'].isoformat(),
+        'id_driver': row['id_driver'],
+        'rides': rides,
+        'by_status': {status: row[f'status_{status}'] or 0 for status, _ in Ride.STATUS_CHOICES},
+        'avg_distance_km': round(row['completed_distance_km'] / completed, 3) if completed else None,
+        'cancellation_rate': round((rides - completed) / rides, 4),
+    }
@@ -1,7 +1,11 @@
+import math
+
+from asgiref.sync import sync_to_async
 from rest_framework import serializers
-from django.utils import timezone
-from datetime import timedelta
-from .models import User, Ride, RideEvent
+from rest_framework.exceptions import ValidationError
+from .cache import recent_event_cache
+from .metrics import timed
+from .models import User, Ride, RideEvent, ArchivedRideEvent
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -19,7 +23,22 @@ class RideEventSerializer(serializers.ModelSerializer):
     """
     class Meta:
         model = RideEvent
-        fields = ['id_ride_event', 'description', 'created_at']
+        fields = ['id_ride_event', 'description', 'event_type', 'created_at']
+        read_only_fields = ['event_type', 'created_at']
+
+
+class RideHistoryEventSerializer(serializers.Serializer):
+    """
+    A hot or archived event of GET /rides/{id}/history/
+    """
+    id_ride_event = serializers.IntegerField()
+    description = serializers.CharField()
+    event_type = serializers.IntegerField()
+    created_at = serializers.DateTimeField()
+    archived = serializers.SerializerMethodField()
+
+    def get_archived(self, obj):
+        return isinstance(obj, ArchivedRideEvent)
 
 
 class RideSerializer(serializers.ModelSerializer):
@@ -38,21 +57,223 @@ class RideSerializer(serializers.ModelSerializer):
             'dropoff_latitude', 'dropoff_longitude', 'pickup_time',
             'id_rider_data', 'id_driver_data', 'todays_ride_events'
         ]
+
+    def __init__(self, *args, fields=None, **kwargs):
+        """
+        Optionally restrict the output to `fields` (see get_ride_fields)
+        """
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
     
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
     def get_todays_ride_events(self, obj):
         """
         Get ride events from the last 24 hours
         """
-        # This will be optimized in the viewset using prefetch_related
-        twenty_four_hours_ago = timezone.now() - timedelta(hours=24)
-        events = getattr(obj, 'recent_events', obj.ride_events.filter(created_at__gte=twenty_four_hours_ago))
-        return RideEventSerializer(events, many=True).data
+        if hasattr(obj, 'recent_events'):
+            return RideEventSerializer(obj.recent_events, many=True).data
+        format_datetime = serializers.DateTimeField().to_representation
+        return [
+            recent_event_data(event, format_datetime)
+            for event in recent_event_cache.get_many([obj.id_ride]).get(obj.id_ride, [])
+        ]
+
+
+def recent_event_data(event, format_datetime):
+    """
+    RideEventSerializer output for a recent_event_cache entry
+    """
+    id_ride_event, description, event_type, created_at = event
+    return {
+        'id_ride_event': id_ride_event,
+        'description': description,
+        'event_type': event_type,
+        'created_at': format_datetime(created_at),
+    }
+
+
+# ?expand= names and the nested RideSerializer fields they add
+RIDE_EXPANSIONS = {
+    'rider': 'id_rider_data',
+    'driver': 'id_driver_data',
+    'events': 'todays_ride_events',
+}
+
+
+def get_ride_fields(query_params):
+    """
+    Return the RideSerializer fields selected by ?fields= and ?expand=
+
+    Without either parameter every field is returned. Otherwise the output
+    holds the plain fields listed in ?fields= (all of them when omitted)
+    plus the nested data named in ?expand=rider,driver,events.
+    """
+    all_fields = RideSerializer.Meta.fields
+    requested = query_params.get('fields')
+    expand = query_params.get('expand')
+    if requested is None and expand is None:
+        return list(all_fields)
+
+    nested = set(RIDE_EXPANSIONS.values())
+    plain = [name for name in all_fields if name not in nested]
+    selected = set(plain)
+    if requested:
+        selected = {name.strip() for name in requested.split(',') if name.strip()}
+        unknown = selected - set(plain)
+        if unknown:
+            raise ValidationError({'fields': f'Unknown fields: {", ".join(sorted(unknown))}'})
+
+    for name in (expand or '').split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in RIDE_EXPANSIONS:
+            raise ValidationError({'expand': f'Unknown expansion: {name}'})
+        selected.add(RIDE_EXPANSIONS[name])
+
+    return [name for name in all_fields if name in selected]
+
+
+class RideRowSerializer:
+    """
+    Read-only, high-throughput equivalent of RideSerializer(many=True)
+
+    Works on dict rows from `queryset.values(*RideRowSerializer.get_values_fields(fields))`
+    and takes today's events for all rows from recent_event_cache at once, so no
+    model instances or per-row serializer fields are created. The output is
+    identical to RideSerializer's, restricted to `fields` when given.
+    """
+    ride_fields = [
+        'id_ride', 'status', 'id_rider', 'id_driver',
+        'pickup_latitude', 'pickup_longitude',
+        'dropoff_latitude', 'dropoff_longitude', 'pickup_time',
+    ]
+    float_fields = {'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude'}
+    user_fields = UserSerializer.Meta.fields
+    values_fields = (
+        ride_fields
+        + ['modified_at']
+        + [f'id_rider__{field}' for field in user_fields]
+        + [f'id_driver__{field}' for field in user_fields]
+    )
+
+    def __init__(self, rows, fields=None, cache_events=True):
+        self.rows = rows
+        self.fields = RideSerializer.Meta.fields if fields is None else fields
+        self.cache_events = cache_events
+        self.format_datetime = serializers.DateTimeField().to_representation
+
+    @classmethod
+    def get_values_fields(cls, fields=None):
+        """
+        Return the values() columns needed to serialize `fields`
+
+        id_ride, pickup_time and modified_at are always included since event
+        grouping, keyset pagination and ETags rely on them.
+        """
+        if fields is None:
+            return cls.values_fields
+        values = ['id_ride', 'pickup_time', 'modified_at']
+        values += [name for name in cls.ride_fields if name in fields and name not in values]
+        if 'id_rider_data' in fields:
+            values += [f'id_rider__{field}' for field in cls.user_fields]
+        if 'id_driver_data' in fields:
+            values += [f'id_driver__{field}' for field in cls.user_fields]
+        return values
+
+    @property
+    def data(self):
+        rows = list(self.rows)
+        events = self.get_row_events(rows)
+        with timed('serialize'):
+            return self.to_representation(rows, events)
+
+    async def adata(self):
+        """
+        data for async views
+
+        rows may be a QuerySet or any other async iterable; the event cache
+        is read in a worker thread.
+        """
+        if hasattr(self.rows, '__aiter__'):
+            rows = [row async for row in self.rows]
+        else:
+            rows = list(self.rows)
+        events = await sync_to_async(self.get_row_events)(rows)
+        with timed('serialize'):
+            return self.to_representation(rows, events)
+
+    def get_row_events(self, rows):
+        if 'todays_ride_events' not in self.fields:
+            return {}
+        return self.get_todays_ride_events([row['id_ride'] for row in rows], self.format_datetime)
+
+    def to_representation(self, rows, events):
+        format_datetime = self.format_datetime
+        data = []
+        for row in rows:
+            item = {}
+            for name in self.fields:
+                if name in self.float_fields:
+                    item[name] = float(row[name])
+                elif name == 'pickup_time':
+                    item[name] = format_datetime(row[name])
+                elif name == 'id_rider_data':
+                    item[name] = self.user_data(row, 'id_rider')
+                elif name == 'id_driver_data':
+                    item[name] = self.user_data(row, 'id_driver')
+                elif name == 'todays_ride_events':
+                    item[name] = events.get(row['id_ride'], [])
+                else:
+                    item[name] = row[name]
+            data.append(item)
+        return data
+
+    def user_data(self, row, prefix):
+        return {field: row[f'{prefix}__{field}'] for field in self.user_fields}
+
+    def get_todays_ride_events(self, ride_ids, format_datetime):
+        """
+        Return {id_ride: [event data, ...]} for events of the last 24 hours
+
+        Served from recent_event_cache; rides it does not hold yet are
+        loaded with a single query.
+        """
+        return {
+            id_ride: [recent_event_data(event, format_datetime) for event in events]
+            for id_ride, events in recent_event_cache.get_many(ride_ids, store=self.cache_events).items()
+        }
+
+
+class CoordinateField(serializers.FloatField):
+    """
+    FloatField that also rejects NaN and infinity, which pass min/max checks
+    """
+    default_error_messages = {
+        'not_finite': 'A finite number is required.',
+    }
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        if not math.isfinite(value):
+            self.fail('not_finite')
+        return value
 
 
 class RideCreateUpdateSerializer(serializers.ModelSerializer):
     """
     Serializer for creating and updating rides
     """
+    pickup_latitude = CoordinateField(min_value=-90, max_value=90)
+    pickup_longitude = CoordinateField(min_value=-180, max_value=180)
+    dropoff_latitude = CoordinateField(min_value=-90, max_value=90)
+    dropoff_longitude = CoordinateField(min_value=-180, max_value=180)
+
     class Meta:
         model = Ride
         fields = [
@@ -60,3 +281,79 @@ class RideCreateUpdateSerializer(serializers.ModelSerializer):
             'pickup_latitude', 'pickup_longitude',
             'dropoff_latitude', 'dropoff_longitude', 'pickup_time'
         ]
+
+
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key field that resolves against objects preloaded into
+    context['related_objects'][model] instead of running a query per value
+    """
+
+    def to_internal_value(self, data):
+        related_objects = self.context.get('related_objects', {}).get(self.queryset.model)
+        if related_objects is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        obj = related_objects.get(pk)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+class RideBulkCreateSerializer(RideCreateUpdateSerializer):
+    """
+    One item of POST /rides/bulk/
+    """
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+
+    class Meta(RideCreateUpdateSerializer.Meta):
+        pass
+
+
+class RideEventBulkCreateSerializer(serializers.ModelSerializer):
+    """
+    One item of POST /ride-events/bulk/
+    """
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+
+    class Meta:
+        model = RideEvent
+        fields = ['id_ride', 'description']
+
+
+class DistanceMatrixSerializer(serializers.Serializer):
+    """
+    Input for the ride distance matrix: N origin points and M ride ids
+    """
+    origins = serializers.ListField(
+        child=serializers.ListField(child=CoordinateField(), min_length=2, max_length=2),
+        min_length=1, max_length=1000,
+        help_text='List of [latitude, longitude] pairs'
+    )
+    ride_ids = serializers.ListField(
+        child=serializers.IntegerField(), min_length=1, max_length=1000
+    )
+
+
+class LongTripsQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the long trips report; months are YYYY-MM
+    """
+    min_hours = serializers.FloatField(default=1, min_value=0)
+    month_from = serializers.DateField(required=False, input_formats=['%Y-%m'])
+    month_to = serializers.DateField(required=False, input_formats=['%Y-%m'])
+    driver = serializers.IntegerField(required=False)
+
+
+class DriverDailyQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the driver daily report; days are YYYY-MM-DD
+    """
+    day_from = serializers.DateField(required=False)
+    day_to = serializers.DateField(required=False)
+    driver = serializers.IntegerField(required=False)
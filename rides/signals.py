@@ -0,0 +1,248 @@
+from functools import partial
+
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .cache import recent_event_cache, response_cache
+from .authentication import api_key_cache
+from .models import ApiKey, Ride, RideEvent, RideDuration, User
+from .reports import (
+    DAILY_STATS_FIELDS, DURATION_EVENTS, apply_daily_stats_deltas, daily_stats_deltas, daily_stats_entry,
+    refresh_ride_durations, ride_daily_stats_entry,
+)
+from .serializers import UserSerializer
+from .spatial_index import active_ride_index
+
+
+# Sent with `instances` after a bulk_create(), which skips post_save.
+# Receivers get the whole batch so they can do their work in bulk too.
+bulk_created = Signal()
+
+
+def active_ride_values(ride):
+    return ride.id_ride, ride.status, ride.pickup_latitude, ride.pickup_longitude
+
+
+@receiver(post_save, sender=Ride)
+def update_active_ride_index(sender, instance, **kwargs):
+    """
+    Keep the in-process nearest-ride index in step with committed ride saves
+    """
+    transaction.on_commit(partial(active_ride_index.update, *active_ride_values(instance)))
+
+
+@receiver(bulk_created, sender=Ride)
+def bulk_update_active_ride_index(sender, instances, **kwargs):
+    rides = [active_ride_values(ride) for ride in instances]
+
+    def update():
+        for values in rides:
+            active_ride_index.update(*values)
+
+    transaction.on_commit(update)
+
+
+@receiver(post_delete, sender=Ride)
+def remove_from_active_ride_index(sender, instance, **kwargs):
+    transaction.on_commit(partial(active_ride_index.remove, instance.id_ride))
+
+
+@receiver(post_save, sender=Ride)
+@receiver(post_delete, sender=Ride)
+@receiver(post_save, sender=RideEvent)
+@receiver(post_delete, sender=RideEvent)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(bulk_created, sender=Ride)
+@receiver(bulk_created, sender=RideEvent)
+def invalidate_response_cache(sender, **kwargs):
+    """
+    Any write to data shown by the rides API orphans every cached response
+
+    Only once the write is committed: bumping earlier would let a request
+    still reading the old rows cache them under the new generation.
+    """
+    transaction.on_commit(response_cache.bump_generation)
+
+
+@receiver(post_save, sender=RideEvent)
+@receiver(post_delete, sender=RideEvent)
+def touch_ride_modified_at(sender, instance, **kwargs):
+    """
+    A new or removed event changes the ride's payload, so move its timestamp
+    """
+    Ride.objects.filter(pk=instance.id_ride_id).update(modified_at=timezone.now())
+
+
+@receiver(bulk_created, sender=RideEvent)
+def bulk_touch_ride_modified_at(sender, instances, **kwargs):
+    ride_ids = {event.id_ride_id for event in instances}
+    Ride.objects.filter(pk__in=ride_ids).update(modified_at=timezone.now())
+
+
+@receiver(post_save, sender=User)
+def touch_user_rides_modified_at(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Rides embed their rider and driver, so an edit of either moves their timestamps
+    """
+    if created or (update_fields is not None and not set(update_fields) & set(UserSerializer.Meta.fields)):
+        return
+    Ride.objects.filter(Q(id_rider=instance.pk) | Q(id_driver=instance.pk)).update(modified_at=timezone.now())
+
+
+@receiver(post_save, sender=RideEvent)
+@receiver(post_delete, sender=RideEvent)
+def refresh_recent_events(sender, instance, **kwargs):
+    """
+    Reload the ride's cached recent events once the write is committed
+    """
+    id_ride = instance.id_ride_id
+    transaction.on_commit(lambda: recent_event_cache.refresh([id_ride]))
+
+
+@receiver(bulk_created, sender=RideEvent)
+def bulk_refresh_recent_events(sender, instances, **kwargs):
+    ride_ids = {event.id_ride_id for event in instances}
+    transaction.on_commit(lambda: recent_event_cache.refresh(ride_ids))
+
+
+@receiver(post_save, sender=RideEvent)
+def update_ride_duration(sender, instance, created, **kwargs):
+    """
+    Keep the ride's pickup to dropoff duration in step with its events
+    """
+    # An edited event may have stopped being a pickup/dropoff, so always recheck
+    if instance.event_type in DURATION_EVENTS or not created:
+        refresh_ride_durations([instance.id_ride_id])
+
+
+@receiver(post_delete, sender=RideEvent)
+def remove_ride_duration(sender, instance, **kwargs):
+    if instance.event_type in DURATION_EVENTS:
+        # After commit, so a cascade from a deleted ride sees the ride gone
+        id_ride = instance.id_ride_id
+        transaction.on_commit(lambda: refresh_ride_durations([id_ride]))
+
+
+@receiver(bulk_created, sender=RideEvent)
+def bulk_update_ride_durations(sender, instances, **kwargs):
+    refresh_ride_durations(
+        event.id_ride_id for event in instances if event.event_type in DURATION_EVENTS
+    )
+
+
+@receiver(post_save, sender=Ride)
+def update_ride_duration_driver(sender, instance, created, **kwargs):
+    if not created:
+        RideDuration.objects.filter(id_ride=instance.pk).exclude(
+            id_driver=instance.id_driver_id
+        ).update(id_driver=instance.id_driver_id)
+
+
+@receiver(pre_save, sender=Ride)
+def remember_daily_stats_entry(sender, instance, update_fields=None, **kwargs):
+    """
+    Lock and remember the stored values the driver daily rollup counted
+
+    Ride.save() runs in a transaction, so the row stays locked until the
+    rollup has been moved over in post_save.
+    """
+    instance._daily_stats_before = None
+    if instance._state.adding:
+        return
+    if update_fields is not None and not set(DAILY_STATS_FIELDS) & set(update_fields):
+        instance._daily_stats_before = False
+        return
+    values = Ride.objects.select_for_update().filter(pk=instance.pk).values_list(*DAILY_STATS_FIELDS).first()
+    if values is not None:
+        instance._daily_stats_before = daily_stats_entry(*values)
+
+
+@receiver(post_save, sender=Ride)
+def update_driver_daily_stats(sender, instance, **kwargs):
+    before = instance.__dict__.pop('_daily_stats_before', None)
+    if before is False:
+        return
+    apply_daily_stats_deltas(daily_stats_deltas(
+        added=[ride_daily_stats_entry(instance)],
+        removed=[before] if before else [],
+    ))
+
+
+@receiver(post_delete, sender=Ride)
+def remove_from_driver_daily_stats(sender, instance, **kwargs):
+    apply_daily_stats_deltas(daily_stats_deltas(removed=[ride_daily_stats_entry(instance)]))
+
+
+@receiver(bulk_created, sender=Ride)
+def bulk_update_driver_daily_stats(sender, instances, **kwargs):
+    apply_daily_stats_deltas(daily_stats_deltas(added=[ride_daily_stats_entry(ride) for ride in instances]))
+
+
+@receiver(post_save, sender=ApiKey)
+@receiver(post_delete, sender=ApiKey)
+def invalidate_api_key_cache(sender, instance, **kwargs):
+    """
+    Revoked or changed keys must not stay cached
+    """
+    transaction.on_commit(partial(api_key_cache.invalidate, instance.id_user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_api_key_cache(sender, instance, update_fields=None, **kwargs):
+    """
+    Changed users (role, is_active) must not stay cached with their keys
+
+    Every login saves last_login alone, which cached keys do not depend on.
+    """
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    transaction.on_commit(partial(api_key_cache.invalidate, instance.pk))
+
+
+# Tables whose row count SQLite keeps in table_row_count via triggers
+COUNTED_TABLES = ['ride', 'ride_event']
+
+
+@receiver(post_migrate)
+def ensure_row_count_triggers(sender, using, **kwargs):
+    """
+    (Re)install the SQLite row count triggers after migrations
+
+    SQLite implements most ALTER TABLE operations by rebuilding the table,
+    which silently drops its triggers, so they are checked after every
+    migrate and the count is re-seeded whenever they had to be recreated.
+    """
+    if sender.name != 'rides':
+        return
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    # Migrated back to before 0003_table_row_count
+    if 'table_row_count' not in connection.introspection.table_names():
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        existing = {row[0] for row in cursor.fetchall()}
+        for table in COUNTED_TABLES:
+            if {f'{table}_count_insert', f'{table}_count_delete'} <= existing:
+                continue
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_count_insert")
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_count_delete")
+            cursor.execute(
+                f"CREATE TRIGGER {table}_count_insert AFTER INSERT ON {table} BEGIN "
+                f"UPDATE table_row_count SET row_count = row_count + 1 WHERE table_name = '{table}'; END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER {table}_count_delete AFTER DELETE ON {table} BEGIN "
+                f"UPDATE table_row_count SET row_count = row_count - 1 WHERE table_name = '{table}'; END"
+            )
+            cursor.execute(
+                f"INSERT OR REPLACE INTO table_row_count (table_name, row_count) "
+                f"SELECT '{table}', COUNT(*) FROM {table}"
+            )
@@ -0,0 +1,229 @@
+import heapq
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+from django.db import close_old_connections
+
+from .geo import (
+    EARTH_RADIUS_KM, GRID_CELL_DEGREES, GRID_COLUMNS, GRID_ROWS, calculate_distances, grid_cell,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Rides that a dispatcher can still be matched against
+ACTIVE_STATUSES = ('en-route', 'pickup')
+
+# Kilometers per degree of latitude
+KM_PER_DEGREE = math.radians(1) * EARTH_RADIUS_KM
+
+
+class ActiveRideIndex:
+    """
+    In-process uniform grid over the pickup coordinates of active rides
+
+    Buckets rides by the same grid cell as Ride.pickup_cell and answers
+    k-nearest queries by searching rings of cells outwards from the query
+    point. Each searched cell's coordinates are kept as NumPy arrays, so a
+    ring costs one vectorized distance computation.
+
+    Server processes build the index at startup and rebuild it every
+    max_age seconds in a background thread (see start_refreshing), so that
+    writes made by other worker processes show up too; elsewhere it is
+    built on first use. Committed Ride saves and deletes of this process
+    are applied in between (see rides.signals).
+    """
+
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._cells = {}
+        self._rides = {}
+        # cell -> (ids, lats, lons) arrays; rebuilt on the next search after a change
+        self._arrays = {}
+        self._built_at = None
+        # Changes made while a build reads the database, replayed onto its result
+        self._pending = None
+        self._refresher = None
+
+    def build(self):
+        """
+        (Re)load all active rides from the database
+        """
+        with self._build_lock:
+            self._build()
+
+    def _build(self):
+        from .models import Ride
+
+        with self._lock:
+            self._pending = []
+        try:
+            rows = Ride.objects.filter(status__in=ACTIVE_STATUSES).values_list(
+                'id_ride', 'pickup_latitude', 'pickup_longitude'
+            )
+            cells, rides = {}, {}
+            for id_ride, lat, lon in rows.iterator(chunk_size=5000):
+                cell = grid_cell(lat, lon)
+                cells.setdefault(cell, {})[id_ride] = (lat, lon)
+                rides[id_ride] = cell
+            arrays = {cell: self._bucket_arrays(bucket) for cell, bucket in cells.items()}
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._cells, self._rides, self._arrays = cells, rides, arrays
+            self._built_at = time.monotonic()
+            # The rows may predate these changes; each one sets the ride's
+            # final state, so replaying them in order is safe
+            for id_ride, position in pending:
+                self._apply(id_ride, position)
+
+    def start_refreshing(self):
+        """
+        Build now and every max_age seconds in a daemon thread
+        """
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(target=self._refresh, name='active-ride-index', daemon=True)
+        self._refresher.start()
+
+    def _refresh(self):
+        while True:
+            try:
+                self.build()
+            except Exception:
+                logger.exception('Building the active ride index failed')
+            finally:
+                close_old_connections()
+            time.sleep(self.max_age)
+
+    def clear(self):
+        with self._lock:
+            self._cells, self._rides, self._arrays = {}, {}, {}
+            self._built_at = None
+
+    def _ensure_built(self):
+        # Only until the first build; later rebuilds happen in the refresher
+        if self._built_at is None:
+            with self._build_lock:
+                if self._built_at is None:
+                    self._build()
+
+    def add(self, id_ride, lat, lon):
+        self._change(id_ride, (lat, lon))
+
+    def remove(self, id_ride):
+        self._change(id_ride, None)
+
+    def _change(self, id_ride, position):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((id_ride, position))
+            if self._built_at is not None:
+                self._apply(id_ride, position)
+
+    def _apply(self, id_ride, position):
+        cell = self._rides.pop(id_ride, None)
+        if cell is not None:
+            self._arrays.pop(cell, None)
+            bucket = self._cells[cell]
+            bucket.pop(id_ride, None)
+            if not bucket:
+                del self._cells[cell]
+        if position is not None:
+            cell = grid_cell(*position)
+            self._cells.setdefault(cell, {})[id_ride] = position
+            self._rides[id_ride] = cell
+            self._arrays.pop(cell, None)
+
+    def update(self, id_ride, status, lat, lon):
+        """
+        Add, move or drop a ride depending on its status
+        """
+        if status in ACTIVE_STATUSES:
+            self.add(id_ride, lat, lon)
+        else:
+            self.remove(id_ride)
+
+    def __len__(self):
+        return len(self._rides)
+
+    def nearest(self, lat, lon, k):
+        """
+        Return up to k (distance_km, id_ride) pairs closest to (lat, lon)
+        """
+        self._ensure_built()
+        with self._lock:
+            if not self._rides:
+                return []
+            return self._search(lat, lon, k)
+
+    def _search(self, lat, lon, k):
+        center = grid_cell(lat, lon)
+        center_row, center_column = divmod(center, GRID_COLUMNS)
+
+        found = []
+        ring = 0
+        while True:
+            ring_cells = 1 if ring == 0 else 8 * ring
+            if ring_cells > len(self._cells) or ring > max(GRID_ROWS, GRID_COLUMNS // 2):
+                # Cheaper to look at every occupied cell than to keep walking rings
+                return self._nearest(lat, lon, list(self._cells), k)
+
+            found = heapq.nsmallest(k, found + self._nearest(lat, lon, self._ring(center_row, center_column, ring), k))
+
+            # Nothing outside the searched square can be closer than this
+            edge_lat = min(abs(lat) + (ring + 1) * GRID_CELL_DEGREES, 90.0)
+            bound_km = ring * GRID_CELL_DEGREES * KM_PER_DEGREE * math.cos(math.radians(edge_lat))
+            if len(found) == k and found[-1][0] <= bound_km:
+                return found
+            ring += 1
+
+    def _ring(self, center_row, center_column, ring):
+        for row in range(center_row - ring, center_row + ring + 1):
+            if not 0 <= row < GRID_ROWS:
+                continue
+            on_edge = row in (center_row - ring, center_row + ring)
+            step = 1 if on_edge else 2 * ring
+            for column in range(center_column - ring, center_column + ring + 1, step or 1):
+                yield row * GRID_COLUMNS + column % GRID_COLUMNS
+
+    def _nearest(self, lat, lon, cells, k):
+        """
+        Return up to k (distance_km, id_ride) pairs, nearest first, among
+        the rides in cells
+        """
+        arrays = [self._cell_arrays(cell) for cell in cells if cell in self._cells]
+        if not arrays:
+            return []
+        ids, lats, lons = (np.concatenate(column) for column in zip(*arrays))
+        distances = calculate_distances(lat, lon, lats, lons)
+        if len(distances) > k:
+            nearest = np.argpartition(distances, k - 1)[:k]
+        else:
+            nearest = np.arange(len(distances))
+        return sorted(zip(distances[nearest].tolist(), ids[nearest].tolist()))
+
+    def _cell_arrays(self, cell):
+        arrays = self._arrays.get(cell)
+        if arrays is None:
+            arrays = self._arrays[cell] = self._bucket_arrays(self._cells[cell])
+        return arrays
+
+    @staticmethod
+    def _bucket_arrays(bucket):
+        coordinates = np.array(list(bucket.values()), dtype=float).reshape(-1, 2)
+        ids = np.fromiter(bucket, dtype=np.int64, count=len(bucket))
+        return ids, coordinates[:, 0], coordinates[:, 1]
+
+
+active_ride_index = ActiveRideIndex()
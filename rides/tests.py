@@ -1,3 +1,1703 @@
-from django.test import TestCase
+import base64
+import csv
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+from functools import partial
+from importlib import import_module
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import update_last_login
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import F, Prefetch, Value
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import ApiKeyAuthentication, ApiKeyCache, api_key_cache
+from .benchmarks import compare, load_baseline, run_scenarios, seed_rides
+from .cache import recent_event_cache, response_cache
+from .db_routers import ReplicaRouter, end_pin_state, start_pin_state
+from .export import csv_columns, iter_ride_rows
+from .filters import RideFilter
+from .geo import EARTH_RADIUS_KM, Haversine, calculate_distance, grid_cell
+from .metrics import endpoint_metrics
+from .middleware import ReplicaPinningMiddleware
+from .models import (
+    User, Ride, RideEvent, ArchivedRideEvent, RideDuration, DriverDailyStats, ApiKey, ImportCheckpoint,
+    TableRowCount,
+)
+from .pagination import estimate_row_count
+from .reports import apply_daily_stats_deltas, long_trips, rebuild_driver_daily_stats, rebuild_ride_durations
+from .serializers import RideSerializer, RideRowSerializer, UserSerializer
+from .signals import ensure_row_count_triggers
+from .spatial_index import ActiveRideIndex, active_ride_index
+
+
+class RideRowSerializerTests(TestCase):
+    """
+    RideRowSerializer must produce exactly what RideSerializer produces
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123',
+            first_name='Admin', last_name='User', role='admin',
+        )
+        rider = User.objects.create_user(
+            username='rider', email='rider@example.com', password='rider123',
+            first_name='Rita', last_name='Rider', role='rider', phone_number='+1-555-0100',
+        )
+        driver = User.objects.create_user(
+            username='driver', email='driver@wingz.com', password='driver123',
+            first_name='Dan', last_name='Driver', role='driver',
+        )
+        now = timezone.now()
+        for i in range(5):
+            ride = Ride.objects.create(
+                status=['en-route', 'pickup', 'dropoff', 'completed', 'cancelled'][i],
+                id_rider=rider, id_driver=driver,
+                pickup_latitude=37.7 + i / 100, pickup_longitude=-122.4,
+                dropoff_latitude=37.8, dropoff_longitude=-122.3 - i / 100,
+                pickup_time=now - timedelta(days=i, microseconds=i),
+            )
+            for hours_ago in range(i):
+                RideEvent.objects.create(id_ride=ride, description=f'Event {hours_ago}')
+            # Events older than 24 hours are never shown
+            old_event = RideEvent.objects.create(id_ride=ride, description='Old event')
+            RideEvent.objects.filter(pk=old_event.pk).update(created_at=now - timedelta(days=2))
+
+    def setUp(self):
+        # Cached recent events must not leak between tests
+        cache.clear()
+
+    def test_matches_ride_serializer(self):
+        queryset = Ride.objects.select_related('id_rider', 'id_driver').prefetch_related(
+            Prefetch(
+                'ride_events',
+                queryset=RideEvent.objects.filter(
+                    created_at__gte=timezone.now() - timedelta(hours=24)
+                ).order_by('id_ride_event'),
+                to_attr='recent_events'
+            )
+        ).order_by('id_ride')
+
+        expected = RideSerializer(queryset, many=True).data
+        rows = queryset.values(*RideRowSerializer.values_fields)
+        self.assertEqual(RideRowSerializer(rows).data, expected)
+
+    def test_list_endpoint_matches_detail_endpoint(self):
+        self.client.force_login(self.admin)
+        listed = self.client.get('/api/v1/rides/?ordering=pickup_time').json()['results']
+        for ride in listed:
+            self.assertEqual(ride, self.client.get(f"/api/v1/rides/{ride['id_ride']}/").json())
+
+    def test_uses_two_queries_for_any_number_of_rides(self):
+        rows = Ride.objects.values(*RideRowSerializer.values_fields)
+        with self.assertNumQueries(2):
+            RideRowSerializer(rows).data
+        # Once cached, today's events need no query at all
+        with self.assertNumQueries(1):
+            RideRowSerializer(rows.all()).data
+
+    def test_new_events_reach_the_event_cache(self):
+        ride = Ride.objects.order_by('id_ride').first()
+        rows = Ride.objects.filter(pk=ride.pk).values(*RideRowSerializer.values_fields)
+        before = RideRowSerializer(rows).data[0]['todays_ride_events']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            event = RideEvent.objects.create(id_ride=ride, description='Status changed to pickup')
+        after = RideRowSerializer(rows.all()).data[0]['todays_ride_events']
+        self.assertEqual(len(after), len(before) + 1)
+        self.assertEqual(after[-1]['id_ride_event'], event.pk)
+        self.assertEqual(after[-1]['event_type'], RideEvent.EventType.PICKUP)
+
+    def test_sparse_fields_match_detail_endpoint(self):
+        self.client.force_login(self.admin)
+        query = 'fields=id_ride,pickup_latitude,pickup_longitude&expand=driver,events'
+        listed = self.client.get(f'/api/v1/rides/?ordering=pickup_time&{query}').json()['results']
+        self.assertEqual(
+            list(listed[0]),
+            ['id_ride', 'pickup_latitude', 'pickup_longitude', 'id_driver_data', 'todays_ride_events'],
+        )
+        for ride in listed:
+            self.assertEqual(ride, self.client.get(f"/api/v1/rides/{ride['id_ride']}/?{query}").json())
+
+    def test_async_endpoints_match_sync_endpoints(self):
+        self.client.force_login(self.admin)
+        for query in ['ordering=pickup_time', 'fields=id_ride,status&expand=rider', 'pagination=cursor&page_size=2']:
+            expected = self.client.get(f'/api/v1/rides/?{query}').json()
+            listed = self.client.get(f'/api/v1/async/rides/?{query}').json()
+            self.assertEqual(listed['results'], expected['results'])
+        for ride in listed['results']:
+            self.assertEqual(
+                self.client.get(f"/api/v1/async/rides/{ride['id_ride']}/").json(),
+                self.client.get(f"/api/v1/rides/{ride['id_ride']}/").json(),
+            )
+        self.assertEqual(
+            self.client.get('/api/v1/async/ride-events/?ordering=id_ride_event').json()['results'],
+            self.client.get('/api/v1/ride-events/?ordering=id_ride_event').json()['results'],
+        )
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/v1/async/rides/').status_code, 401)
+
+
+class ResponseCacheTests(TestCase):
+    """
+    Cached ride responses are dropped once a write they depend on commits
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        cls.ride = Ride.objects.create(
+            status='pickup', id_rider=cls.admin, id_driver=cls.admin, pickup_latitude=37.77,
+            pickup_longitude=-122.41, dropoff_latitude=37.8, dropoff_longitude=-122.3, pickup_time=timezone.now(),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+        self.urls = ['/api/v1/rides/', f'/api/v1/rides/{self.ride.pk}/']
+        for url in self.urls:
+            self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+    def assertInvalidated(self, write):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                write()
+                generation = response_cache.generation()
+            # Not before the write commits
+            self.assertEqual(response_cache.generation(), generation)
+        self.assertGreater(response_cache.generation(), generation)
+        return [self.client.get(url) for url in self.urls]
+
+    def test_ride_update(self):
+        def write():
+            self.ride.status = 'dropoff'
+            self.ride.save()
+
+        listed, detail = self.assertInvalidated(write)
+        self.assertEqual(listed['X-Cache'], 'MISS')
+        self.assertEqual(listed.json()['results'][0]['status'], 'dropoff')
+        self.assertEqual(detail['X-Cache'], 'MISS')
+        self.assertEqual(detail.json()['status'], 'dropoff')
+
+    def test_event_and_user_writes(self):
+        listed, detail = self.assertInvalidated(
+            lambda: RideEvent.objects.create(id_ride=self.ride, description='Passenger picked up')
+        )
+        self.assertEqual(detail.json()['todays_ride_events'][0]['description'], 'Passenger picked up')
+
+        def rename():
+            self.admin.first_name = 'Ada'
+            self.admin.save()
+
+        listed, detail = self.assertInvalidated(rename)
+        self.assertEqual(listed.json()['results'][0]['id_rider_data']['first_name'], 'Ada')
+        self.assertEqual(detail.json()['id_driver_data']['first_name'], 'Ada')
+
+    def test_rolled_back_write_keeps_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Ride.objects.filter(pk=self.ride.pk).first().delete()
+                transaction.set_rollback(True)
+        for url in self.urls:
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+
+class RecentEventCacheTests(TestCase):
+    """
+    Recent events are cached per ride as rides are read, and warmed at startup
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        cls.rides = [
+            Ride.objects.create(
+                status='pickup', id_rider=cls.admin, id_driver=cls.admin, pickup_latitude=37.77,
+                pickup_longitude=-122.41, dropoff_latitude=37.8, dropoff_longitude=-122.3, pickup_time=timezone.now(),
+            )
+            for _ in range(2)
+        ]
+        for ride in cls.rides:
+            RideEvent.objects.create(id_ride=ride, description='Status changed to pickup')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def test_fills_with_the_rides_read(self):
+        read, unread = self.rides
+        response = self.client.get(f'/api/v1/rides/{read.pk}/')
+        self.assertEqual(len(response.json()['todays_ride_events']), 1)
+        self.assertIsNotNone(cache.get(recent_event_cache.key(read.pk)))
+        self.assertIsNone(cache.get(recent_event_cache.key(unread.pk)))
+
+        with self.assertNumQueries(0):
+            events = recent_event_cache.get_many([read.pk])
+        self.assertEqual([event[1] for event in events[read.pk]], ['Status changed to pickup'])
+
+    def test_warm_stores_the_window(self):
+        old = RideEvent.objects.create(id_ride=self.rides[0], description='Status changed to en-route')
+        RideEvent.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=2))
+        recent_event_cache.warm(batch_size=1)
+
+        with self.assertNumQueries(0):
+            events = recent_event_cache.get_many([ride.pk for ride in self.rides])
+        self.assertEqual([[event[1] for event in events[ride.pk]] for ride in self.rides], [
+            ['Status changed to pickup'], ['Status changed to pickup'],
+        ])
+
+    def test_local_memory_entries_expire_quickly(self):
+        with self.settings(RESPONSE_CACHE_TIMEOUT=60):
+            self.assertEqual(recent_event_cache.timeout, 60)
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        with self.settings(CACHES=shared):
+            self.assertEqual(recent_event_cache.timeout, 24 * 60 * 60)
+
+
+class ConditionalGetTests(TestCase):
+    """
+    ETags change with every write the response depends on, and only those
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        cls.rider = User.objects.create_user(
+            username='rider', email='rider@example.com', password='rider123', first_name='Rita', role='rider',
+        )
+        cls.rides = [
+            Ride.objects.create(
+                status='completed', id_rider=cls.rider, id_driver=cls.admin,
+                pickup_latitude=37.77, pickup_longitude=-122.41, dropoff_latitude=37.8,
+                dropoff_longitude=-122.3, pickup_time=timezone.now() - timedelta(hours=i),
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def assertRevalidates(self, url, write):
+        etag = self.client.get(url)['ETag']
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response.json()
+
+    def test_rider_edit_changes_list_and_detail(self):
+        def rename():
+            self.rider.first_name = 'Rosa'
+            self.rider.save()
+
+        ride = self.rides[-1]
+        data = self.assertRevalidates(f'/api/v1/rides/{ride.pk}/', rename)
+        self.assertEqual(data['id_rider_data']['first_name'], 'Rosa')
+        self.rider.first_name = 'Rita'
+        data = self.assertRevalidates('/api/v1/rides/?ordering=pickup_time', rename)
+        self.assertEqual(data['results'][0]['id_rider_data']['first_name'], 'Rosa')
+
+    def test_deleting_an_older_ride_changes_the_list(self):
+        deleted = self.rides[-1].pk
+        data = self.assertRevalidates('/api/v1/rides/?status=completed', self.rides[-1].delete)
+        self.assertNotIn(deleted, [ride['id_ride'] for ride in data['results']])
+
+    def test_new_event_changes_the_ride(self):
+        ride = self.rides[0]
+        data = self.assertRevalidates(
+            f'/api/v1/rides/{ride.pk}/',
+            lambda: RideEvent.objects.create(id_ride=ride, description='Status changed to dropoff'),
+        )
+        self.assertEqual(len(data['todays_ride_events']), 1)
+
+    def test_unrelated_writes_keep_the_etag(self):
+        url = '/api/v1/rides/?status=completed'
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Ride.objects.create(
+                status='cancelled', id_rider=self.admin, id_driver=self.admin, pickup_latitude=37.77,
+                pickup_longitude=-122.41, dropoff_latitude=37.8, dropoff_longitude=-122.3,
+                pickup_time=timezone.now(),
+            )
+        # The response cache is invalidated, but the 304 still comes before serializing
+        with mock.patch.object(RideRowSerializer, 'to_representation') as to_representation:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        to_representation.assert_not_called()
+
+    def test_if_modified_since_on_detail(self):
+        ride = self.rides[0]
+        url = f'/api/v1/rides/{ride.pk}/'
+        last_modified = self.client.get(url)['Last-Modified']
+        not_modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['Last-Modified'], last_modified)
+        self.assertIn('ETag', not_modified)
+
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=2)):
+            with self.captureOnCommitCallbacks(execute=True):
+                RideEvent.objects.create(id_ride=ride, description='Status changed to dropoff')
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+        # Lists also change by rides leaving them, which no timestamp records
+        self.assertNotIn('Last-Modified', self.client.get('/api/v1/rides/'))
+
+    def test_validator_needs_no_query(self):
+        url = '/api/v1/rides/?status=completed'
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertFalse([query for query in queries if 'ride' in query['sql']])
+
+        # One count for a filtered list, none at all for keyset pages
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertEqual(len([query for query in queries if 'COUNT(' in query['sql']]), 1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/rides/?pagination=cursor')
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+        self.assertNotIn('ETag', response)
+
+
+class DistanceSortTests(TestCase):
+    """
+    ?sort_by_distance= orders by the database-side Haversine distance
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        generator = random.Random(1)
+        cls.pickups = [(generator.uniform(-60, 60), generator.uniform(-180, 180)) for _ in range(12)]
+        # Antipodal to the origin below, where rounding pushes the Haversine term just past 1
+        cls.pickups.append((-12.0, -54.75))
+        for lat, lon in cls.pickups:
+            Ride.objects.create(
+                status='pickup', id_rider=cls.admin, id_driver=cls.admin, pickup_latitude=lat,
+                pickup_longitude=lon, dropoff_latitude=lat, dropoff_longitude=lon, pickup_time=timezone.now(),
+            )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def sorted_list(self, page_size=50):
+        return self.client.get('/api/v1/rides/', {
+            'sort_by_distance': 'true', 'lat': 12.0, 'lon': 125.25, 'page_size': page_size,
+        })
+
+    def test_orders_by_distance(self):
+        response = self.sorted_list()
+        self.assertEqual(response.status_code, 200)
+        pickups = [(ride['pickup_latitude'], ride['pickup_longitude']) for ride in response.json()['results']]
+        self.assertEqual(pickups, sorted(self.pickups, key=lambda pickup: calculate_distance(12.0, 125.25, *pickup)))
+        self.assertEqual(pickups[-1], (-12.0, -54.75))
+        farthest = Ride.objects.filter(pickup_latitude=-12.0).annotate(
+            distance=Haversine(Value(12.0), Value(125.25), F('pickup_latitude'), F('pickup_longitude'))
+        ).get()
+        self.assertAlmostEqual(farthest.distance, math.pi * EARTH_RADIUS_KM)
+
+    def test_query_count_does_not_grow_with_rides(self):
+        counts = []
+        for page_size in [2, 13]:
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(len(self.sorted_list(page_size).json()['results']), page_size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class DistanceMatrixTests(TestCase):
+    """
+    POST /rides/distance-matrix/ agrees with calculate_distance
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        cls.rides = [
+            Ride.objects.create(
+                status='pickup', id_rider=cls.admin, id_driver=cls.admin,
+                pickup_latitude=37.7 + i * 0.05, pickup_longitude=-122.4 + i * 0.07,
+                dropoff_latitude=37.8, dropoff_longitude=-122.3, pickup_time=timezone.now(),
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def post(self, origins, ride_ids):
+        return self.client.post(
+            '/api/v1/rides/distance-matrix/', json.dumps({'origins': origins, 'ride_ids': ride_ids}),
+            content_type='application/json',
+        )
+
+    def test_matches_calculate_distance(self):
+        origins = [[37.7749, -122.4194], [-33.86, 151.21]]
+        rides = [self.rides[2], self.rides[0], self.rides[2]]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(origins, [ride.pk for ride in rides])
+        self.assertEqual(response.status_code, 200)
+        matrix = response.json()['distances_km']
+        self.assertEqual((len(matrix), len(matrix[0])), (2, 3))
+        for row, (lat, lon) in zip(matrix, origins):
+            expected = [calculate_distance(lat, lon, ride.pickup_latitude, ride.pickup_longitude) for ride in rides]
+            for distance, exact in zip(row, expected):
+                self.assertAlmostEqual(distance, exact, places=9)
+        self.assertEqual(len([query for query in queries if 'FROM "ride"' in query['sql']]), 1)
+
+    def test_rejects_unknown_ride_ids(self):
+        response = self.post([[37.7749, -122.4194]], [self.rides[0].pk, 999999])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('999999', response.json()['ride_ids'])
+
+    def test_limits(self):
+        ride_ids = [ride.pk for ride in self.rides]
+        origin = [37.7749, -122.4194]
+        response = self.post([origin] * 1000, (ride_ids * 334)[:1000])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['distances_km']), 1000)
+        self.assertEqual(len(response.json()['distances_km'][0]), 1000)
+
+        self.assertEqual(self.post([origin] * 1001, ride_ids).status_code, 400)
+        self.assertEqual(self.post([origin], (ride_ids * 334)[:1001]).status_code, 400)
+        self.assertEqual(self.post([], ride_ids).status_code, 400)
+        self.assertEqual(self.post([[37.7749]], ride_ids).status_code, 400)
+
+
+class RideFilterTests(TestCase):
+    """
+    Radius filter against a brute force distance check, and its validation
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        cls.rides = [
+            Ride.objects.create(
+                status='pickup', id_rider=cls.admin, id_driver=cls.admin,
+                pickup_latitude=37.7749 + i * 0.01, pickup_longitude=-122.4194 - i * 0.015,
+                dropoff_latitude=37.8, dropoff_longitude=-122.3, pickup_time=timezone.now(),
+            )
+            for i in range(40)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def test_radius_matches_exact_distances(self):
+        for radius_km in [0.5, 3, 12, 60]:
+            expected = sorted(
+                ride.pk for ride in self.rides
+                if calculate_distance(37.7749, -122.4194, ride.pickup_latitude, ride.pickup_longitude) <= radius_km
+            )
+            response = self.client.get(
+                f'/api/v1/rides/?lat=37.7749&lon=-122.4194&radius_km={radius_km}&page_size=100&fields=id_ride'
+            )
+            self.assertEqual(sorted(ride['id_ride'] for ride in response.json()['results']), expected)
+
+    def test_radius_is_checked_in_sql(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/v1/rides/?lat=37.7749&lon=-122.4194&radius_km=60&page_size=100')
+        self.assertEqual(len([query for query in queries if 'HAVERSINE' in query['sql']]), 2)
+
+    def test_rejects_invalid_coordinates_and_radius(self):
+        for query in [
+            'lat=37.7&lon=-122.4&radius_km=-5', 'lat=37.7&lon=-122.4&radius_km=0',
+            'lat=nan&lon=-122.4&radius_km=1', 'lat=37.7&lon=inf&radius_km=1', 'lat=37.7&lon=-122.4&radius_km=nan',
+            'lat=91&lon=-122.4&radius_km=1', 'lat=37.7&lon=-181&radius_km=1', 'lat=37.7&radius_km=1',
+        ]:
+            self.assertEqual(self.client.get(f'/api/v1/rides/?{query}').status_code, 400, query)
+
+
+class RiderEmailFilterTests(TestCase):
+    """
+    ?rider_email= in its three match modes
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        cls.riders = {
+            email: User.objects.create_user(username=email, email=email, role='rider')
+            for email in ['ANNA@example.com', 'anna.b@example.com', 'JoAnna@example.org', 'bob@example.com']
+        }
+        for rider in cls.riders.values():
+            Ride.objects.create(
+                status='pickup', id_rider=rider, id_driver=cls.admin, pickup_latitude=37.77,
+                pickup_longitude=-122.41, dropoff_latitude=37.8, dropoff_longitude=-122.3, pickup_time=timezone.now(),
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def rider_emails(self, query):
+        response = self.client.get(f'/api/v1/rides/?{query}&expand=rider&fields=id_ride')
+        self.assertEqual(response.status_code, 200)
+        return sorted(ride['id_rider_data']['email'] for ride in response.json()['results'])
+
+    def test_match_modes(self):
+        cases = [
+            ('rider_email=anna@example.COM&rider_email_match=exact', ['ANNA@example.com']),
+            ('rider_email=ANNA&rider_email_match=prefix', ['ANNA@example.com', 'anna.b@example.com']),
+            ('rider_email=anna', ['ANNA@example.com', 'JoAnna@example.org', 'anna.b@example.com']),
+            ('rider_email=EXAMPLE.ORG&rider_email_match=substring', ['JoAnna@example.org']),
+            ('rider_email=nobody&rider_email_match=prefix', []),
+        ]
+        for query, expected in cases:
+            self.assertEqual(self.rider_emails(query), expected, query)
+
+    def test_many_riders_fall_back_to_a_subquery(self):
+        with mock.patch.object(RideFilter, 'max_rider_ids', 2):
+            with CaptureQueriesContext(connection) as queries:
+                emails = self.rider_emails('rider_email=example&page_size=100')
+        self.assertEqual(emails, sorted(self.riders))
+        rides_query = [query['sql'] for query in queries if query['sql'].startswith('SELECT "ride"')][-1]
+        self.assertIn('IN (SELECT', rides_query)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.rider_emails('rider_email=example&page_size=100&status=pickup')
+        rides_query = [query['sql'] for query in queries if query['sql'].startswith('SELECT "ride"')][-1]
+        self.assertNotIn('IN (SELECT', rides_query)
+
+    def test_rejects_unknown_match_modes(self):
+        for mode in ['fuzzy', 'EXACT', 'suffix']:
+            response = self.client.get(f'/api/v1/rides/?rider_email=anna&rider_email_match={mode}')
+            self.assertEqual(response.status_code, 400, mode)
+            self.assertIn('rider_email_match', response.json())
+
+
+class RideEventFilterTests(TestCase):
+    """
+    RideEventFilter and the event_type classification it relies on
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        cls.ride = Ride.objects.create(
+            status='dropoff', id_rider=cls.admin, id_driver=cls.admin, pickup_latitude=37.77,
+            pickup_longitude=-122.41, dropoff_latitude=37.8, dropoff_longitude=-122.3, pickup_time=timezone.now(),
+        )
+        cls.start = timezone.now() - timedelta(hours=3)
+        cls.events = [
+            RideEvent.objects.create(
+                id_ride=cls.ride, description=description, created_at=cls.start + timedelta(hours=i),
+            )
+            for i, description in enumerate(['Status changed to pickup', 'Status changed to dropoff', 'Honked twice'])
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def event_ids(self, query):
+        response = self.client.get(f'/api/v1/ride-events/?{query}')
+        self.assertEqual(response.status_code, 200, query)
+        return sorted(event['id_ride_event'] for event in response.json()['results'])
+
+    def test_event_type_by_name_or_value(self):
+        pickup, dropoff, other = [event.pk for event in self.events]
+        self.assertEqual(self.event_ids('event_type=pickup'), [pickup])
+        self.assertEqual(self.event_ids('event_type=PICKUP,dropoff'), [pickup, dropoff])
+        self.assertEqual(self.event_ids(f'event_type={RideEvent.EventType.DROPOFF.value}, other'), [dropoff, other])
+
+    def test_rejects_unknown_event_types(self):
+        for value in ['teleported', '99', '-1', 'pickup,nope']:
+            response = self.client.get(f'/api/v1/ride-events/?event_type={value}')
+            self.assertEqual(response.status_code, 400, value)
+            self.assertIn('event_type', response.json())
+
+    def test_created_after_and_before(self):
+        pickup, dropoff, other = [event.pk for event in self.events]
+        after = (self.start + timedelta(hours=1)).isoformat().replace('+00:00', 'Z')
+        before = (self.start + timedelta(hours=2)).isoformat().replace('+00:00', 'Z')
+        self.assertEqual(self.event_ids(f'created_after={after}'), [dropoff, other])
+        self.assertEqual(self.event_ids(f'created_before={before}'), [pickup, dropoff])
+        self.assertEqual(self.event_ids(f'created_after={after}&created_before={before}&event_type=dropoff'), [dropoff])
+        self.assertEqual(self.client.get('/api/v1/ride-events/?created_after=yesterday').status_code, 400)
+
+    def test_save_classifies_the_description(self):
+        self.assertEqual(
+            [event.event_type for event in self.events],
+            [RideEvent.EventType.PICKUP, RideEvent.EventType.DROPOFF, RideEvent.EventType.OTHER],
+        )
+        event = self.events[2]
+        event.description = 'Ride completed'
+        event.save(update_fields=['description'])
+        event.refresh_from_db()
+        self.assertEqual(event.event_type, RideEvent.EventType.RIDE_COMPLETED)
+
+    def test_bulk_insert_classifies_the_description(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/ride-events/bulk/', json.dumps([
+                {'id_ride': self.ride.pk, 'description': 'Passenger picked up'},
+                {'id_ride': self.ride.pk, 'description': 'passenger picked up'},
+            ]), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        created = RideEvent.objects.filter(pk__in=[item['id_ride_event'] for item in response.json()['created']])
+        self.assertEqual(
+            sorted(created.values_list('event_type', flat=True)),
+            [RideEvent.EventType.OTHER, RideEvent.EventType.PASSENGER_PICKED_UP],
+        )
+
+    def test_migration_classifies_existing_events(self):
+        migration = import_module('rides.migrations.0009_ride_event_event_type')
+        RideEvent.objects.update(event_type=RideEvent.EventType.OTHER)
+        with mock.patch.object(migration, 'BATCH_SIZE', 2):
+            migration.classify_event_types(apps, None)
+        self.assertEqual(
+            list(RideEvent.objects.order_by('pk').values_list('event_type', flat=True)),
+            [RideEvent.EventType.PICKUP, RideEvent.EventType.DROPOFF, RideEvent.EventType.OTHER],
+        )
+
+
+class ActiveRideIndexTests(SimpleTestCase):
+    """
+    k-nearest searches agree with a brute force scan
+    """
+
+    def test_matches_brute_force(self):
+        index = ActiveRideIndex()
+        index._built_at = time.monotonic()
+        rng = random.Random(7)
+        rides = {}
+        for id_ride in range(3000):
+            rides[id_ride] = (37.7749 + rng.uniform(-0.3, 0.3), -122.4194 + rng.uniform(-0.3, 0.3))
+            index.add(id_ride, *rides[id_ride])
+        for id_ride in range(0, 3000, 3):
+            index.remove(id_ride)
+            del rides[id_ride]
+        index.add(1, 37.7749, -122.4194)
+        rides[1] = (37.7749, -122.4194)
+
+        for lat, lon, k in [(37.7749, -122.4194, 1), (37.9, -122.2, 10), (37.1, -123.0, 25), (-33.9, 151.2, 5)]:
+            expected = sorted(
+                (calculate_distance(lat, lon, *pickup), id_ride) for id_ride, pickup in rides.items()
+            )[:k]
+            found = index.nearest(lat, lon, k)
+            self.assertEqual([id_ride for _, id_ride in found], [id_ride for _, id_ride in expected])
+            for (distance, _), (expected_distance, _) in zip(found, expected):
+                self.assertAlmostEqual(distance, expected_distance, places=9)
+
+
+class NearbyRidesTests(TestCase):
+    """
+    /rides/nearby/ sees committed ride changes only
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+
+    def setUp(self):
+        cache.clear()
+        active_ride_index.clear()
+        self.client.force_login(self.admin)
+
+    def create_ride(self, **kwargs):
+        return Ride.objects.create(**{
+            'status': 'pickup', 'id_rider': self.admin, 'id_driver': self.admin,
+            'pickup_latitude': 37.7749, 'pickup_longitude': -122.4194, 'dropoff_latitude': 37.8,
+            'dropoff_longitude': -122.3, 'pickup_time': timezone.now(), **kwargs,
+        })
+
+    def nearby(self):
+        response = self.client.get('/api/v1/rides/nearby/?lat=37.7749&lon=-122.4194&k=5')
+        return [ride['id_ride'] for ride in response.json()['results']]
+
+    def test_follows_committed_writes(self):
+        first = self.create_ride()
+        self.assertEqual(self.nearby(), [first.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second = self.create_ride(pickup_latitude=37.78)
+        self.assertEqual(self.nearby(), [first.pk, second.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.status = 'completed'
+            first.save()
+            second.delete()
+        self.assertEqual(self.nearby(), [])
+
+    def test_ignores_rolled_back_writes(self):
+        self.assertEqual(self.nearby(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.create_ride()
+                transaction.set_rollback(True)
+        self.assertEqual(active_ride_index.nearest(37.7749, -122.4194, 5), [])
+
+    def test_rejects_invalid_coordinates(self):
+        for query in ['lat=nan&lon=1', 'lat=1&lon=inf', 'lat=90.5&lon=1', 'lat=1&lon=-180.5', 'lat=1']:
+            self.assertEqual(self.client.get(f'/api/v1/rides/nearby/?{query}').status_code, 400, query)
+
+
+class CachedCountPaginationTests(TestCase):
+    """
+    List counts come from the row count estimate or a cached filtered count
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        for status in ['completed', 'completed', 'cancelled']:
+            cls.new_ride(status).save()
+
+    @classmethod
+    def new_ride(cls, status='completed'):
+        return Ride(
+            status=status, id_rider=cls.admin, id_driver=cls.admin, pickup_latitude=37.77,
+            pickup_longitude=-122.41, dropoff_latitude=37.8, dropoff_longitude=-122.3, pickup_time=timezone.now(),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def list_rides(self, query=''):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(f'/api/v1/rides/{query}').json()
+        counts = [query for query in queries if 'COUNT(' in query['sql']]
+        return data['count'], data['count_exact'], len(counts)
+
+    def test_triggers_track_inserts_deletes_and_bulk_create(self):
+        self.assertEqual(estimate_row_count(Ride), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            Ride.objects.bulk_create([self.new_ride() for _ in range(4)])
+            Ride.objects.filter(status='cancelled').delete()
+            self.new_ride().save()
+        self.assertEqual(estimate_row_count(Ride), Ride.objects.count())
+        self.assertEqual(estimate_row_count(Ride), 7)
+
+    def test_post_migrate_reinstalls_dropped_triggers(self):
+        # What an ALTER TABLE rebuilding the ride table leaves behind
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER ride_count_insert')
+        TableRowCount.objects.filter(table_name='ride').update(row_count=0)
+
+        ensure_row_count_triggers(sender=apps.get_app_config('rides'), using='default')
+        self.assertEqual(estimate_row_count(Ride), 3)
+        self.new_ride().save()
+        self.assertEqual(estimate_row_count(Ride), 4)
+
+    def test_unfiltered_lists_report_the_estimate(self):
+        # Small tables are counted exactly
+        self.assertEqual(self.list_rides(), (3, True, 1))
+
+        TableRowCount.objects.filter(table_name='ride').update(row_count=25000)
+        self.assertEqual(self.list_rides('?page_size=1'), (25000, False, 0))
+
+    def test_pg_class_estimate(self):
+        fake = mock.MagicMock(vendor='postgresql')
+        cursor = fake.cursor.return_value.__enter__.return_value
+        with mock.patch.dict('rides.pagination.connections', {'default': fake}):
+            cursor.fetchone.return_value = (120000,)
+            self.assertEqual(estimate_row_count(Ride), 120000)
+            self.assertEqual(cursor.execute.call_args.args[1], ['ride'])
+            # Never analyzed
+            cursor.fetchone.return_value = (-1,)
+            self.assertIsNone(estimate_row_count(Ride))
+
+    def test_filtered_counts_are_cached_by_normalized_filters(self):
+        self.assertEqual(self.list_rides('?status=completed'), (2, True, 1))
+        # Same filters: empty values and non-filter parameters do not matter
+        self.assertEqual(self.list_rides('?status=completed&rider_email=&page_size=5'), (2, False, 0))
+        self.assertEqual(self.list_rides('?status=cancelled'), (1, True, 1))
+
+        with mock.patch('rides.pagination.cache.set') as cache_set:
+            self.list_rides('?status=dropoff')
+        [timeout] = [call.args[2] for call in cache_set.call_args_list if call.args[0].startswith('count:')]
+        self.assertEqual(timeout, 30)
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    ?pagination=cursor pages, broken cursors and conflicting orderings
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        now = timezone.now()
+        for i in range(5):
+            ride = Ride.objects.create(
+                status='pickup', id_rider=cls.admin, id_driver=cls.admin,
+                pickup_latitude=37.7 + i / 10, pickup_longitude=-122.4, dropoff_latitude=37.8,
+                dropoff_longitude=-122.3, pickup_time=now - timedelta(hours=i % 3),
+            )
+            RideEvent.objects.create(id_ride=ride, description='Ride requested')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def test_walks_every_row_in_keyset_order(self):
+        for prefix in ['/api/v1/', '/api/v1/async/']:
+            expected = list(Ride.objects.order_by('pickup_time', 'id_ride').values_list('id_ride', flat=True))
+            seen = []
+            url = f'{prefix}rides/?pagination=cursor&page_size=2&ordering=pickup_time'
+            while url:
+                page = self.client.get(url).json()
+                seen += [ride['id_ride'] for ride in page['results']]
+                url = page['next']
+            self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_is_not_found(self):
+        cursors = [
+            base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            for payload in [{'v': 'garbage', 'pk': 1, 'r': False}, {'v': None, 'pk': 1, 'r': False}, [1]]
+        ] + ['not-base64!']
+        for prefix in ['/api/v1/', '/api/v1/async/']:
+            for endpoint in ['rides', 'ride-events']:
+                for cursor in cursors:
+                    response = self.client.get(f'{prefix}{endpoint}/?cursor={cursor}')
+                    self.assertEqual(response.status_code, 404, (prefix, endpoint, cursor))
+
+    def test_rejects_other_orderings(self):
+        for prefix in ['/api/v1/', '/api/v1/async/']:
+            for query in ['sort_by_distance=true&lat=37.7&lon=-122.4', 'ordering=-pickup_time']:
+                response = self.client.get(f'{prefix}rides/?pagination=cursor&{query}')
+                self.assertEqual(response.status_code, 400, (prefix, query))
+            response = self.client.get(f'{prefix}ride-events/?pagination=cursor&ordering=description')
+            self.assertEqual(response.status_code, 400, prefix)
+
+
+class ExportTests(TestCase):
+    """
+    Exports stream exactly what the list returns for the same filters
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', first_name='Ada', role='admin',
+        )
+        cls.rider = User.objects.create_user(
+            username='rider', email='rider@example.com', password='rider123', first_name='Rita, "R"', role='rider',
+        )
+        for i in range(5):
+            ride = Ride.objects.create(
+                status='completed' if i % 4 else 'cancelled', id_rider=cls.rider, id_driver=cls.admin,
+                pickup_latitude=37.77 + i / 100, pickup_longitude=-122.41, dropoff_latitude=37.8,
+                dropoff_longitude=-122.3, pickup_time=timezone.now() - timedelta(hours=i),
+            )
+            RideEvent.objects.create(id_ride=ride, description='Status changed to pickup')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def listed(self, query):
+        rides = self.client.get(f'/api/v1/rides/?page_size=1000&{query}').json()['results']
+        return sorted(rides, key=lambda ride: ride['id_ride'])
+
+    def export(self, query):
+        response = self.client.get(f'/api/v1/rides/export/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_matches_the_list(self):
+        for query in [
+            'status=completed', 'status=completed&fields=id_ride,status&expand=rider,events',
+            'fields=id_ride,status,pickup_time',
+        ]:
+            lines = self.export(f'format=ndjson&{query}').splitlines()
+            self.assertEqual([json.loads(line) for line in lines], self.listed(query))
+
+    def test_csv_matches_the_list(self):
+        query = 'status=completed'
+        listed = self.listed(query)
+        fields = list(listed[0])
+        expected = [csv_columns(fields)]
+        for ride in listed:
+            row = []
+            for name in fields:
+                if name in ('id_rider_data', 'id_driver_data'):
+                    row += [ride[name][field] for field in UserSerializer.Meta.fields]
+                elif name == 'todays_ride_events':
+                    row.append(json.dumps(ride[name]))
+                else:
+                    row.append(ride[name])
+            expected.append(['' if value is None else str(value) for value in row])
+        self.assertEqual(list(csv.reader(StringIO(self.export(f'format=csv&{query}')))), expected)
+
+    def test_empty_result(self):
+        self.assertEqual(self.export('format=ndjson&status=dropoff'), '')
+        [header] = csv.reader(StringIO(self.export('format=csv&status=dropoff')))
+        self.assertIn('id_rider_data.email', header)
+
+    def test_events_are_fetched_per_chunk(self):
+        with mock.patch('rides.views.iter_ride_rows', partial(iter_ride_rows, chunk_size=2)):
+            with CaptureQueriesContext(connection) as queries:
+                lines = self.export('format=ndjson').splitlines()
+        self.assertEqual(len(lines), 5)
+        event_queries = [query for query in queries if 'FROM "ride_event"' in query['sql']]
+        self.assertEqual(len(event_queries), 3)
+        # Exports leave the recent event cache as it was
+        self.assertIsNone(cache.get(recent_event_cache.key(json.loads(lines[0])['id_ride'])))
+
+
+class BulkCreateTests(TestCase):
+    """
+    POST /rides/bulk/ and /ride-events/bulk/
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        cls.rider = User.objects.create_user(username='rider', email='rider@example.com', role='rider')
+        cls.driver = User.objects.create_user(username='driver', email='driver@wingz.com', role='driver')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def ride(self, **kwargs):
+        return {
+            'status': 'pickup', 'id_rider': self.rider.pk, 'id_driver': self.driver.pk,
+            'pickup_latitude': 37.7749, 'pickup_longitude': -122.4194, 'dropoff_latitude': 37.8,
+            'dropoff_longitude': -122.3, 'pickup_time': '2026-01-01T12:00:00Z', **kwargs,
+        }
+
+    def post(self, url, items):
+        return self.client.post(url, json.dumps(items), content_type='application/json')
+
+    def test_creates_every_valid_ride(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post('/api/v1/rides/bulk/', [self.ride(), self.ride(id_driver=self.rider.pk)])
+        self.assertEqual(response.status_code, 201)
+        created = response.json()['created']
+        self.assertEqual([item['index'] for item in created], [0, 1])
+        self.assertEqual(response.json()['errors'], [])
+        ride = Ride.objects.get(pk=created[0]['id_ride'])
+        self.assertEqual(ride.pickup_cell, grid_cell(37.7749, -122.4194))
+        # Rider and driver ids are both resolved by one in_bulk() on user
+        lookups = [query for query in queries if '"user"."id_user" IN' in query['sql']]
+        self.assertEqual(len(lookups), 1)
+
+    def test_reports_invalid_items_by_index(self):
+        response = self.post('/api/v1/rides/bulk/', [
+            self.ride(pickup_latitude='nan'),
+            self.ride(),
+            self.ride(id_rider=999999),
+            self.ride(pickup_longitude=-181),
+            self.ride(dropoff_latitude='inf'),
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([item['index'] for item in response.json()['created']], [1])
+        errors = {item['index']: item['errors'] for item in response.json()['errors']}
+        self.assertEqual(sorted(errors), [0, 2, 3, 4])
+        self.assertIn('pickup_latitude', errors[0])
+        self.assertIn('id_rider', errors[2])
+        self.assertIn('pickup_longitude', errors[3])
+        self.assertIn('dropoff_latitude', errors[4])
+
+        response = self.post('/api/v1/rides/bulk/', [self.ride(status='unknown')])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['created'], [])
+        self.assertEqual(self.post('/api/v1/rides/bulk/', {'status': 'pickup'}).status_code, 400)
+
+    def test_single_create_rejects_non_finite_coordinates(self):
+        for value in ['nan', 'inf', '-inf', 91]:
+            response = self.post('/api/v1/rides/', self.ride(pickup_latitude=value))
+            self.assertEqual(response.status_code, 400, value)
+        self.assertEqual(self.post('/api/v1/rides/', self.ride()).status_code, 201)
+
+    def test_creates_ride_events(self):
+        ride = Ride.objects.create(**{
+            **self.ride(), 'id_rider': self.rider, 'id_driver': self.driver, 'pickup_time': timezone.now(),
+        })
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post('/api/v1/ride-events/bulk/', [
+                {'id_ride': ride.pk, 'description': 'Status changed to pickup'},
+                {'id_ride': 999999, 'description': 'Ride requested'},
+                {'id_ride': ride.pk},
+            ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([item['index'] for item in response.json()['created']], [0])
+        self.assertEqual([item['index'] for item in response.json()['errors']], [1, 2])
+        event = RideEvent.objects.get(pk=response.json()['created'][0]['id_ride_event'])
+        self.assertEqual(event.event_type, RideEvent.EventType.PICKUP)
+        lookups = [
+            query for query in queries
+            if query['sql'].startswith('SELECT') and 'FROM "ride" WHERE "ride"."id_ride" IN' in query['sql']
+        ]
+        self.assertEqual(len(lookups), 1)
+
+
+class ImportRidesTests(TestCase):
+    """
+    import_rides skips bad rows and resumes from its checkpoint
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='rider', email='rider@example.com', role='rider')
+        User.objects.create_user(username='driver', email='driver@wingz.com', role='driver')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'rides.ndjson')
+
+    def row(self, **kwargs):
+        return {
+            'status': 'completed', 'rider_email': 'rider@example.com', 'driver_email': 'driver@wingz.com',
+            'pickup_latitude': 37.7749, 'pickup_longitude': -122.4194, 'dropoff_latitude': 37.8,
+            'dropoff_longitude': -122.3, 'pickup_time': '2026-01-01T12:00:00Z',
+            'events': [{'description': 'Status changed to pickup', 'created_at': '2026-01-01T12:00:00Z'}],
+            **kwargs,
+        }
+
+    def write(self, rows, mode='w'):
+        with open(self.path, mode) as file:
+            for row in rows:
+                file.write((row if isinstance(row, str) else json.dumps(row)) + '\n')
+
+    def run_import(self, *args):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_rides', self.path, '--batch-size', '2', *args, stdout=stdout, stderr=stderr)
+        return stderr.getvalue()
+
+    def test_skips_bad_rows(self):
+        self.write([
+            self.row(),
+            '{"status": "completed", "pickup_latitude": NaN}',
+            self.row(pickup_latitude='nan'),
+            self.row(pickup_longitude='Infinity'),
+            self.row(dropoff_latitude=91),
+            self.row(pickup_longitude=None),
+            self.row(status='flying'),
+            self.row(rider_email='nobody@example.com'),
+            'not json',
+            self.row(pickup_time='2026-01-02T12:00:00Z'),
+        ])
+        errors = self.run_import()
+        self.assertEqual(Ride.objects.count(), 2)
+        self.assertEqual(RideEvent.objects.count(), 2)
+        self.assertEqual(
+            [int(line.split(':')[0].split()[1]) for line in errors.splitlines()], [2, 3, 4, 5, 6, 7, 8, 9]
+        )
+        self.assertEqual(Ride.objects.get(pickup_time__day=1).pickup_cell, grid_cell(37.7749, -122.4194))
+
+    def test_resumes_after_the_last_committed_batch(self):
+        self.write([self.row(pickup_time=f'2026-01-0{day}T12:00:00Z') for day in range(1, 5)])
+        self.write([self.row(status='flying'), self.row(pickup_time='2026-01-05T12:00:00Z')], mode='a')
+        with self.assertRaises(CommandError):
+            self.run_import('--max-errors', '0')
+        # The first two batches committed with their checkpoint; the third did not
+        self.assertEqual(Ride.objects.count(), 4)
+        self.assertEqual(ImportCheckpoint.objects.get(source=self.path).rows, 4)
+
+        self.run_import()
+        self.assertEqual(
+            sorted(ride.pickup_time.day for ride in Ride.objects.all()), [1, 2, 3, 4, 5]
+        )
+        self.write([self.row(pickup_time='2026-01-06T12:00:00Z')], mode='a')
+        self.run_import()
+        self.assertEqual(Ride.objects.count(), 6)
+
+        self.run_import('--restart')
+        self.assertEqual(Ride.objects.count(), 12)
+
+    def test_user_cache_limit_keeps_batch_users(self):
+        User.objects.create_user(username='other', email='other@example.com', role='rider')
+        self.write([self.row(), self.row(), self.row(rider_email='other@example.com'), self.row()])
+        with mock.patch('rides.management.commands.import_rides.Command.max_cached_users', 1):
+            errors = self.run_import()
+        self.assertEqual(errors, '')
+        self.assertEqual(Ride.objects.count(), 4)
+        self.assertEqual(Ride.objects.filter(id_rider__email='other@example.com').count(), 1)
+
+
+class LongTripsReportTests(TestCase):
+    """
+    long_trips() must give the reporting SQL's result from the ride_duration rollup
+    """
+
+    # The README query, with SQLite's date and string functions
+    REPORT_SQL = {
+        'postgresql': """
+            WITH ride_durations AS (
+                SELECT r.id_ride, r.id_driver,
+                    u.first_name || ' ' || LEFT(u.last_name, 1) AS driver_name,
+                    EXTRACT(EPOCH FROM (dropoff_event.created_at - pickup_event.created_at)) / 3600 AS duration_hours,
+                    TO_CHAR(pickup_event.created_at, 'YYYY-MM') AS month
+                FROM ride r
+                JOIN "user" u ON r.id_driver = u.id_user
+                JOIN ride_event pickup_event ON r.id_ride = pickup_event.id_ride
+                    AND pickup_event.description = 'Status changed to pickup'
+                JOIN ride_event dropoff_event ON r.id_ride = dropoff_event.id_ride
+                    AND dropoff_event.description = 'Status changed to dropoff'
+                WHERE pickup_event.created_at < dropoff_event.created_at
+            )
+            SELECT month, driver_name, COUNT(*) FROM ride_durations WHERE duration_hours > 1
+            GROUP BY month, driver_name, id_driver ORDER BY month, driver_name
+        """,
+        'sqlite': """
+            WITH ride_durations AS (
+                SELECT r.id_ride, r.id_driver,
+                    u.first_name || ' ' || SUBSTR(u.last_name, 1, 1) AS driver_name,
+                    (JULIANDAY(dropoff_event.created_at) - JULIANDAY(pickup_event.created_at)) * 24 AS duration_hours,
+                    STRFTIME('%Y-%m', pickup_event.created_at) AS month
+                FROM ride r
+                JOIN "user" u ON r.id_driver = u.id_user
+                JOIN ride_event pickup_event ON r.id_ride = pickup_event.id_ride
+                    AND pickup_event.description = 'Status changed to pickup'
+                JOIN ride_event dropoff_event ON r.id_ride = dropoff_event.id_ride
+                    AND dropoff_event.description = 'Status changed to dropoff'
+                WHERE pickup_event.created_at < dropoff_event.created_at
+            )
+            SELECT month, driver_name, COUNT(*) FROM ride_durations WHERE duration_hours > 1
+            GROUP BY month, driver_name, id_driver ORDER BY month, driver_name
+        """,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        cls.drivers = [
+            User.objects.create_user(
+                username=f'driver{i}', email=f'driver{i}@wingz.com', role='driver',
+                first_name=first_name, last_name=last_name,
+            )
+            for i, (first_name, last_name) in enumerate([('Chris', 'Hemsworth'), ('Howard', 'Young'), ('Randy', 'West')])
+        ]
+        generator = random.Random(15)
+        cls.rides = []
+        for _ in range(30):
+            ride = Ride.objects.create(
+                status='dropoff', id_rider=cls.admin, id_driver=generator.choice(cls.drivers),
+                pickup_latitude=37.77, pickup_longitude=-122.41, dropoff_latitude=37.8, dropoff_longitude=-122.3,
+                pickup_time=timezone.now(),
+            )
+            pickup_at = timezone.make_aware(timezone.datetime(2026, generator.randint(1, 3), 1)) + timedelta(
+                days=generator.randrange(28), minutes=generator.randrange(24 * 60)
+            )
+            RideEvent.objects.create(id_ride=ride, description='Status changed to pickup', created_at=pickup_at)
+            # Some trips are too short and some never reach the dropoff
+            if generator.random() < 0.9:
+                RideEvent.objects.create(
+                    id_ride=ride, description='Status changed to dropoff',
+                    created_at=pickup_at + timedelta(minutes=generator.choice([20, 59, 61, 90, 300])),
+                )
+            cls.rides.append(ride)
+
+    def report_sql(self):
+        with connection.cursor() as cursor:
+            cursor.execute(self.REPORT_SQL[connection.vendor])
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def report(self):
+        return [(row['month'], row['driver'], row['count']) for row in long_trips()]
+
+    def test_matches_the_reporting_sql(self):
+        expected = self.report_sql()
+        self.assertTrue(expected)
+        self.assertEqual(self.report(), expected)
+        rebuild_ride_durations()
+        self.assertEqual(self.report(), expected)
+
+    def test_follows_event_and_driver_changes(self):
+        pickup = RideEvent.objects.filter(
+            id_ride__in=[ride.pk for ride in self.rides], description='Status changed to pickup'
+        ).order_by('pk')
+        with self.captureOnCommitCallbacks(execute=True):
+            # Moved a month back, which lengthens the trip past an hour
+            moved = pickup[0]
+            moved.created_at -= timedelta(days=31)
+            moved.save()
+            pickup[1].delete()
+            ride = self.rides[2]
+            ride.id_driver = self.drivers[0] if ride.id_driver != self.drivers[0] else self.drivers[1]
+            ride.save()
+            self.rides[3].delete()
+        self.assertEqual(self.report(), self.report_sql())
+
+
+class DriverDailyStatsTests(TestCase):
+    """
+    The incrementally maintained driver daily rollup must equal a full rebuild
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        cls.drivers = [
+            User.objects.create_user(username=f'driver{i}', email=f'driver{i}@wingz.com', role='driver')
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        self.random = random.Random(7)
+        self.day = timezone.make_aware(timezone.datetime(2026, 3, 1, 23, 30))
+
+    def new_ride(self, **kwargs):
+        values = {
+            'status': self.random.choice(['en-route', 'pickup', 'dropoff', 'completed', 'cancelled']),
+            'id_rider': self.admin, 'id_driver': self.random.choice(self.drivers),
+            'pickup_latitude': self.random.uniform(37.6, 37.9), 'pickup_longitude': self.random.uniform(-122.5, -122.2),
+            'dropoff_latitude': self.random.uniform(37.6, 37.9), 'dropoff_longitude': self.random.uniform(-122.5, -122.2),
+            'pickup_time': self.day + timedelta(minutes=self.random.randrange(0, 120)),
+        }
+        values.update(kwargs)
+        return Ride(**values)
+
+    def snapshot(self):
+        return sorted(
+            (id_driver, day, status, count, round(distance, 6))
+            for id_driver, day, status, count, distance in DriverDailyStats.objects.filter(
+                ride_count__gt=0
+            ).values_list('id_driver', 'day', 'status', 'ride_count', 'distance_km')
+        )
+
+    def assertMatchesRebuild(self):
+        incremental = self.snapshot()
+        self.assertTrue(incremental)
+        rebuild_driver_daily_stats()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_creates_updates_and_deletes(self):
+        rides = []
+        for _ in range(20):
+            ride = self.new_ride()
+            ride.save()
+            rides.append(ride)
+
+        rides[0].status = 'completed' if rides[0].status != 'completed' else 'cancelled'
+        rides[0].save()
+        rides[1].id_driver = self.drivers[1] if rides[1].id_driver == self.drivers[0] else self.drivers[0]
+        rides[1].save(update_fields=['id_driver'])
+        # Across midnight UTC, so the ride moves to the next day's row
+        rides[2].pickup_time = self.day + timedelta(days=1, hours=2)
+        rides[2].save()
+        rides[3].dropoff_latitude += 0.1
+        rides[3].save()
+        rides[4].delete()
+        rides[5].id_driver.delete()
+        self.assertMatchesRebuild()
+
+    def test_stale_instance_moves_stored_values(self):
+        ride = self.new_ride(status='pickup')
+        ride.save()
+        # Another request completes the ride; this copy still says pickup
+        stale = Ride.objects.get(pk=ride.pk)
+        ride.status = 'completed'
+        ride.save()
+        stale.id_driver = self.drivers[1] if stale.id_driver == self.drivers[0] else self.drivers[0]
+        stale.save()
+        self.assertMatchesRebuild()
+
+    def test_bulk_created_rides(self):
+        self.client.force_login(self.admin)
+        items = []
+        for _ in range(10):
+            ride = self.new_ride()
+            items.append({
+                'status': ride.status, 'id_rider': self.admin.pk, 'id_driver': ride.id_driver.pk,
+                'pickup_latitude': ride.pickup_latitude, 'pickup_longitude': ride.pickup_longitude,
+                'dropoff_latitude': ride.dropoff_latitude, 'dropoff_longitude': ride.dropoff_longitude,
+                'pickup_time': ride.pickup_time.isoformat(),
+            })
+        response = self.client.post('/api/v1/rides/bulk/', json.dumps(items), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertMatchesRebuild()
+
+    def test_rebuild_uses_utc_days(self):
+        # 23:30 UTC is still the afternoon before in Los Angeles
+        for _ in range(5):
+            self.new_ride().save()
+        with self.settings(TIME_ZONE='America/Los_Angeles'):
+            self.assertMatchesRebuild()
+
+    def test_locks_exactly_the_touched_rows(self):
+        day = self.day.date()
+        for status in ['completed', 'cancelled']:
+            for driver in self.drivers:
+                self.new_ride(status=status, id_driver=driver, pickup_time=self.day).save()
+        deltas = {
+            (self.drivers[0].pk, day, 'completed'): (1, 2.0),
+            (self.drivers[1].pk, day, 'cancelled'): (1, 0.0),
+            (self.drivers[1].pk, day + timedelta(days=1), 'pickup'): (1, 1.0),
+        }
+        with CaptureQueriesContext(connection) as queries:
+            apply_daily_stats_deltas(deltas, lock_batch_size=1)
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 3)
+        for sql in selects:
+            self.assertIn('"status" =', sql)
+            self.assertTrue(sql.endswith('ORDER BY "driver_daily_stats"."id" ASC'))
+
+        counts = dict(
+            ((id_driver, day, status), count)
+            for id_driver, day, status, count in DriverDailyStats.objects.values_list(
+                'id_driver', 'day', 'status', 'ride_count'
+            )
+        )
+        self.assertEqual(counts, {
+            (self.drivers[0].pk, day, 'completed'): 2, (self.drivers[0].pk, day, 'cancelled'): 1,
+            (self.drivers[1].pk, day, 'completed'): 1, (self.drivers[1].pk, day, 'cancelled'): 2,
+            (self.drivers[1].pk, day + timedelta(days=1), 'pickup'): 1,
+        })
+
+    def test_report_reads_the_rollup(self):
+        for status in ['completed', 'completed', 'cancelled']:
+            self.new_ride(status=status, id_driver=self.drivers[0], pickup_time=self.day).save()
+        self.client.force_login(self.admin)
+        response = self.client.get('/api/v1/reports/driver-daily/', {'driver': self.drivers[0].pk})
+        self.assertEqual(response.status_code, 200)
+        [row] = response.json()['results']
+        self.assertEqual(row['day'], '2026-03-01')
+        self.assertEqual(row['rides'], 3)
+        self.assertEqual(row['by_status']['completed'], 2)
+        self.assertEqual(row['cancellation_rate'], round(1 / 3, 4))
+
+
+class ArchiveRideEventsTests(TestCase):
+    """
+    archive_ride_events moves old events without losing them from the history
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='admin', email='admin@wingz.com', role='admin')
+        cls.ride = Ride.objects.create(
+            status='dropoff', id_rider=cls.admin, id_driver=cls.admin, pickup_latitude=37.77,
+            pickup_longitude=-122.41, dropoff_latitude=37.8, dropoff_longitude=-122.3, pickup_time=timezone.now(),
+        )
+        now = timezone.now()
+        cls.events = [
+            RideEvent.objects.create(id_ride=cls.ride, description=description, created_at=now - age)
+            for description, age in [
+                ('Status changed to pickup', timedelta(days=40)),
+                ('Status changed to dropoff', timedelta(hours=2)),
+                ('Passenger dropped off', timedelta(minutes=5)),
+            ]
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def archive(self, older_than):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_ride_events', '--older-than', older_than, stdout=StringIO())
+
+    def test_moves_old_events_and_keeps_history(self):
+        modified_at = Ride.objects.get(pk=self.ride.pk).modified_at
+        self.archive('30d')
+        self.assertEqual(list(ArchivedRideEvent.objects.values_list('pk', flat=True)), [self.events[0].pk])
+        self.assertEqual(
+            sorted(RideEvent.objects.values_list('pk', flat=True)), [self.events[1].pk, self.events[2].pk]
+        )
+        # Archived events are still the ride's, so no event delete receivers ran
+        self.assertEqual(Ride.objects.get(pk=self.ride.pk).modified_at, modified_at)
+        self.assertTrue(RideDuration.objects.filter(id_ride=self.ride).exists())
+
+        history = self.client.get(f'/api/v1/rides/{self.ride.pk}/history/').json()['events']
+        self.assertEqual([event['id_ride_event'] for event in history], [event.pk for event in self.events])
+        self.assertEqual([event['archived'] for event in history], [True, False, False])
+
+    def test_invalidates_cached_responses_and_recent_events(self):
+        url = f'/api/v1/rides/{self.ride.pk}/'
+        self.assertEqual(len(self.client.get(url).json()['todays_ride_events']), 2)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        self.archive('1h')
+        self.assertEqual(len(recent_event_cache.get_many([self.ride.pk])[self.ride.pk]), 1)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()['todays_ride_events']), 1)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    """
+    Reads go to a replica until the current context writes
+    """
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.router.replicas = ['replica_1']
+
+    def test_pins_reads_to_the_primary_after_a_write(self):
+        state, token = start_pin_state()
+        try:
+            self.assertEqual(self.router.db_for_read(Ride), 'replica_1')
+            self.assertIsNone(self.router.db_for_read(ApiKey))
+            self.assertEqual(self.router.db_for_write(ApiKey), 'default')
+            self.assertEqual(self.router.db_for_read(RideEvent), 'replica_1')
+            self.assertEqual(self.router.db_for_write(Ride), 'default')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertTrue(state.wrote)
+        finally:
+            end_pin_state(token)
+
+    def test_pinned_request_reads_from_the_primary(self):
+        _, token = start_pin_state(pinned=True)
+        try:
+            self.assertEqual(self.router.db_for_read(Ride), 'default')
+        finally:
+            end_pin_state(token)
+
+
+class PinnedReadCacheTests(TestCase):
+    """
+    Clients pinned to the primary after a write never read caches that a
+    lagging replica may have filled
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+        cls.ride = Ride.objects.create(
+            status='pickup', id_rider=cls.admin, id_driver=cls.admin, pickup_latitude=37.77,
+            pickup_longitude=-122.41, dropoff_latitude=37.8, dropoff_longitude=-122.3, pickup_time=timezone.now(),
+        )
+        cls.event = RideEvent.objects.create(id_ride=cls.ride, description='Ride requested')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+        patcher = mock.patch('rides.db_routers.replica_aliases', return_value=['replica_1'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pinned_requests_bypass_caches(self):
+        urls = [f'/api/v1/rides/{self.ride.pk}/', '/api/v1/rides/?status=pickup']
+        for url in urls:
+            self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+        # Rows changed without signals stand in for writes the replica
+        # has not replayed yet when it filled the caches
+        Ride.objects.filter(pk=self.ride.pk).update(status='dropoff')
+        RideEvent.objects.filter(pk=self.event.pk).update(description='Driver assigned')
+
+        detail, listed = (self.client.get(url) for url in urls)
+        self.assertEqual(detail['X-Cache'], 'HIT')
+        self.assertEqual(detail.json()['status'], 'pickup')
+        self.assertEqual(listed.json()['count'], 1)
+
+        self.client.cookies[ReplicaPinningMiddleware.cookie_name] = '1'
+        detail, listed = (self.client.get(url) for url in urls)
+        self.assertEqual(detail['X-Cache'], 'BYPASS')
+        self.assertEqual(detail.json()['status'], 'dropoff')
+        self.assertEqual(detail.json()['todays_ride_events'][0]['description'], 'Driver assigned')
+        self.assertEqual(listed.json()['count'], 0)
+        self.assertTrue(listed.json()['count_exact'])
+
+
+class ApiKeyAuthenticationTests(TestCase):
+    """
+    Cached API keys must stay correct across revocation, expiry and user changes
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='admin', email='admin@wingz.com', role='admin')
+        cls.driver = User.objects.create_user(username='driver', email='driver@wingz.com', role='driver')
+        cls.api_key, cls.key = ApiKey.generate(cls.admin, name='dispatch')
+        cls.driver_api_key, cls.driver_key = ApiKey.generate(cls.driver, name='driver app')
+
+    def setUp(self):
+        api_key_cache.clear()
+        self.auth = ApiKeyAuthentication()
+
+    def test_authenticates_and_caches_key(self):
+        response = self.client.get('/api/v1/rides/', HTTP_AUTHORIZATION=f'Api-Key {self.key}')
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            user, api_key = self.auth.authenticate_credentials(self.key)
+        self.assertEqual(user, self.admin)
+        self.assertEqual(api_key, self.api_key)
+
+    def test_rejects_wrong_key(self):
+        response = self.client.get('/api/v1/rides/', HTTP_AUTHORIZATION=f'Api-Key {self.api_key.prefix}.wrong')
+        self.assertEqual(response.status_code, 401)
+
+    def test_requests_get_their_own_user(self):
+        user, _ = self.auth.authenticate_credentials(self.key)
+        user.role = 'rider'
+        user, api_key = self.auth.authenticate_credentials(self.key)
+        self.assertEqual(user.role, 'admin')
+        self.assertIs(api_key.id_user, user)
+
+    def test_expired_key_is_refused(self):
+        self.auth.authenticate_credentials(self.key)
+        ApiKey.objects.filter(pk=self.api_key.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        # Expiry is checked against the database once the cached entry is gone
+        with mock.patch('rides.authentication.time.monotonic', return_value=time.monotonic() + 3600):
+            with self.assertRaisesMessage(AuthenticationFailed, 'API key expired.'):
+                self.auth.authenticate_credentials(self.key)
+
+    def test_revoke_drops_key_at_once(self):
+        self.auth.authenticate_credentials(self.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.api_key.revoke()
+        with self.assertRaisesMessage(AuthenticationFailed, 'API key revoked.'):
+            self.auth.authenticate_credentials(self.key)
+
+    def test_revoke_elsewhere_applies_after_ttl(self):
+        self.auth.authenticate_credentials(self.key)
+        # Another process without a shared cache: no invalidation reaches here
+        ApiKey.objects.filter(pk=self.api_key.pk).update(revoked_at=timezone.now())
+        self.auth.authenticate_credentials(self.key)
+        with mock.patch('rides.authentication.time.monotonic', return_value=time.monotonic() + 3600):
+            with self.assertRaisesMessage(AuthenticationFailed, 'API key revoked.'):
+                self.auth.authenticate_credentials(self.key)
+
+    def test_user_change_drops_only_their_keys(self):
+        self.auth.authenticate_credentials(self.key)
+        self.auth.authenticate_credentials(self.driver_key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.driver.is_active = False
+            self.driver.save()
+        with self.assertNumQueries(0):
+            self.auth.authenticate_credentials(self.key)
+        with self.assertRaisesMessage(AuthenticationFailed, 'User inactive or deleted.'):
+            self.auth.authenticate_credentials(self.driver_key)
+
+    def test_login_keeps_keys_cached(self):
+        self.auth.authenticate_credentials(self.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            update_last_login(None, self.admin)
+        with self.assertNumQueries(0):
+            self.auth.authenticate_credentials(self.key)
+
+    def test_other_processes_drop_invalidated_users(self):
+        other = ApiKeyCache()
+        admin_hash, driver_hash = ApiKey.hash_key(self.key), ApiKey.hash_key(self.driver_key)
+        other.get(admin_hash)
+        other.set(admin_hash, (self.admin, self.api_key))
+        other.set(driver_hash, (self.driver, self.driver_api_key))
+        api_key_cache.invalidate(self.driver.pk)
+        other.generation_checked_at = 0.0
+        self.assertIsNotNone(other.get(admin_hash))
+        self.assertIsNone(other.get(driver_hash))
+
+    def test_other_processes_clear_when_records_are_missing(self):
+        other = ApiKeyCache()
+        admin_hash = ApiKey.hash_key(self.key)
+        other.get(admin_hash)
+        other.set(admin_hash, (self.admin, self.api_key))
+        api_key_cache.invalidate(self.driver.pk)
+        cache.delete(ApiKeyCache.invalidated_user_key.format(cache.get(ApiKeyCache.generation_key)))
+        other.generation_checked_at = 0.0
+        self.assertIsNone(other.get(admin_hash))
+
+
+class MetricsTests(TestCase):
+    """
+    Server-Timing headers and the Prometheus metrics endpoint
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='admin', email='admin@wingz.com', password='admin123', role='admin',
+        )
+
+    def setUp(self):
+        endpoint_metrics.clear()
+        self.client.force_login(self.admin)
+
+    def test_server_timing_counts_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/rides/')
+        self.assertRegex(
+            response['Server-Timing'], rf'^db;dur=[\d.]+;desc="{len(queries)} queries", view;dur=[\d.]+, '
+        )
+        self.assertIn('render;dur=', response['Server-Timing'])
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/v1/rides/')
+        self.client.get('/api/v1/rides/')
+        response = self.client.get('/api/v1/metrics/')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        text = response.content.decode()
+        self.assertIn('rides_request_seconds{endpoint="GET ride-list",phase="total",quantile="0.99"}', text)
+        self.assertIn('rides_request_queries_count{endpoint="GET ride-list"} 2', text)
+
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/v1/metrics/').status_code, 401)
+
+
+class EndpointBenchmarkTests(TestCase):
+    """
+    Every read endpoint stays within the committed bench_baseline.json
+
+    Seeds BENCH_RIDES rides (default 1000; the baseline also has 100000).
+    Query counts are always compared; latency only with BENCH_LATENCY=1,
+    since it depends on the machine. `manage.py bench_api` runs the same
+    scenarios at larger sizes and can rewrite the baseline.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.rides = int(os.environ.get('BENCH_RIDES', 1000))
+        seed_rides(cls.rides)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_endpoints_do_not_regress(self):
+        results = run_scenarios(repeat=int(os.environ.get('BENCH_REPEAT', 3)))
+        baseline = load_baseline().get(str(self.rides), {})
+        self.assertEqual(
+            compare(results, baseline, latency=bool(os.environ.get('BENCH_LATENCY'))), []
+        )
+        # Count (table estimate, plus an exact count below 10000 rows, or
+        # nothing once a filtered count is cached) and the page
+        self.assertLessEqual(results['rides-list']['queries'], 3)
+        self.assertLessEqual(results['rides-list-status']['queries'], 1)
@@ -1,13 +1,20 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet, RideViewSet, RideEventViewSet
+from .views import UserViewSet, RideViewSet, RideEventViewSet, ReportViewSet, MetricsViewSet
+from .async_views import AsyncRideView, AsyncRideEventView
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
 router.register(r'rides', RideViewSet, basename='ride')
 router.register(r'ride-events', RideEventViewSet)
+router.register(r'reports', ReportViewSet, basename='report')
+router.register(r'metrics', MetricsViewSet, basename='metrics')
 
 urlpatterns = [
     path('api/v1/', include(router.urls)),
+    path('api/v1/async/rides/', AsyncRideView.as_view(), name='ride-async-list'),
+    path('api/v1/async/rides/<int:pk>/', AsyncRideView.as_view(), name='ride-async-detail'),
+    path('api/v1/async/ride-events/', AsyncRideEventView.as_view(), name='rideevent-async-list'),
+    path('api/v1/async/ride-events/<int:pk>/', AsyncRideEventView.as_view(), name='rideevent-async-detail'),
     path('api-auth/', include('rest_framework.urls')),
 ]
@@ -1,36 +1,30 @@
+import math
+
 from django.shortcuts import render
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets, status
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from rest_framework.decorators import action
-from django.db.models import Prefetch, F, Q
-from django.utils import timezone
-from datetime import timedelta
-import math
+from django.db.models import F, Q, Value
 
-from .models import User, Ride, RideEvent
-from .serializers import UserSerializer, RideSerializer, RideCreateUpdateSerializer, RideEventSerializer
-from .filters import RideFilter
+from .models import User, Ride, RideEvent, ArchivedRideEvent
+from .serializers import (
+    UserSerializer, RideSerializer, RideRowSerializer, RideCreateUpdateSerializer, RideEventSerializer,
+    DistanceMatrixSerializer, RideBulkCreateSerializer, RideEventBulkCreateSerializer, LongTripsQuerySerializer,
+    DriverDailyQuerySerializer, RideHistoryEventSerializer, get_ride_fields,
+)
+from .bulk import BulkCreateMixin
+from .authentication import api_key_cache
+from .cache import CachedReadMixin, ConditionalGetMixin, recent_event_cache, response_cache
+from .export import CSVRenderer, NDJSONRenderer, buffered, csv_lines, iter_ride_rows, ndjson_lines
+from .filters import RideFilter, RideEventFilter
+from .geo import Haversine, distance_matrix
+from .metrics import PrometheusRenderer, endpoint_metrics, prometheus_lines
+from .pagination import RidePagination, RideEventPagination, ReportPagination
 from .permissions import IsAdminUser
-
-
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """
-    Calculate the distance between two points on Earth using Haversine formula
-    Returns distance in kilometers
-    """
-    # Convert latitude and longitude from degrees to radians
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    
-    # Haversine formula
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    
-    # Radius of Earth in kilometers
-    r = 6371
-    
-    return c * r
+from .reports import driver_daily_row, driver_daily_stats, long_trips
+from .spatial_index import active_ride_index
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -42,69 +36,93 @@ class UserViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAdminUser]
 
 
-class RideViewSet(viewsets.ModelViewSet):
+def order_by_distance(queryset, query_params):
+    """
+    Sort rides by distance to lat/lon when ?sort_by_distance= is set
+    """
+    lat = query_params.get('lat')
+    lon = query_params.get('lon')
+    sort_by_distance = query_params.get('sort_by_distance')
+
+    if lat and lon and sort_by_distance:
+        try:
+            user_lat = float(lat)
+            user_lon = float(lon)
+        except ValueError:
+            pass  # Invalid lat/lon values, ignore distance sorting
+        else:
+            # Distance is computed and sorted in the database so that
+            # LIMIT/OFFSET and COUNT stay in SQL as well
+            queryset = queryset.annotate(
+                distance=Haversine(
+                    Value(user_lat), Value(user_lon),
+                    F('pickup_latitude'), F('pickup_longitude')
+                )
+            ).order_by('distance', 'id_ride')
+
+    return queryset
+
+
+class RideRowListMixin:
+    """
+    List rides through RideRowSerializer, straight from values() rows
+    """
+
+    def list(self, request, *args, **kwargs):
+        fields = self.get_ride_fields()
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.prefetch_related(None).values(*RideRowSerializer.get_values_fields(fields))
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(RideRowSerializer(page, fields=fields).data)
+        return Response(RideRowSerializer(rows, fields=fields).data)
+
+
+class RideViewSet(ConditionalGetMixin, CachedReadMixin, RideRowListMixin, BulkCreateMixin, viewsets.ModelViewSet):
     """
     ViewSet for Ride model with optimized queries and advanced filtering
     """
     permission_classes = [IsAdminUser]
+    pagination_class = RidePagination
+    bulk_serializer_class = RideBulkCreateSerializer
     filterset_class = RideFilter
     ordering_fields = ['pickup_time']
     
+    def get_ride_fields(self):
+        """
+        RideSerializer fields selected by ?fields= and ?expand= on reads
+        """
+        if self.action not in ('list', 'retrieve', 'export'):
+            return list(RideSerializer.Meta.fields)
+        if not hasattr(self, '_ride_fields'):
+            self._ride_fields = get_ride_fields(self.request.query_params)
+        return self._ride_fields
+
     def get_queryset(self):
         """
         Optimized queryset that minimizes database queries
         """
-        # Base queryset with select_related for foreign keys
-        queryset = Ride.objects.select_related('id_rider', 'id_driver')
+        fields = self.get_ride_fields()
+        queryset = Ride.objects.all()
+
+        # Join users and prefetch events only when their data is requested
+        related = [
+            name for name, nested in (('id_rider', 'id_rider_data'), ('id_driver', 'id_driver_data'))
+            if nested in fields
+        ]
+        if related:
+            queryset = queryset.select_related(*related)
         
-        # Prefetch only recent ride events (last 24 hours) for performance
-        twenty_four_hours_ago = timezone.now() - timedelta(hours=24)
-        recent_events_prefetch = Prefetch(
-            'ride_events',
-            queryset=RideEvent.objects.filter(created_at__gte=twenty_four_hours_ago),
-            to_attr='recent_events'
-        )
-        queryset = queryset.prefetch_related(recent_events_prefetch)
+        # Recent ride events (last 24 hours) come from recent_event_cache
+        # in the serializers rather than from a prefetch query
+
+        if self.action == 'retrieve' and len(fields) < len(RideSerializer.Meta.fields):
+            plain_fields = [name for name in fields if name in RideRowSerializer.ride_fields]
+            queryset = queryset.only('id_ride', 'modified_at', *plain_fields, *related)
         
         # Handle distance-based sorting if GPS coordinates are provided
-        lat = self.request.query_params.get('lat')
-        lon = self.request.query_params.get('lon')
-        sort_by_distance = self.request.query_params.get('sort_by_distance')
-        
-        if lat and lon and sort_by_distance:
-            try:
-                user_lat = float(lat)
-                user_lon = float(lon)
-                
-                # Add distance calculation and sort
-                # Note: For very large datasets, you might want to use raw SQL or 
-                # database-specific functions for better performance
-                rides_with_distance = []
-                for ride in queryset:
-                    distance = calculate_distance(
-                        user_lat, user_lon, 
-                        ride.pickup_latitude, ride.pickup_longitude
-                    )
-                    rides_with_distance.append((ride, distance))
-                
-                # Sort by distance
-                rides_with_distance.sort(key=lambda x: x[1])
-                
-                # Extract just the ride objects
-                sorted_ride_ids = [ride.id_ride for ride, _ in rides_with_distance]
-                
-                # Preserve the distance-based order in the queryset
-                # This is a bit of a hack but maintains the order
-                preserved_order = {id: index for index, id in enumerate(sorted_ride_ids)}
-                queryset = queryset.filter(id_ride__in=sorted_ride_ids)
-                queryset = sorted(queryset, key=lambda x: preserved_order[x.id_ride])
-                
-                return queryset
-                
-            except ValueError:
-                pass  # Invalid lat/lon values, ignore distance sorting
-        
-        return queryset
+        return order_by_distance(queryset, self.request.query_params)
     
     def get_serializer_class(self):
         """
@@ -112,68 +130,197 @@ class RideViewSet(viewsets.ModelViewSet):
         """
         if self.action in ['create', 'update', 'partial_update']:
             return RideCreateUpdateSerializer
+        if self.action == 'distance_matrix':
+            return DistanceMatrixSerializer
         return RideSerializer
-    
-    def list(self, request, *args, **kwargs):
+
+    def prepare_bulk_instance(self, instance):
+        instance.set_pickup_cell()
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action == 'retrieve':
+            kwargs['fields'] = self.get_ride_fields()
+        return super().get_serializer(*args, **kwargs)
+
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
         """
-        Custom list method to handle distance-based sorting with pagination
+        Stream every ride matching the filters as NDJSON or CSV
+
+        Use ?format=ndjson (default) or ?format=csv; ?fields= and ?expand=
+        work as on the list. Rows are read in chunks from a server-side
+        cursor, so memory stays flat regardless of the number of rows.
         """
-        # Check if distance sorting is requested
-        lat = request.query_params.get('lat')
-        lon = request.query_params.get('lon')
-        sort_by_distance = request.query_params.get('sort_by_distance')
-        
-        if lat and lon and sort_by_distance:
-            # For distance-based sorting, we need to handle pagination differently
-            try:
-                user_lat = float(lat)
-                user_lon = float(lon)
-                
-                # Get the base queryset without distance sorting
-                queryset = Ride.objects.select_related('id_rider', 'id_driver')
-                twenty_four_hours_ago = timezone.now() - timedelta(hours=24)
-                recent_events_prefetch = Prefetch(
-                    'ride_events',
-                    queryset=RideEvent.objects.filter(created_at__gte=twenty_four_hours_ago),
-                    to_attr='recent_events'
-                )
-                queryset = queryset.prefetch_related(recent_events_prefetch)
-                
-                # Apply filters
-                queryset = self.filter_queryset(queryset)
-                
-                # Calculate distances and sort
-                rides_with_distance = []
-                for ride in queryset:
-                    distance = calculate_distance(
-                        user_lat, user_lon, 
-                        ride.pickup_latitude, ride.pickup_longitude
-                    )
-                    rides_with_distance.append((ride, distance))
-                
-                rides_with_distance.sort(key=lambda x: x[1])
-                sorted_rides = [ride for ride, _ in rides_with_distance]
-                
-                # Manual pagination
-                page = self.paginate_queryset(sorted_rides)
-                if page is not None:
-                    serializer = self.get_serializer(page, many=True)
-                    return self.get_paginated_response(serializer.data)
-                
-                serializer = self.get_serializer(sorted_rides, many=True)
-                return Response(serializer.data)
-                
-            except ValueError:
-                pass  # Invalid lat/lon values, fall back to normal list
-        
-        # Default list behavior
-        return super().list(request, *args, **kwargs)
+        fields = self.get_ride_fields()
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        if not queryset.ordered:
+            queryset = queryset.order_by('id_ride')
+        rides = iter_ride_rows(queryset, fields)
+
+        renderer = request.accepted_renderer
+        if renderer.format == 'csv':
+            lines = csv_lines(rides, fields)
+        else:
+            lines = ndjson_lines(rides)
+        response = StreamingHttpResponse(buffered(lines), content_type=renderer.media_type)
+        response['Content-Disposition'] = f'attachment; filename="rides.{renderer.format}"'
+        return response
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """
+        Every event of the ride, including those moved to the archive by
+        archive_ride_events, oldest first
+        """
+        ride = self.get_object()
+        events = sorted(
+            [
+                *ArchivedRideEvent.objects.filter(id_ride=ride.pk),
+                *RideEvent.objects.filter(id_ride=ride.pk),
+            ],
+            key=lambda event: (event.created_at, event.id_ride_event),
+        )
+        return Response({
+            'id_ride': ride.pk,
+            'events': RideHistoryEventSerializer(events, many=True).data,
+        })
+
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        """
+        Return the k active (en-route/pickup) rides closest to lat/lon
+
+        Candidates come from the in-memory active ride index; only the k
+        matching rides are loaded from the database.
+        """
+        try:
+            lat = float(request.query_params['lat'])
+            lon = float(request.query_params['lon'])
+        except (KeyError, ValueError):
+            raise ValidationError({'detail': 'lat and lon query parameters are required numbers.'})
+        if not (math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValidationError({'detail': 'lat must be within -90..90 and lon within -180..180.'})
+        try:
+            k = int(request.query_params.get('k', 10))
+        except ValueError:
+            raise ValidationError({'k': 'Must be an integer.'})
+        k = max(1, min(k, 100))
 
+        nearest = active_ride_index.nearest(lat, lon, k)
+        rides = self.get_queryset().in_bulk([id_ride for _, id_ride in nearest])
 
-class RideEventViewSet(viewsets.ModelViewSet):
+        results = []
+        for distance, id_ride in nearest:
+            ride = rides.get(id_ride)
+            if ride is not None:
+                data = self.get_serializer(ride).data
+                data['distance_km'] = distance
+                results.append(data)
+        return Response({'results': results})
+
+    @action(detail=False, methods=['post'], url_path='distance-matrix')
+    def distance_matrix(self, request):
+        """
+        Return the distances in km from each origin to each ride's pickup
+
+        distances_km[i][j] is the distance from origins[i] to ride_ids[j].
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        origins = serializer.validated_data['origins']
+        ride_ids = serializer.validated_data['ride_ids']
+
+        pickups = {
+            id_ride: (lat, lon)
+            for id_ride, lat, lon in Ride.objects.filter(id_ride__in=ride_ids).values_list(
+                'id_ride', 'pickup_latitude', 'pickup_longitude'
+            )
+        }
+        missing = [id_ride for id_ride in ride_ids if id_ride not in pickups]
+        if missing:
+            raise ValidationError({'ride_ids': f'Unknown ride ids: {missing}'})
+
+        matrix = distance_matrix(origins, [pickups[id_ride] for id_ride in ride_ids])
+        return Response({
+            'origins': origins,
+            'ride_ids': ride_ids,
+            'distances_km': matrix.tolist(),
+        })
+
+
+class RideEventViewSet(BulkCreateMixin, viewsets.ModelViewSet):
     """
     ViewSet for RideEvent model
     """
     queryset = RideEvent.objects.all()
     serializer_class = RideEventSerializer
     permission_classes = [IsAdminUser]
+    pagination_class = RideEventPagination
+    bulk_serializer_class = RideEventBulkCreateSerializer
+    filterset_class = RideEventFilter
+
+    def prepare_bulk_instance(self, instance):
+        instance.set_event_type()
+
+
+class ReportViewSet(viewsets.ViewSet):
+    """
+    Read-only reports served from precomputed rollup tables
+    """
+    permission_classes = [IsAdminUser]
+
+    @action(detail=False, methods=['get'], url_path='long-trips')
+    def long_trips(self, request):
+        """
+        Count of trips longer than ?min_hours= (default 1) per month and driver
+
+        Optional ?month_from=, ?month_to= (YYYY-MM) and ?driver= narrow the
+        report. Reads ride_duration only, never ride_event.
+        """
+        params = LongTripsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response({'results': long_trips(**params.validated_data)})
+
+    @action(detail=False, methods=['get'], url_path='driver-daily')
+    def driver_daily(self, request):
+        """
+        Rides per driver and day: counts by status, average distance of
+        non-cancelled rides and cancellation rate
+
+        Optional ?day_from=, ?day_to= (YYYY-MM-DD) and ?driver= narrow the
+        report. Reads driver_daily_stats only, never ride.
+        """
+        params = DriverDailyQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        paginator = ReportPagination()
+        page = paginator.paginate_queryset(driver_daily_stats(**params.validated_data), request, view=self)
+        return paginator.get_paginated_response([driver_daily_row(row) for row in page])
+
+
+class MetricsViewSet(viewsets.ViewSet):
+    """
+    This process's request metrics in the Prometheus text format
+    """
+    permission_classes = [IsAdminUser]
+    renderer_classes = [PrometheusRenderer]
+
+    def list(self, request):
+        """
+        p50/p95/p99 of the SQL query count and of the db, view, serialize,
+        render and total durations per endpoint, plus cache counters
+        """
+        response_stats = response_cache.stats()
+        event_stats = recent_event_cache.stats()
+        counters = [
+            ('rides_response_cache_hits_total', 'Responses served from the response cache', 'counter',
+             response_stats['hits']),
+            ('rides_response_cache_misses_total', 'Responses built because of a response cache miss', 'counter',
+             response_stats['misses']),
+            ('rides_recent_event_cache_hits_total', 'Rides whose recent events came from the cache', 'counter',
+             event_stats['hits']),
+            ('rides_recent_event_cache_misses_total', 'Rides whose recent events were queried', 'counter',
+             event_stats['misses']),
+            ('rides_api_key_cache_entries', 'Verified API keys cached in this process', 'gauge',
+             len(api_key_cache.entries)),
+        ]
+        return Response('\n'.join(prometheus_lines(endpoint_metrics.snapshot(), counters)) + '\n')
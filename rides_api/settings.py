@@ -45,7 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rides.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'rides.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -78,9 +80,11 @@ WSGI_APPLICATION = 'rides_api.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+DB_ENGINE = config('DB_ENGINE', default='django.db.backends.postgresql')
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': DB_ENGINE,
         'NAME': config('DB_NAME', default='wingz_db'),
         'USER': config('DB_USER', default='wingz_user'),
         'PASSWORD': config('DB_PASSWORD', default='wingz_password'),
@@ -89,6 +93,44 @@ DATABASES = {
     }
 }
 
+# Read replicas as host[:port] (or database files for SQLite), e.g.
+# DB_REPLICAS=replica1.internal,replica2.internal:5433. They share the
+# primary's credentials and become the aliases replica_1, replica_2, ...
+for index, replica in enumerate(config('DB_REPLICAS', default='', cast=Csv()), start=1):
+    database = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if DB_ENGINE.endswith('sqlite3'):
+        database['NAME'] = replica
+    else:
+        host, _, port = replica.partition(':')
+        database.update(HOST=host, PORT=port or DATABASES['default']['PORT'])
+    DATABASES[f'replica_{index}'] = database
+
+DATABASE_ROUTERS = ['rides.db_routers.ReplicaRouter']
+
+# Seconds a client that wrote keeps reading from the primary
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=5, cast=int)
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='rides-api'),
+    }
+}
+if CACHES['default']['BACKEND'].endswith('LocMemCache'):
+    # The default of 300 entries is far too small for per-ride cache entries
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=100000, cast=int)}
+
+# Seconds a cached ride list/detail response may be served
+RESPONSE_CACHE_TIMEOUT = config('RESPONSE_CACHE_TIMEOUT', default=60, cast=int)
+
+# Verified API keys each process keeps in memory, and for how many seconds
+API_KEY_CACHE_SIZE = config('API_KEY_CACHE_SIZE', default=10000, cast=int)
+API_KEY_CACHE_TTL = config('API_KEY_CACHE_TTL', default=60, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -137,13 +179,14 @@ AUTH_USER_MODEL = 'rides.User'
 # Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rides.authentication.ApiKeyAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rides.permissions.IsAdminUser',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'rides.pagination.CachedCountPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
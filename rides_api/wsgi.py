@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rides_api.settings')
 
 application = get_wsgi_application()
+
+# Build the nearest-ride index before the first request and keep it fresh,
+# and load the last 24 hours of ride events into the cache
+from rides.cache import recent_event_cache  # noqa: E402
+from rides.spatial_index import active_ride_index  # noqa: E402
+
+active_ride_index.start_refreshing()
+recent_event_cache.start_warming()